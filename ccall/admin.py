@@ -7,14 +7,41 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import Group
 
+from .changelists import LargeTableAdmin
+from .exports import export_filename, stream_csv
 from .models.call import Call
+from .models.call_rollup import CallRollup
 from .models.fund import Fund
 from .models.pledge import Pledge
 from .models.pool import Pool
 from .models.project import Project
 from .models.prospect import Prospect
+from .models.prospect_status import ProspectStatus
+from .models.reservation import Reservation
 from .models.result_code import ResultCode
+from .models.upload_job import UploadJob
 from .models.user import PhonathonUser
+from .search import SEARCH_RESULTS_MAX, prospect_index
+
+
+def export_csv(modeladmin, request, queryset):
+    """Stream the selected objects as CSV, in the upload layout."""
+    return stream_csv(queryset, export_filename(queryset.model))
+
+
+export_csv.short_description = 'Export selected %(verbose_name_plural)s as CSV'
+
+
+def assign_group_action(name):
+    """Admin action moving the selected users to the group name."""
+    def assign_group(modeladmin, request, queryset):
+        user_ids = PhonathonUser.objects.assign_group(
+            queryset, name, replace=PhonathonUser.GROUPS)
+        modeladmin.message_user(
+            request, 'Moved {} user(s) to {}.'.format(len(user_ids), name))
+    assign_group.__name__ = 'assign_group_{}'.format(name.lower())
+    assign_group.short_description = 'Move selected users to {}'.format(name)
+    return assign_group
 
 
 @admin.register(PhonathonUser)
@@ -34,6 +61,15 @@ class PhonathonUserAdmin(UserAdmin):
                            'password1', 'password2')}),
         ('Permissions', {'fields': ('is_active', 'groups')}),
     ]
+    actions = [assign_group_action(name) for name in PhonathonUser.GROUPS]
+
+    def get_actions(self, request):
+        actions = super(PhonathonUserAdmin, self).get_actions(request)
+        if not request.user.is_manager_and_above:
+            # only managers and above change the groups of users
+            for name in PhonathonUser.GROUPS:
+                actions.pop('assign_group_{}'.format(name.lower()), None)
+        return actions
 
     def get_fieldsets(self, request, obj=None):
         fieldsets = super(PhonathonUserAdmin, self).get_fieldsets(
@@ -48,6 +84,7 @@ class PhonathonUserAdmin(UserAdmin):
 class ProspectAdmin(admin.ModelAdmin):
     """Admin interface for model Prospect."""
     list_display = ('nric', 'name', 'phone_home', 'phone_mobile')
+    search_fields = ('nric', 'name', 'email', 'phone_digits')
     fieldsets = [
         (None, {'fields': ('nric', 'salutation', 'name', 'gender',
                            'email', 'phone_home', 'phone_mobile')}),
@@ -57,12 +94,25 @@ class ProspectAdmin(admin.ModelAdmin):
                                   'education_degree', 'education_year')}),
     ]
     add_fieldsets = fieldsets
+    actions = [export_csv]
+
+    def get_search_results(self, request, queryset, search_term):
+        """Search Prospects through the search index."""
+        if not search_term.strip():
+            return queryset, False
+        ids = prospect_index(queryset.db).search_ids(
+            search_term, limit=SEARCH_RESULTS_MAX)
+        return queryset.filter(pk__in=ids), False
 
 
 @admin.register(Pledge)
-class PledgeAdmin(admin.ModelAdmin):
+class PledgeAdmin(LargeTableAdmin):
     """Admin interface for model Pledge."""
     list_display = ('prospect', 'pledge_fund', 'pledge_amount', 'pledge_date')
+    list_filter = ('pledge_fund', 'pledge_date')
+    list_select_related = ('prospect', 'pledge_fund')
+    raw_id_fields = ('prospect',)
+    actions = [export_csv]
 
 
 @admin.register(Fund)
@@ -90,9 +140,50 @@ class ResultCodeAdmin(admin.ModelAdmin):
 
 
 @admin.register(Call)
-class CallAdmin(admin.ModelAdmin):
+class CallAdmin(LargeTableAdmin):
     """Admin interface for model Call."""
-    pass
+    list_display = ('call_time', 'prospect', 'caller', 'project', 'pool',
+                    'attempt', 'result_code')
+    list_filter = ('project', 'pool', 'result_code', 'call_time')
+    list_select_related = ('prospect', 'caller', 'project', 'pool',
+                           'result_code')
+    raw_id_fields = ('prospect', 'caller')
+    actions = [export_csv]
+
+
+@admin.register(CallRollup)
+class CallRollupAdmin(admin.ModelAdmin):
+    """Admin interface for model CallRollup."""
+    list_display = ('hour', 'project', 'pool', 'caller', 'calls', 'completed',
+                    'pledges', 'pledge_amount')
+    list_filter = ('project', 'pool')
+    list_select_related = ('project', 'pool', 'caller')
+    date_hierarchy = 'hour'
+
+
+@admin.register(ProspectStatus)
+class ProspectStatusAdmin(admin.ModelAdmin):
+    """Admin interface for model ProspectStatus."""
+    list_display = ('prospect', 'pool', 'attempts', 'last_result_code',
+                    'last_call_time', 'is_complete')
+    list_filter = ('is_complete', 'pool', 'last_result_code')
+    list_select_related = ('prospect', 'pool', 'last_result_code')
+
+
+@admin.register(Reservation)
+class ReservationAdmin(admin.ModelAdmin):
+    """Admin interface for model Reservation."""
+    list_display = ('prospect', 'caller', 'pool', 'attempt', 'expires_at')
+    list_select_related = ('prospect', 'caller', 'pool')
+
+
+@admin.register(UploadJob)
+class UploadJobAdmin(admin.ModelAdmin):
+    """Admin interface for model UploadJob."""
+    list_display = ('__str__', 'user', 'created_at', 'rows_processed',
+                    'rows_created', 'rows_updated', 'rows_skipped',
+                    'rows_merged', 'rows_failed')
+    list_filter = ('status', 'model')
 
 
 # Unregister groups, since groups are automatically populated
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Cache of the authenticated users of app ccall."""
+
+from __future__ import unicode_literals
+
+import copy
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils.crypto import constant_time_compare
+
+# seconds a user is cached for, unless set by settings.USER_CACHE_TIMEOUT
+USER_CACHE_TIMEOUT = 300
+
+
+def user_cache():
+    """The cache backend of the sessions, which also holds the users."""
+    return caches[getattr(settings, 'SESSION_CACHE_ALIAS', 'default')]
+
+
+def shares_user_cache():
+    """
+    Whether the cache of the users is shared by every process. A
+    local-memory cache is not: the other processes would go on serving a
+    user changed in one of them.
+    """
+    return not isinstance(user_cache(), LocMemCache)
+
+
+def session_user_key(session_cookie):
+    """Cache key of the user of a session, by session cookie."""
+    return 'ccall:users:session:{}'.format(
+        hashlib.sha1(session_cookie.encode('utf-8')).hexdigest())
+
+
+def user_version_key(user_id):
+    """Cache key of the version of a user by id."""
+    return 'ccall:users:{}:version'.format(user_id)
+
+
+def get_cached_user(request):
+    """
+    The user of the session of request, from the cache when possible.
+    Users are cached by session with the version of the user, changed by
+    clear_cached_users. A cached user is only trusted at the current
+    version, if the session was authenticated by an enabled backend and
+    with the current password hash of the user, as auth.get_user checks.
+    Otherwise the user is read from the database by auth.get_user, which
+    flushes sessions that no longer verify, and cached with its groups.
+    The password hash is not cached: the session hash derived from it is
+    cached instead, and the password of a cached user is left deferred.
+    """
+    session = request.session
+    user_id = session.get(auth.SESSION_KEY)
+    backend_path = session.get(BACKEND_SESSION_KEY)
+    # the cookie rather than the session key, which signed cookie
+    # sessions compute anew
+    session_cookie = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if user_id is None or not session_cookie or \
+            backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return auth.get_user(request)
+    cache = user_cache()
+    user_key = session_user_key(session_cookie)
+    version_key = user_version_key(user_id)
+    cached = cache.get_many([user_key, version_key])
+    version = cached.get(version_key)
+    if version is None:
+        # never written, or evicted: start a new version
+        cache.add(version_key, uuid.uuid4().hex, None)
+        version = cache.get(version_key)
+    cached_version, auth_hash, user = cached.get(user_key,
+                                                 (None, None, None))
+    if user is not None and cached_version == version and \
+            constant_time_compare(session.get(HASH_SESSION_KEY, ''),
+                                  auth_hash):
+        user.backend = backend_path
+        return user
+    # the version is read first, so a concurrent change reloads
+    user = auth.get_user(request)
+    if user.is_authenticated:
+        # load the groups, so that the role is cached with the user
+        user.role
+        cache.set(user_key, (version, user.get_session_auth_hash(),
+                             without_password(user)),
+                  getattr(settings, 'USER_CACHE_TIMEOUT', USER_CACHE_TIMEOUT))
+    return user
+
+
+def without_password(user):
+    """
+    Copy of user without its password hash, which is deferred: read from
+    the database once accessed, and not written by save.
+    """
+    user = copy.copy(user)
+    user.__dict__.pop('password', None)
+    return user
+
+
+def clear_cached_users(user_ids, using=None):
+    """
+    Start a new version of users by id, so that their cached copies are
+    dropped in every session, now and again once the current transaction
+    commits, so that no request caches their old state in between.
+    """
+    keys = [user_version_key(user_id) for user_id in user_ids]
+    if not keys:
+        return
+    user_cache().delete_many(keys)
+    transaction.on_commit(lambda: user_cache().delete_many(keys), using=using)
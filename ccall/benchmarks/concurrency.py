@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""Concurrent write throughput benchmark for the database profiles."""
+
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.db import (DEFAULT_DB_ALIAS, DatabaseError, close_old_connections,
+                       connections)
+from django.test.utils import override_settings
+
+from . import generators
+from .database import peak_rss_kb, temporary_database
+from ..models.call import Call
+from ..models.pool import Pool
+from ..models.project import Project
+from ..models.prospect import Prospect
+from ..models.result_code import ResultCode
+from ..models.user import PhonathonUser
+from ..utils import UPLOAD_CHUNK_SIZE, chunked
+
+# number of callers writing Calls at once, and Calls written by each
+WRITERS = 60
+WRITES = 20
+# number of Prospects uploaded by a manager while the callers write
+UPLOAD_ROWS = 10000
+# seconds connections are kept open by the persistent PostgreSQL profile
+PERSISTENT_CONN_MAX_AGE = 600
+
+
+def load_writers(writers, writes):
+    """
+    Create a caller per writer, with writes Prospects each to call in a
+    Pool, bypassing the upload managers. Returns the Pool and a list of
+    (caller id, Prospect ids) pairs, one per writer.
+    """
+    project = Project.objects.create(name='Benchmark Project')
+    pool = Pool.objects.create(name='Benchmark Pool', project=project)
+    PhonathonUser.objects.bulk_create(
+        PhonathonUser(username=generators.username(i), name='Caller')
+        for i in range(writers))
+    for batch in chunked(generators.prospect_rows(writers * writes),
+                         UPLOAD_CHUNK_SIZE):
+        Prospect.objects.bulk_create(Prospect(**row) for row in batch)
+    caller_ids = dict(PhonathonUser.objects.values_list('username', 'pk'))
+    prospect_ids = dict(Prospect.objects.values_list('nric', 'pk'))
+    return pool, [
+        (caller_ids[generators.username(i)],
+         [prospect_ids[generators.nric(i * writes + j)]
+          for j in range(writes)])
+        for i in range(writers)]
+
+
+def write_calls(caller_id, prospect_ids, pool, result_code_id, counts,
+                end_request=close_old_connections):
+    """
+    Record a Call by the caller for each Prospect, one request at a time as
+    the calling page does, calling end_request after each. Counts the Calls
+    written, and the ones failed with a database error such as "database is
+    locked", in counts.
+    """
+    for prospect_id in prospect_ids:
+        try:
+            Call.objects.create(
+                caller_id=caller_id, prospect_id=prospect_id,
+                project_id=pool.project_id, pool=pool, attempt=1,
+                result_code_id=result_code_id)
+            counts['writes'] += 1
+        except DatabaseError:
+            counts['errors'] += 1
+        finally:
+            end_request()
+
+
+def upload_prospects(rows, offset, counts):
+    """
+    Upload Prospects, numbered from offset so as not to clash with the
+    Prospects of the writers, counting the ones created in counts.
+    """
+    rows = (dict(row, nric=generators.nric(offset + i))
+            for i, row in enumerate(rows))
+    try:
+        created, _ = Prospect.objects.from_upload(rows)
+        counts['uploaded'] += len(created)
+    except DatabaseError:
+        counts['upload_errors'] += 1
+
+
+def run_thread(target, *args):
+    """Run target in a new thread, with connections of its own."""
+    def run():
+        try:
+            target(*args)
+        finally:
+            connections.close_all()
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+@contextmanager
+def database_profile(settings=None, database=None, using=DEFAULT_DB_ALIAS):
+    """
+    Override settings and the settings of a database for the duration of
+    the block, for every thread.
+    """
+    settings_dict = connections[using].settings_dict
+    saved = {key: settings_dict.get(key) for key in database or {}}
+    settings_dict.update(database or {})
+    try:
+        with override_settings(**(settings or {})):
+            yield
+    finally:
+        settings_dict.update(saved)
+
+
+def database_profiles(using=DEFAULT_DB_ALIAS):
+    """
+    Profiles benchmarked on the configured backend, as (label, settings,
+    database settings) tuples: untuned and tuned PRAGMAs on SQLite, else a
+    connection per request and persistent connections.
+    """
+    vendor = connections[using].vendor
+    if vendor == 'sqlite':
+        return [('sqlite default', {'SQLITE_PRAGMAS': ()}, {}),
+                ('sqlite tuned', {}, {})]
+    conn_max_age = connections[using].settings_dict['CONN_MAX_AGE'] or \
+        PERSISTENT_CONN_MAX_AGE
+    return [('{} CONN_MAX_AGE=0'.format(vendor), {}, {'CONN_MAX_AGE': 0}),
+            ('{} CONN_MAX_AGE={}'.format(vendor, conn_max_age), {},
+             {'CONN_MAX_AGE': conn_max_age})]
+
+
+def run_concurrency_benchmark(writers=WRITERS, writes=WRITES,
+                              upload_rows=UPLOAD_ROWS):
+    """
+    For each database profile, load a fresh database, then have writers
+    callers record writes Calls each while a manager uploads upload_rows
+    Prospects. Returns one result per profile.
+    """
+    results = []
+    for label, settings, database in database_profiles():
+        with database_profile(settings, database), temporary_database():
+            pool, assignments = load_writers(writers, writes)
+            result_code_id = ResultCode.objects.get(
+                result_code='No Answer').pk
+            connections.close_all()
+            counts = [Counter() for _ in range(writers + 1)]
+            start = time.time()
+            threads = [run_thread(upload_prospects,
+                                  generators.prospect_rows(upload_rows),
+                                  writers * writes, counts[-1])]
+            threads.extend(
+                run_thread(write_calls, caller_id, prospect_ids, pool,
+                           result_code_id, thread_counts)
+                for (caller_id, prospect_ids), thread_counts in zip(
+                    assignments, counts))
+            for thread in threads:
+                thread.join()
+            seconds = time.time() - start
+        total = sum(counts, Counter())
+        results.append({
+            'benchmark': 'concurrent writes {}'.format(label),
+            'writers': writers,
+            'writes': total['writes'],
+            'errors': total['errors'],
+            'uploaded': total['uploaded'],
+            'upload_errors': total['upload_errors'],
+            'seconds': round(seconds, 3),
+            'writes_per_second': round(total['writes'] / seconds, 1)
+            if seconds else None,
+            'peak_rss_kb': peak_rss_kb(),
+        })
+    return results
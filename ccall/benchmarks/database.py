@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Temporary databases and measurements for benchmarks."""
+
+from __future__ import unicode_literals
+
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from ..instrumentation import QueryCounter
+
+
+@contextmanager
+def temporary_database(using=DEFAULT_DB_ALIAS):
+    """
+    Point a connection to a fresh, migrated database for the duration of
+    the block: a file in a temporary directory on SQLite, else a test
+    database created and destroyed by the backend. Yields the temporary
+    directory, which is removed afterwards along with everything written to
+    it.
+    """
+    connection = connections[using]
+    work_dir = tempfile.mkdtemp(prefix='phonathon-benchmark-')
+    name = connection.settings_dict['NAME']
+    connection.close()
+    try:
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['NAME'] = os.path.join(
+                work_dir, 'benchmark.sqlite3')
+            call_command('migrate', database=using, verbosity=0,
+                         interactive=False)
+        else:
+            connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False)
+        yield work_dir
+    finally:
+        connection.close()
+        if connection.vendor != 'sqlite' and \
+                connection.settings_dict['NAME'] != name:
+            connection.creation.destroy_test_db(name, verbosity=0)
+        connection.settings_dict['NAME'] = name
+        shutil.rmtree(work_dir)
+
+
+def peak_rss_kb():
+    """
+    Peak resident set size of this process so far, in kilobytes. Runs
+    measured in the same process share it, so benchmarks run each size in
+    a fresh process.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # in bytes on macOS, in kilobytes elsewhere
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+@contextmanager
+def measure(name, rows, results, using=DEFAULT_DB_ALIAS):
+    """
+    Time the block and append its throughput, query counts and the peak
+    RSS of the process at its end.
+    """
+    start = time.time()
+    with QueryCounter(using) as counter:
+        yield
+    seconds = time.time() - start
+    results.append({
+        'benchmark': name,
+        'rows': rows,
+        'seconds': round(seconds, 3),
+        'rows_per_second': round(rows / seconds, 1) if seconds else None,
+        'queries': counter.queries,
+        'queries_per_row': round(counter.queries / rows, 3) if rows else None,
+        'db_seconds': round(counter.seconds, 3),
+        'peak_rss_kb': peak_rss_kb(),
+    })
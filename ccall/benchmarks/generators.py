@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Synthetic CSV data for benchmarks, in the upload formats."""
+
+from __future__ import unicode_literals
+
+import csv
+import io
+import random
+
+SALUTATIONS = ('Dr', 'Mdm', 'Mr', 'Mrs', 'Ms')
+SCHOOLS = ('School of Humanities', 'Nanyang Business School',
+           'School of Computer Science and Engineering')
+DEGREES = ('B.A (Econs)', 'B.BUS', 'B.Eng (Computer Science)')
+
+
+def username(i):
+    """Username of the i-th synthetic caller."""
+    return 'caller{}'.format(i)
+
+
+def nric(i):
+    """NRIC of the i-th synthetic prospect."""
+    return 'S{:07d}Z'.format(i)
+
+
+def fund_name(i):
+    """Name of the i-th synthetic fund."""
+    return 'Fund {}'.format(i)
+
+
+def write_csv(path, rows):
+    """Stream an iterable of dicts to a CSV file, one row at a time."""
+    rows = iter(rows)
+    first = next(rows)
+    with io.open(path, 'w', encoding='utf-8', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, sorted(first))
+        writer.writeheader()
+        writer.writerow(first)
+        for row in rows:
+            writer.writerow(row)
+
+
+def user_rows(count):
+    """Rows for a Caller upload."""
+    for i in range(count):
+        yield {'username': username(i), 'name': 'Caller {}'.format(i),
+               'password': 'password{}'.format(i)}
+
+
+def fund_rows(count):
+    """Rows for a Fund upload."""
+    for i in range(count):
+        yield {'name': fund_name(i)}
+
+
+def prospect_rows(count, seed=0):
+    """Rows for a Prospect or Pool upload."""
+    rand = random.Random(seed)
+    for i in range(count):
+        yield {
+            'nric': nric(i),
+            'salutation': rand.choice(SALUTATIONS),
+            'name': 'Prospect {}'.format(i),
+            'gender': rand.choice('FM'),
+            'email': 'prospect{}@example.com'.format(i),
+            'address_1': '{} Nanyang Avenue'.format(rand.randint(1, 999)),
+            'address_2': '',
+            'address_3': '',
+            'address_postal': '{:06d}'.format(rand.randint(0, 999999)),
+            'phone_home': '6{:07d}'.format(rand.randint(0, 9999999)),
+            'phone_mobile': '9{:07d}'.format(rand.randint(0, 9999999)),
+            'education_school': rand.choice(SCHOOLS),
+            'education_degree': rand.choice(DEGREES),
+            'education_year': str(rand.randint(1950, 2017)),
+        }
+
+
+def pledge_rows(count, prospects, funds, seed=0):
+    """Rows for a Pledge upload, over the first prospects and funds."""
+    rand = random.Random(seed)
+    for i in range(count):
+        yield {
+            'prospect': nric(i % prospects),
+            'pledge_amount': str(rand.choice((20, 50, 100, 250, 1000))),
+            'pledge_fund': fund_name(i % funds),
+            'pledge_date': '{:02d}/{:02d}/2018'.format(
+                rand.randint(1, 28), rand.randint(1, 12)),
+        }
+
+
+def call_rows(count, callers, prospects, project, pool, result_codes,
+              seed=0):
+    """Rows for a Call upload, over the first callers and prospects."""
+    rand = random.Random(seed)
+    for i in range(count):
+        yield {
+            'caller': username(i % callers),
+            'prospect': nric(i % prospects),
+            'project': project,
+            'pool': pool,
+            'attempt': str(i // prospects + 1),
+            'result_code': rand.choice(result_codes),
+            'comment': '',
+        }
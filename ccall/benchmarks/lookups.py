@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Latency benchmark for the Call lookups, with and without indexes."""
+
+from __future__ import unicode_literals
+
+import random
+
+from django.db import connection
+
+from . import generators
+from .database import measure, temporary_database
+from ..models.call import Call
+from ..models.pool import Pool
+from ..models.project import Project
+from ..models.prospect import Prospect
+from ..models.result_code import ResultCode
+from ..models.user import PhonathonUser
+from ..utils import UPLOAD_CHUNK_SIZE, chunked
+
+# the sizes the Call lookups are expected to handle
+SIZES = (1000000,)
+# number of lookups timed per access pattern
+LOOKUPS = 1000
+# number of callers and Prospects per Call of the synthetic Calls
+CALLERS = 60
+CALLS_PER_PROSPECT = 4
+
+
+def load_calls(size, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Insert size synthetic Calls, bypassing the upload managers, with the
+    Prospects and callers they reference. Returns the Calls' natural keys
+    as (caller_id, prospect_id, project_id, pool_id, attempt) tuples.
+    """
+    project = Project.objects.create(name='Benchmark Project')
+    pool = Pool.objects.create(name='Benchmark Pool', project=project)
+    callers = min(size, CALLERS)
+    prospects = max(size // CALLS_PER_PROSPECT, 1)
+    PhonathonUser.objects.bulk_create(
+        PhonathonUser(username=generators.username(i), name='Caller')
+        for i in range(callers))
+    for batch in chunked(generators.prospect_rows(prospects), chunk_size):
+        Prospect.objects.bulk_create(Prospect(**row) for row in batch)
+    caller_ids = dict(PhonathonUser.objects.values_list('username', 'pk'))
+    prospect_ids = dict(Prospect.objects.values_list('nric', 'pk'))
+    result_codes = dict(ResultCode.objects.values_list('result_code', 'pk'))
+    keys = []
+    rows = generators.call_rows(size, callers, prospects, project.name,
+                                pool.name, list(result_codes))
+    for batch in chunked(rows, chunk_size):
+        calls = [Call(caller_id=caller_ids[row['caller']],
+                      prospect_id=prospect_ids[row['prospect']],
+                      project=project, pool=pool,
+                      attempt=int(row['attempt']),
+                      result_code_id=result_codes[row['result_code']])
+                 for row in batch]
+        Call.objects.bulk_create(calls)
+        keys.extend((obj.caller_id, obj.prospect_id, obj.project_id,
+                     obj.pool_id, obj.attempt) for obj in calls)
+    return keys
+
+
+def time_lookups(keys, label, results, lookups=LOOKUPS, seed=0):
+    """
+    Time lookups of random Calls by natural key, of the latest Call of a
+    Prospect in a Pool, and of the latest Calls of a caller, appending one
+    result per access pattern.
+    """
+    sample = random.Random(seed).sample(keys, min(lookups, len(keys)))
+    with measure('natural key {}'.format(label), len(sample), results):
+        for key in sample:
+            Call.objects.get_by_natural_key(*key)
+    with measure('latest call {}'.format(label), len(sample), results):
+        for _, prospect_id, _, pool_id, _ in sample:
+            Call.objects.filter(pool=pool_id, prospect=prospect_id).order_by(
+                '-attempt').values_list('pk', flat=True).first()
+    with measure('caller calls {}'.format(label), len(sample), results):
+        for caller_id, _, _, _, _ in sample:
+            list(Call.objects.filter(caller=caller_id).order_by(
+                '-call_time').values_list('pk', flat=True)[:20])
+
+
+def drop_indexes():
+    """Drop the composite indexes and unique constraint of Call."""
+    with connection.schema_editor() as editor:
+        editor.alter_unique_together(
+            Call, Call._meta.unique_together, [])
+        for index in Call._meta.indexes:
+            editor.remove_index(Call, index)
+
+
+def add_indexes():
+    """Add the composite indexes and unique constraint of Call back."""
+    with connection.schema_editor() as editor:
+        editor.alter_unique_together(
+            Call, [], Call._meta.unique_together)
+        for index in Call._meta.indexes:
+            editor.add_index(Call, index)
+
+
+def run_lookup_benchmark(size, lookups=LOOKUPS):
+    """
+    Load size synthetic Calls into a fresh database, and time the Call
+    lookups without the composite indexes, then with them. Returns one
+    result per access pattern and index state.
+    """
+    results = []
+    with temporary_database():
+        keys = load_calls(size)
+        drop_indexes()
+        time_lookups(keys, 'without indexes', results, lookups)
+        add_indexes()
+        time_lookups(keys, 'with indexes', results, lookups)
+    return results
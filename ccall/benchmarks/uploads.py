@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""Throughput benchmark for the upload managers."""
+
+from __future__ import unicode_literals
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+
+from . import generators
+from .database import measure, temporary_database
+from ..jobs import upload_data
+from ..models.pool import Pool
+from ..models.project import Project
+from ..models.result_code import ResultCode
+from ..utils import UPLOAD_CHUNK_SIZE, read_csv_chunks
+
+# the sizes the upload managers are expected to handle
+SIZES = (1000, 10000, 100000, 1000000)
+# number of callers referenced by the synthetic Calls
+CALLERS = 60
+PROJECT = 'Benchmark Project'
+POOL = 'Benchmark Pool'
+
+
+def upload_file(path, model_string, chunk_size=UPLOAD_CHUNK_SIZE,
+                project=None):
+    """Upload a CSV file chunk by chunk, as the upload worker does."""
+    with open(path, 'rb') as csv_file:
+        for data in read_csv_chunks(File(csv_file), chunk_size):
+            if model_string == 'Pool':
+                Pool.objects.from_upload(project, POOL, data)
+            else:
+                upload_data(data, model_string)
+
+
+def run_upload_benchmark(size, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Upload size synthetic rows of every data type into a fresh database.
+    Returns one result per data type, in upload order.
+    """
+    results = []
+    with temporary_database() as work_dir:
+        project = Project.objects.create(name=PROJECT)
+        result_codes = list(
+            ResultCode.objects.values_list('result_code', flat=True))
+        files = [
+            ('Caller', generators.user_rows(size)),
+            ('Fund', generators.fund_rows(size)),
+            ('Prospect', generators.prospect_rows(size)),
+            ('Pledge', generators.pledge_rows(size, size, size)),
+            ('Pool', generators.prospect_rows(size, seed=1)),
+            ('Call', generators.call_rows(
+                size, min(size, CALLERS), size, PROJECT, POOL,
+                result_codes)),
+        ]
+        for model_string, rows in files:
+            path = os.path.join(work_dir, '{}.csv'.format(model_string))
+            generators.write_csv(path, rows)
+            with measure('upload {}'.format(model_string), size, results):
+                upload_file(path, model_string, chunk_size, project)
+    return results
+
+
+def run_upload_benchmark_process(size, chunk_size=UPLOAD_CHUNK_SIZE,
+                                 real_hashes=False):
+    """
+    Run the upload benchmark of size rows in a fresh Python process, so
+    that the peak RSS reported for its runs owes nothing to other sizes.
+    Returns its results.
+    """
+    output = tempfile.NamedTemporaryFile(suffix='.json', delete=False)
+    output.close()
+    try:
+        subprocess.check_call(
+            [sys.executable, '-m', 'django', 'benchmark_uploads',
+             '--in-process', '--sizes', str(size),
+             '--chunk-size', str(chunk_size), '--output', output.name] +
+            (['--real-hashes'] if real_hashes else []),
+            cwd=settings.BASE_DIR)
+        with open(output.name) as output_file:
+            return json.load(output_file)['results']
+    finally:
+        os.remove(output.name)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Admin change lists for the large tables of app ccall."""
+
+from __future__ import unicode_literals
+
+from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Max
+from django.utils.functional import cached_property
+
+# number of rows above which change lists are counted approximately
+ESTIMATED_COUNT_THRESHOLD = 10000
+# query string parameter holding the last primary key of the previous page
+KEYSET_VAR = 'after'
+
+
+def estimate_count(queryset):
+    """
+    Estimated number of rows of the table of queryset, from the planner
+    statistics where available, else from the largest primary key.
+    """
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class '
+                    'WHERE relname = %s', [table])
+                row = cursor.fetchone()
+                if row and row[0] > 0:
+                    return row[0]
+            elif connection.vendor == 'sqlite':
+                # rows counted by the last ANALYZE, if any
+                cursor.execute(
+                    'SELECT stat FROM sqlite_stat1 WHERE tbl = %s '
+                    'LIMIT 1', [table])
+                row = cursor.fetchone()
+                if row:
+                    return int(row[0].split()[0])
+    except DatabaseError:
+        pass
+    # rows are seldom deleted, so the largest key is close
+    return queryset.model._default_manager.db_manager(
+        queryset.db).aggregate(count=Max('pk'))['count'] or 0
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator counting at most ESTIMATED_COUNT_THRESHOLD rows exactly.
+    Above it, unfiltered lists are counted from the table statistics and
+    filtered ones are reported at the threshold; estimated is then True.
+    """
+    estimated = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list.order_by()
+        count = queryset[:ESTIMATED_COUNT_THRESHOLD + 1].count()
+        if count <= ESTIMATED_COUNT_THRESHOLD:
+            return count
+        self.estimated = True
+        if not queryset.query.where:
+            return max(estimate_count(queryset), count)
+        return count
+
+
+class KeysetChangeList(ChangeList):
+    """
+    Change list paging by primary key instead of OFFSET, in the default
+    ordering by descending primary key. Each page lists the rows below the
+    last key of the previous one, given in the query string, so that later
+    pages cost as little as the first. Lists sorted by another column are
+    paged by OFFSET as usual.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        self.after = request.GET.get(KEYSET_VAR)
+        super(KeysetChangeList, self).__init__(request, *args, **kwargs)
+        # links to filters and sorts start from the first page
+        self.params.pop(KEYSET_VAR, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super(KeysetChangeList, self).get_filters_params(
+            params)
+        lookup_params.pop(KEYSET_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        super(KeysetChangeList, self).get_results(request)
+        self.keyset = ORDER_VAR not in self.params and not self.show_all
+        if not self.keyset:
+            return
+        queryset = self.queryset.order_by('-pk')
+        if self.after:
+            try:
+                queryset = queryset.filter(pk__lt=int(self.after))
+            except ValueError:
+                pass
+        rows = list(queryset[:self.list_per_page + 1])
+        self.result_list = rows[:self.list_per_page]
+        self.first_page_url = self.get_query_string(remove=[KEYSET_VAR]) \
+            if self.after else None
+        self.next_page_url = self.get_query_string(
+            {KEYSET_VAR: rows[-2].pk}) if len(rows) > self.list_per_page \
+            else None
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    ModelAdmin for tables too large to count exactly or page by OFFSET.
+    Subclasses list the related objects shown in list_select_related.
+    """
+    ordering = ('-pk',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    change_list_template = 'admin/keyset_change_list.html'
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
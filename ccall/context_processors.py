@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+"""Context processors for app ccall."""
+
+from __future__ import unicode_literals
+
+from .models.user import PhonathonUser
+
+# roles by upper case name, e.g. ROLES.MANAGER
+ROLES = {name.upper(): role for role, name in PhonathonUser.ROLES.items()}
+
+
+def roles(request):
+    """Add the roles, to compare with user.role in templates."""
+    return {'ROLES': ROLES}
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""CSV exports of the Calls, Pledges and Prospects of app ccall."""
+
+from __future__ import unicode_literals
+
+import csv
+from datetime import date, datetime
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+# number of rows read per query during exports
+EXPORT_CHUNK_SIZE = 2000
+# date format of the Pledge upload
+EXPORT_DATE_FORMAT = r'%d/%m/%Y'
+
+# columns of each export as (CSV header, field lookup) pairs, in the layout
+# accepted by the from_upload managers, with natural keys for relations
+EXPORT_COLUMNS = {
+    'Call': (
+        ('caller', 'caller__username'),
+        ('call_time', 'call_time'),
+        ('prospect', 'prospect__nric'),
+        ('project', 'project__name'),
+        ('pool', 'pool__name'),
+        ('attempt', 'attempt'),
+        ('result_code', 'result_code__result_code'),
+        ('comment', 'comment'),
+        ('pledge_amount', 'pledge_amount'),
+        ('pledge_method', 'pledge_method'),
+        ('pledge_meta', 'pledge_meta'),
+    ),
+    'Pledge': (
+        ('prospect', 'prospect__nric'),
+        ('pledge_amount', 'pledge_amount'),
+        ('pledge_fund', 'pledge_fund__name'),
+        ('pledge_date', 'pledge_date'),
+    ),
+    'Prospect': tuple((name, name) for name in (
+        'nric', 'salutation', 'name', 'gender', 'email', 'address_1',
+        'address_2', 'address_3', 'address_postal', 'phone_home',
+        'phone_mobile', 'education_school', 'education_degree',
+        'education_year')),
+}
+
+
+class Echo(object):
+    """File-like object returning what is written, for streaming CSV."""
+
+    def write(self, value):
+        return value
+
+
+def format_value(value):
+    """A column value as written to the CSV file."""
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return timezone.localtime(value).isoformat() \
+            if timezone.is_aware(value) else value.isoformat()
+    if isinstance(value, date):
+        return value.strftime(EXPORT_DATE_FORMAT)
+    return value
+
+
+def export_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the header, then the rows of queryset in the export layout of its
+    model. Rows are read by ascending primary key, one chunk per query
+    after the last key of the previous chunk, so that memory use and the
+    cost of each query do not grow with the size of the export.
+    """
+    columns = EXPORT_COLUMNS[queryset.model.__name__]
+    yield [header for header, _ in columns]
+    queryset = queryset.order_by('pk').values_list(
+        'pk', *(lookup for _, lookup in columns))
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None \
+            else queryset.filter(pk__gt=last_pk)
+        count = 0
+        for row in chunk[:chunk_size].iterator():
+            last_pk = row[0]
+            count += 1
+            yield [format_value(value) for value in row[1:]]
+        if count < chunk_size:
+            return
+
+
+def stream_csv(queryset, filename, chunk_size=EXPORT_CHUNK_SIZE):
+    """StreamingHttpResponse of the export of queryset as a CSV file."""
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse(
+        (writer.writerow(row) for row in export_rows(queryset, chunk_size)),
+        content_type='text/csv')
+    response['Content-Disposition'] = \
+        'attachment; filename="{}"'.format(filename)
+    return response
+
+
+def write_csv(queryset, csv_file, chunk_size=EXPORT_CHUNK_SIZE):
+    """Write the export of queryset to a text file. Returns the row count."""
+    writer = csv.writer(csv_file)
+    count = -1
+    for row in export_rows(queryset, chunk_size):
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def export_filename(model):
+    """Name of an export file of model, stamped with the current time."""
+    return '{}_{}.csv'.format(
+        model._meta.model_name,
+        timezone.localtime(timezone.now()).strftime('%Y%m%d_%H%M%S'))
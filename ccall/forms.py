@@ -5,16 +5,18 @@ from __future__ import unicode_literals
 
 from django import forms
 
+from .models.call import Call
 from .models.pool import Pool
+from .models.upload_job import UploadJob
 
 
 class UploadForm(forms.Form):
     """Form to handle Caller/Fund/Prospect/Pledge/Call CSV data uploads."""
-    MODEL_USER = 'Caller'
-    MODEL_FUND = 'Fund'
-    MODEL_PROSPECT = 'Prospect'
-    MODEL_PLEDGE = 'Pledge'
-    MODEL_CALL = 'Call'
+    MODEL_USER = UploadJob.MODEL_USER
+    MODEL_FUND = UploadJob.MODEL_FUND
+    MODEL_PROSPECT = UploadJob.MODEL_PROSPECT
+    MODEL_PLEDGE = UploadJob.MODEL_PLEDGE
+    MODEL_CALL = UploadJob.MODEL_CALL
     MODELS = (
         (MODEL_USER, MODEL_USER),
         (MODEL_FUND, MODEL_FUND),
@@ -32,7 +34,30 @@ class UploadPoolForm(forms.ModelForm):
 
     uploaded_file = forms.FileField(
         label='Upload file', allow_empty_file=False)
+    replace = forms.BooleanField(
+        label='Remove Prospects not in file', required=False)
 
     class Meta:
         model = Pool
         exclude = ('prospects', 'max_attempts',)
+
+    def validate_unique(self):
+        # uploading to an existing Pool updates it
+        pass
+
+
+class CallResultForm(forms.ModelForm):
+    """
+    Form to validate a call result submitted by a caller.
+    Related objects are given by natural key, and resolved in bulk by
+    CallManager.from_results.
+    """
+    client_ref = forms.UUIDField(required=False)
+    prospect = forms.CharField(max_length=15)
+    project = forms.CharField(max_length=50)
+    pool = forms.CharField(max_length=50)
+    result_code = forms.CharField(max_length=25)
+
+    class Meta:
+        model = Call
+        fields = ('comment', 'pledge_amount', 'pledge_method', 'pledge_meta')
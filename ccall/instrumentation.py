@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Instrumentation of database access for app ccall."""
+
+from __future__ import unicode_literals
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.utils import CursorWrapper
+
+from .utils import chunked
+
+# uploads in progress and open recorders, per thread
+_local = threading.local()
+
+
+class CountingCursorWrapper(CursorWrapper):
+    """Cursor wrapper reporting each statement to a QueryCounter."""
+
+    def __init__(self, cursor, db, counter):
+        super(CountingCursorWrapper, self).__init__(cursor, db)
+        self.counter = counter
+
+    def execute(self, sql, params=None):
+        start = time.time()
+        try:
+            return super(CountingCursorWrapper, self).execute(sql, params)
+        finally:
+            self.counter.add(time.time() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return super(CountingCursorWrapper, self).executemany(
+                sql, param_list)
+        finally:
+            self.counter.add(time.time() - start)
+
+
+class QueryCounter(object):
+    """
+    Context manager counting the SQL statements run on a connection,
+    and the time spent running them.
+    Unlike CaptureQueriesContext, no statement is kept, so the count is
+    not capped and memory stays flat on large uploads.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.connection = connections[using]
+        self.queries = 0
+        self.seconds = 0.0
+
+    def add(self, seconds):
+        """Record one statement."""
+        self.queries += 1
+        self.seconds += seconds
+
+    def __enter__(self):
+        connection = self.connection
+        # cursors are wrapped whether or not queries are being logged
+        self._saved = {name: connection.__dict__.get(name)
+                       for name in ('make_cursor', 'make_debug_cursor')}
+        make_cursor = connection.make_cursor
+        make_debug_cursor = connection.make_debug_cursor
+        connection.make_cursor = lambda cursor: CountingCursorWrapper(
+            make_cursor(cursor), connection, self)
+        connection.make_debug_cursor = lambda cursor: CountingCursorWrapper(
+            make_debug_cursor(cursor), connection, self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for name, method in self._saved.items():
+            if method is None:
+                delattr(self.connection, name)
+            else:
+                setattr(self.connection, name, method)
+
+
+class UploadMetrics(object):
+    """
+    SQL statements run by one from_upload invocation, in total and per
+    chunk of rows.
+    """
+
+    def __init__(self, name, using=DEFAULT_DB_ALIAS):
+        self.name = name
+        self.counter = QueryCounter(using)
+        self.rows = 0
+        self.chunks = []
+
+    def __str__(self):
+        return '{} upload: {} rows, {} queries'.format(
+            self.name, self.rows, self.queries)
+
+    @property
+    def queries(self):
+        """Statements run by the upload."""
+        return self.counter.queries
+
+    @property
+    def seconds(self):
+        """Time spent running the statements of the upload."""
+        return self.counter.seconds
+
+    @property
+    def queries_per_1000_rows(self):
+        """Statements run per 1,000 uploaded rows."""
+        return self.queries * 1000.0 / self.rows if self.rows else 0.0
+
+    def add_chunk(self, rows, queries, seconds):
+        """Record the statements run for one chunk of rows."""
+        self.rows += rows
+        self.chunks.append(
+            {'rows': rows, 'queries': queries, 'seconds': seconds})
+
+    def to_dict(self):
+        """Counts of the upload, as reported by benchmarks and logs."""
+        return {
+            'name': self.name,
+            'rows': self.rows,
+            'queries': self.queries,
+            'queries_per_1000_rows': round(self.queries_per_1000_rows, 1),
+            'db_seconds': round(self.seconds, 3),
+            'chunks': self.chunks,
+        }
+
+
+def _stack(name):
+    """The list held in the thread-local attribute name."""
+    if not hasattr(_local, name):
+        setattr(_local, name, [])
+    return getattr(_local, name)
+
+
+def instrumented_upload(method):
+    """
+    Decorator for the from_upload method of a manager.
+    The statements run by each invocation are counted, and the resulting
+    UploadMetrics are passed to the open record_uploads blocks. The method
+    is called exactly as before.
+    """
+    @functools.wraps(method)
+    def wrapper(manager, *args, **kwargs):
+        metrics = UploadMetrics(manager.model.__name__, manager.db)
+        uploads = _stack('uploads')
+        uploads.append(metrics)
+        try:
+            with metrics.counter:
+                return method(manager, *args, **kwargs)
+        finally:
+            uploads.remove(metrics)
+            for recorded in _stack('recorders'):
+                recorded.append(metrics)
+    return wrapper
+
+
+def upload_chunks(data, chunk_size):
+    """
+    Yield chunks of data like chunked, recording the rows and statements
+    of each chunk to the uploads in progress on this thread.
+    """
+    for chunk in chunked(data, chunk_size):
+        uploads = list(_stack('uploads'))
+        start = [(metrics.queries, metrics.seconds) for metrics in uploads]
+        try:
+            yield chunk
+        finally:
+            for metrics, (queries, seconds) in zip(uploads, start):
+                metrics.add_chunk(len(chunk), metrics.queries - queries,
+                                  metrics.seconds - seconds)
+
+
+@contextmanager
+def record_uploads():
+    """
+    Collect the UploadMetrics of the uploads finished within the block.
+    Yields a list, filled in order of completion, so an upload nested in
+    another (Prospects within a Pool) comes before the outer one.
+    """
+    recorders = _stack('recorders')
+    recorded = []
+    recorders.append(recorded)
+    try:
+        yield recorded
+    finally:
+        recorders.remove(recorded)
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Background processing of queued uploads for app ccall."""
+
+from __future__ import unicode_literals
+
+import logging
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import DatabaseError, transaction
+
+from .instrumentation import record_uploads
+from .models.call import Call
+from .models.fund import Fund
+from .models.pledge import Pledge
+from .models.pool import Pool
+from .models.project import Project
+from .models.prospect import Prospect
+from .models.result_code import ResultCode
+from .models.upload_job import UploadJob
+from .models.user import PhonathonUser
+from .pgcopy import COPY_CHUNK_SIZE, uses_copy
+from .utils import UPLOAD_CHUNK_SIZE, read_csv_chunks
+
+ccall_log = logging.getLogger('ccall')
+
+# uploads staged with COPY on PostgreSQL, which take much larger chunks
+COPY_MODELS = (UploadJob.MODEL_PROSPECT, UploadJob.MODEL_PLEDGE,
+               UploadJob.MODEL_CALL)
+
+
+# models uploaded by data type, Pools aside
+UPLOAD_MODELS = {
+    UploadJob.MODEL_USER: PhonathonUser,
+    UploadJob.MODEL_FUND: Fund,
+    UploadJob.MODEL_PROSPECT: Prospect,
+    UploadJob.MODEL_PLEDGE: Pledge,
+    UploadJob.MODEL_CALL: Call,
+}
+
+# models whose lookup tables serve the uploads
+LOOKUP_MODELS = (Fund, Pool, Project, ResultCode)
+
+
+def upload_data(data, model_string, stats=None, **kwargs):
+    """
+    Parse the model choice to a Model class and process the data.
+    Extra keyword arguments are passed on to its from_upload.
+    """
+    try:
+        model = UPLOAD_MODELS[model_string]
+    except KeyError:
+        # Upload is not implemented for this model
+        ccall_log.error('Cannot upload %s data', model_string)
+        return [], []
+    return model.objects.from_upload(data, stats=stats, **kwargs)
+
+
+def process_job(job, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Process a claimed UploadJob chunk by chunk, recording progress.
+    The rows of a chunk rejected by the database are counted as failed,
+    and the job goes on with the next chunk.
+    """
+    prospect_ids = set()
+    if job.model in COPY_MODELS and uses_copy(UploadJob.objects):
+        chunk_size = max(chunk_size, COPY_CHUNK_SIZE)
+    options = {}
+    try:
+        job.uploaded_file.open('rb')
+        try:
+            workers = os.cpu_count() or 1
+            if job.model == UploadJob.MODEL_USER and workers > 1:
+                # one pool of processes hashes the passwords of every chunk
+                options = {'workers': workers,
+                           'executor': ProcessPoolExecutor(workers)}
+            for data in read_csv_chunks(job.uploaded_file, chunk_size):
+                stats = Counter()
+                # lookup tables are not loaded within the chunk transaction
+                for model in LOOKUP_MODELS:
+                    model.objects.load_lookup_cache()
+                try:
+                    # a rejected chunk is written not at all
+                    with transaction.atomic(using=UploadJob.objects.db), \
+                            record_uploads() as uploads:
+                        if job.model == UploadJob.MODEL_POOL:
+                            created, updated = Pool.objects.from_upload(
+                                job.project, job.pool_name, data,
+                                stats=stats)
+                        else:
+                            created, updated = upload_data(
+                                data, job.model, stats=stats, **options)
+                except DatabaseError as exc_:
+                    # count the rows of the chunk as failed, and go on
+                    ccall_log.exception(exc_)
+                    ccall_log.error('Cannot process chunk of UploadJob %s',
+                                    job.pk)
+                    job.add_progress(len(data), 0, 0)
+                    continue
+                if job.model == UploadJob.MODEL_POOL:
+                    prospect_ids.update(obj.pk for obj in created + updated)
+                if uploads:
+                    # the outer upload finishes last
+                    ccall_log.debug('Processed chunk of UploadJob %s: %s',
+                                    job.pk, uploads[-1])
+                job.add_progress(len(data), len(created), len(updated),
+                                 stats['skipped'], stats['merged'])
+        finally:
+            job.uploaded_file.close()
+            if 'executor' in options:
+                options['executor'].shutdown()
+        if job.model == UploadJob.MODEL_POOL and job.replace:
+            replace_pool_prospects(job, prospect_ids)
+    except Exception as exc_:
+        ccall_log.exception(exc_)
+        ccall_log.error('Exception encountered on UploadJob: %s', job.pk)
+        job.finish(error=str(exc_))
+        return
+    job.finish()
+    ccall_log.debug('Processed UploadJob %s: %s', job.pk, job.to_dict())
+
+
+def replace_pool_prospects(job, prospect_ids):
+    """Remove the Prospects not in a processed Pool upload from the Pool."""
+    if not prospect_ids:
+        # never empty a Pool because no row of the file could be processed
+        ccall_log.error('Cannot replace Pool %s, no Prospect uploaded',
+                        job.pool_name)
+        return
+    pool_obj = Pool.objects.get_by_natural_key(job.project, job.pool_name)
+    Pool.objects.sync_prospects(pool_obj, prospect_ids, replace=True)
+
+
+def process_queued_jobs(chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Fail the stale UploadJobs, then process queued UploadJobs until none is
+    left. Returns the count processed.
+    """
+    UploadJob.objects.fail_stale()
+    count = 0
+    job = UploadJob.objects.claim()
+    while job is not None:
+        process_job(job, chunk_size)
+        count += 1
+        job = UploadJob.objects.claim()
+    return count
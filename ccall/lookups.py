@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Process-local cache of the small lookup tables of app ccall."""
+
+from __future__ import unicode_literals
+
+import logging
+import uuid
+
+from django.core.cache import cache
+from django.db import connections, models, transaction
+
+ccall_log = logging.getLogger('ccall')
+
+
+class LookupCache(object):
+    """
+    In-memory copy of a small table, keyed by natural key.
+    The table holds the field values of each row rather than objects, so
+    that every lookup builds a fresh object. The table is loaded on first
+    use and reloaded when its version in the cache backend changes, so
+    that writes by other processes are noticed.
+    It is never loaded within a transaction, which may see uncommitted or
+    later rolled back rows. Within a transaction, the table already loaded
+    from committed rows is served, unless the transaction wrote to it.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.version_key = 'ccall:lookups:{}'.format(
+            model._meta.label_lower)
+        self.field_names = [field.attname
+                            for field in model._meta.concrete_fields]
+        self.table = None
+        self.version = None
+
+    def current_version(self):
+        """Version of the table in the cache backend."""
+        version = cache.get(self.version_key)
+        if version is None:
+            # never written, or evicted: start a new version
+            cache.add(self.version_key, uuid.uuid4().hex, None)
+            version = cache.get(self.version_key)
+        return version
+
+    def get_table(self, using):
+        """
+        Dict of natural key to the field values of the object, or None
+        within a transaction if the table is not loaded, out of date, or
+        written by the transaction.
+        """
+        connection = connections[using]
+        dirty = dirty_lookups(connection)
+        version = self.current_version()
+        table = self.table
+        if connection.in_atomic_block:
+            if self.model in dirty or version != self.version:
+                return None
+            return table
+        # the transactions that wrote to the table have ended
+        dirty.discard(self.model)
+        if table is None or version != self.version:
+            manager = self.model._default_manager.db_manager(using)
+            table = {
+                manager.cache_key(obj): tuple(getattr(obj, name)
+                                              for name in self.field_names)
+                for obj in manager.all()}
+            # the version is read first, so a concurrent change reloads
+            self.table, self.version = table, version
+            ccall_log.debug('Loaded %s %s objects into the lookup cache',
+                            len(table), self.model.__name__)
+        return table
+
+    def instance(self, values, using):
+        """A new object of field values from the table, as if loaded."""
+        return self.model.from_db(using, self.field_names, values)
+
+    def invalidate(self, using):
+        """
+        Stop serving the table to the current transaction, and drop it in
+        every process once the transaction commits.
+        """
+        connection = connections[using]
+        if connection.in_atomic_block:
+            dirty_lookups(connection).add(self.model)
+
+        def bump_version():
+            self.table = None
+            cache.set(self.version_key, uuid.uuid4().hex, None)
+        transaction.on_commit(bump_version, using=using)
+
+
+def dirty_lookups(connection):
+    """
+    Set of the models whose table was written by the current transaction
+    of connection, whose lookups are not served from memory.
+    """
+    if not hasattr(connection, 'ccall_dirty_lookups'):
+        connection.ccall_dirty_lookups = set()
+    return connection.ccall_dirty_lookups
+
+
+# lookup caches by model
+_caches = {}
+
+
+def get_lookup_cache(model):
+    """The LookupCache of a model, created on first use."""
+    if model not in _caches:
+        _caches[model] = LookupCache(model)
+    return _caches[model]
+
+
+class CachedLookupManager(models.Manager):
+    """
+    Manager serving natural key lookups of a small table from memory.
+    Subclasses list the fields of the natural key in natural_key_fields.
+    """
+    natural_key_fields = ()
+
+    def cache_key(self, obj):
+        """Natural key of obj, a value for single field keys."""
+        key = tuple(getattr(obj, self.model._meta.get_field(name).attname)
+                    for name in self.natural_key_fields)
+        return key[0] if len(key) == 1 else key
+
+    def lookup_cache(self):
+        """The LookupCache of the model."""
+        return get_lookup_cache(self.model)
+
+    def get_by_natural_key(self, *key):
+        """Get an object by natural key, from memory when possible."""
+        # related objects are given as natural key values by their pk
+        key = tuple(getattr(value, 'pk', value) for value in key)
+        lookup_cache = self.lookup_cache()
+        table = lookup_cache.get_table(self.db)
+        if table is None:
+            return self.get(**dict(zip(self.natural_key_fields, key)))
+        try:
+            values = table[key[0] if len(key) == 1 else key]
+        except KeyError:
+            raise self.model.DoesNotExist(
+                '{} matching query does not exist.'.format(
+                    self.model._meta.object_name))
+        return lookup_cache.instance(values, self.db)
+
+    def in_bulk_by_natural_key(self, keys):
+        """
+        Dict of natural key to object for the existing keys, from memory
+        when possible, else with one query.
+        """
+        keys = set(keys)
+        lookup_cache = self.lookup_cache()
+        table = lookup_cache.get_table(self.db)
+        if table is not None:
+            return {key: lookup_cache.instance(table[key], self.db)
+                    for key in keys if key in table}
+        fields = self.natural_key_fields
+        if len(fields) == 1:
+            lookups = {'{}__in'.format(fields[0]): keys}
+        else:
+            lookups = {'{}__in'.format(field): {key[i] for key in keys}
+                       for i, field in enumerate(fields)}
+        objs = {self.cache_key(obj): obj for obj in self.filter(**lookups)}
+        return {key: objs[key] for key in keys if key in objs}
+
+    def load_lookup_cache(self):
+        """
+        Load the table if out of date, outside of a transaction, so that
+        lookups within the transactions that follow are served from it.
+        """
+        self.lookup_cache().get_table(self.db)
+
+    def clear_lookup_cache(self):
+        """Invalidate the cached table, after writes bypassing signals."""
+        self.lookup_cache().invalidate(self.db)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""Benchmark concurrent writes under each database profile."""
+
+from __future__ import unicode_literals
+
+import json
+import logging
+import platform
+
+import django
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...benchmarks.concurrency import (UPLOAD_ROWS, WRITERS, WRITES,
+                                       run_concurrency_benchmark)
+
+
+class Command(BaseCommand):
+    """Benchmark concurrent writes under each database profile."""
+    help = ('Have callers record Calls concurrently while a manager uploads '
+            'Prospects, in a temporary database of the configured backend, '
+            'and report the write throughput and failed writes of each '
+            'database profile as JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--writers', type=int, default=WRITERS,
+            help='Number of callers writing at once.')
+        parser.add_argument(
+            '--writes', type=int, default=WRITES,
+            help='Number of Calls written by each caller.')
+        parser.add_argument(
+            '--upload-rows', type=int, default=UPLOAD_ROWS,
+            help='Number of Prospects uploaded meanwhile.')
+        parser.add_argument(
+            '--output', help='File to save the results to, as JSON.')
+
+    def handle(self, *args, **options):
+        report = {
+            'date': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'results': [],
+        }
+        # per-row debug logging would dominate the timings
+        ccall_log = logging.getLogger('ccall')
+        level = ccall_log.level
+        ccall_log.setLevel(logging.WARNING)
+        try:
+            results = run_concurrency_benchmark(
+                options['writers'], options['writes'], options['upload_rows'])
+        finally:
+            ccall_log.setLevel(level)
+        for result in results:
+            report['results'].append(result)
+            self.stderr.write(
+                '{benchmark}: {writes_per_second} writes/s, {errors} failed '
+                'writes, {uploaded} Prospects uploaded'.format(**result))
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
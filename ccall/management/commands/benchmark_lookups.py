@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the Call lookups with and without composite indexes."""
+
+from __future__ import unicode_literals
+
+import json
+import platform
+
+import django
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...benchmarks.lookups import LOOKUPS, SIZES, run_lookup_benchmark
+
+
+class Command(BaseCommand):
+    """Benchmark the Call lookups with and without composite indexes."""
+    help = ('Load synthetic Calls into a temporary SQLite database and '
+            'report the latency of the natural key, latest Call and caller '
+            'history lookups, without and with the composite indexes, as '
+            'JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=list(SIZES),
+            help='Number of Calls loaded.')
+        parser.add_argument(
+            '--lookups', type=int, default=LOOKUPS,
+            help='Number of lookups timed per access pattern.')
+        parser.add_argument(
+            '--output', help='File to save the results to, as JSON.')
+
+    def handle(self, *args, **options):
+        report = {
+            'date': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'results': [],
+        }
+        for size in options['sizes']:
+            for result in run_lookup_benchmark(size, options['lookups']):
+                result['calls'] = size
+                report['results'].append(result)
+                self.stderr.write(
+                    '{benchmark} x {calls}: {rows_per_second} lookups/s, '
+                    '{queries_per_row} queries/lookup'.format(**result))
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+        else:
+            self.stdout.write(output)
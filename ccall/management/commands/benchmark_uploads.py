@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the upload managers on synthetic data."""
+
+from __future__ import unicode_literals
+
+import json
+import logging
+import platform
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from ...benchmarks.uploads import (SIZES, run_upload_benchmark,
+                                   run_upload_benchmark_process)
+from ...utils import UPLOAD_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    """Benchmark the upload managers on synthetic data."""
+    help = ('Upload synthetic Caller, Fund, Prospect, Pledge, Pool and Call '
+            'data into a temporary SQLite database and report rows/second, '
+            'peak RSS and queries per row as JSON. Each size runs in a '
+            'fresh process, so that its peak RSS is its own.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=list(SIZES),
+            help='Number of rows uploaded per data type.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=UPLOAD_CHUNK_SIZE,
+            help='Number of rows processed per chunk.')
+        parser.add_argument(
+            '--real-hashes', action='store_true',
+            help='Hash Caller passwords with the configured hashers, '
+                 'instead of a fast insecure one.')
+        parser.add_argument(
+            '--in-process', action='store_true',
+            help='Run every size in this process, rather than each in a '
+                 'fresh one.')
+        parser.add_argument(
+            '--output', help='File to save the results to, as JSON.')
+
+    def handle(self, *args, **options):
+        report = {
+            'date': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'chunk_size': options['chunk_size'],
+            'real_hashes': options['real_hashes'],
+            'results': [],
+        }
+        if not options['in_process']:
+            # each process reports its results to stderr as they come
+            for size in options['sizes']:
+                report['results'].extend(run_upload_benchmark_process(
+                    size, options['chunk_size'], options['real_hashes']))
+            self.write_report(report, options['output'])
+            return
+        if options['real_hashes']:
+            hashers = settings.PASSWORD_HASHERS
+        else:
+            hashers = ['django.contrib.auth.hashers.MD5PasswordHasher']
+        # per-row debug logging would dominate the timings
+        ccall_log = logging.getLogger('ccall')
+        level = ccall_log.level
+        ccall_log.setLevel(logging.WARNING)
+        try:
+            with override_settings(PASSWORD_HASHERS=hashers):
+                for size in options['sizes']:
+                    for result in run_upload_benchmark(
+                            size, options['chunk_size']):
+                        report['results'].append(result)
+                        self.report_result(result)
+        finally:
+            ccall_log.setLevel(level)
+        self.write_report(report, options['output'])
+
+    def report_result(self, result):
+        """Write a one line summary of a result to stderr."""
+        self.stderr.write(
+            '{benchmark} x {rows}: {rows_per_second} rows/s, '
+            '{queries_per_row} queries/row, peak RSS {peak_rss_kb} '
+            'kB'.format(**result))
+
+    def write_report(self, report, output):
+        """Save report as JSON to the output file, else to stdout."""
+        if output:
+            with open(output, 'w') as output_file:
+                output_file.write(json.dumps(report, indent=2) + '\n')
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""Export the Calls, Pledges or Prospects as CSV."""
+
+from __future__ import unicode_literals
+
+import io
+
+from django.core.management.base import BaseCommand
+
+from ...exports import EXPORT_CHUNK_SIZE, EXPORT_COLUMNS, write_csv
+from ...models.call import Call
+from ...models.pledge import Pledge
+from ...models.prospect import Prospect
+
+MODELS = {model.__name__: model for model in (Call, Pledge, Prospect)}
+
+
+class Command(BaseCommand):
+    """Export the Calls, Pledges or Prospects as CSV."""
+    help = ('Export every Call, Pledge or Prospect as CSV, in the layout '
+            'accepted by the uploads, reading the rows in chunks.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=sorted(EXPORT_COLUMNS))
+        parser.add_argument(
+            '--output', help='File to save the export to, else stdout.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+            help='Number of rows read per query.')
+
+    def handle(self, *args, **options):
+        queryset = MODELS[options['model']].objects.all()
+        if options['output']:
+            with io.open(options['output'], 'w', encoding='utf-8',
+                         newline='') as csv_file:
+                count = write_csv(queryset, csv_file, options['chunk_size'])
+        else:
+            count = write_csv(queryset, self.stdout, options['chunk_size'])
+        self.stderr.write('Exported {} {}(s)'.format(count, options['model']))
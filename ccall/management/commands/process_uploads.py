@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""Worker processing queued CSV data uploads."""
+
+from __future__ import unicode_literals
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from ...jobs import process_queued_jobs
+from ...utils import UPLOAD_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    """Worker processing queued CSV data uploads."""
+    help = 'Process queued CSV data uploads, polling the database for jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Process the queued uploads and exit.')
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help='Seconds to wait between polls for new uploads.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=UPLOAD_CHUNK_SIZE,
+            help='Number of rows processed per chunk.')
+
+    def handle(self, *args, **options):
+        while True:
+            count = process_queued_jobs(options['chunk_size'])
+            if count:
+                self.stdout.write('Processed {} upload(s)'.format(count))
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""Rebuild the hourly rollups of the Calls."""
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from ...models.call_rollup import CallRollup
+
+
+class Command(BaseCommand):
+    """Rebuild the hourly rollups of the Calls."""
+    help = 'Rebuild the hourly rollups of the Calls shown on the dashboard.'
+
+    def handle(self, *args, **options):
+        count = CallRollup.objects.rebuild()
+        self.stdout.write('Rebuilt {} rollup(s)'.format(count))
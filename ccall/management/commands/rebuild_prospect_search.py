@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""Rebuild the search index of the Prospects."""
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from ...search import prospect_index
+
+
+class Command(BaseCommand):
+    """Rebuild the search index of the Prospects."""
+    help = 'Rebuild the search index of the Prospects from their columns.'
+
+    def handle(self, *args, **options):
+        count = prospect_index().rebuild()
+        self.stdout.write('Indexed {} Prospect(s)'.format(count))
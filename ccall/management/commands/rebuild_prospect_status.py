@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""Rebuild the status of every Prospect in its Pools."""
+
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from ...models.prospect_status import ProspectStatus
+from ...utils import UPLOAD_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    """Rebuild the status of every Prospect in its Pools."""
+    help = 'Rebuild the status of every Prospect in its Pools from the Calls.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=UPLOAD_CHUNK_SIZE,
+            help='Number of statuses written per query.')
+
+    def handle(self, *args, **options):
+        count = ProspectStatus.objects.rebuild(options['chunk_size'])
+        self.stdout.write('Rebuilt {} status(es)'.format(count))
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""Middleware for app ccall."""
+
+from __future__ import unicode_literals
+
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.utils.functional import SimpleLazyObject
+
+from .auth import get_cached_user, shares_user_cache
+
+
+def get_user(request):
+    """The user of request, looked up once per request."""
+    if not hasattr(request, '_cached_user'):
+        request._cached_user = get_cached_user(request)
+    return request._cached_user
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """
+    AuthenticationMiddleware serving request.user from the cache of
+    authenticated users, so that requests of a signed in caller need not
+    read the user and its groups from the database.
+    Without a cache shared by every process, such as the local-memory
+    cache, users are not cached: AuthenticationMiddleware serves them.
+    """
+
+    def process_request(self, request):
+        if not shares_user_cache():
+            return super(CachedAuthenticationMiddleware,
+                         self).process_request(request)
+        assert hasattr(request, 'session'), (
+            'CachedAuthenticationMiddleware requires the session middleware '
+            'to be installed before it.')
+        request.user = SimpleLazyObject(lambda: get_user(request))
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:21
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ccall', '0008_uploadjob_rows_skipped'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Reservation',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempt', models.PositiveSmallIntegerField(verbose_name='Attempt')),
+                ('reserved_at', models.DateTimeField(auto_now_add=True, verbose_name='Reserved at')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='Expires at')),
+                ('caller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Caller')),
+                ('pool', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ccall.Pool', verbose_name='Pool')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='reservation',
+            name='prospect',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='ccall.Prospect', verbose_name='Prospect'),
+        ),
+    ]
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:23
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_prospect_status(apps, schema_editor):
+    """Build the status of every Prospect in its Pools from the Calls."""
+    Call = apps.get_model('ccall', 'Call')
+    ProspectStatus = apps.get_model('ccall', 'ProspectStatus')
+    db_alias = schema_editor.connection.alias
+    latest = {}
+    for call in Call.objects.using(db_alias).filter(
+            pool__isnull=False).order_by('attempt', 'pk').values(
+                'pool_id', 'prospect_id', 'attempt', 'result_code_id',
+                'call_time', 'result_code__is_complete').iterator():
+        latest[(call['pool_id'], call['prospect_id'])] = call
+    ProspectStatus.objects.using(db_alias).bulk_create([
+        ProspectStatus(
+            pool_id=call['pool_id'], prospect_id=call['prospect_id'],
+            attempts=call['attempt'],
+            last_result_code_id=call['result_code_id'],
+            last_call_time=call['call_time'],
+            is_complete=call['result_code__is_complete'])
+        for call in latest.values()], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ccall', '0009_reservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProspectStatus',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Attempts')),
+                ('last_call_time', models.DateTimeField(null=True, verbose_name='Last call time')),
+                ('is_complete', models.BooleanField(default=False, verbose_name='Complete status')),
+                ('last_result_code', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to='ccall.ResultCode', verbose_name='Last result code')),
+                ('pool', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ccall.Pool', verbose_name='Pool')),
+            ],
+            options={
+                'verbose_name_plural': 'prospect statuses',
+            },
+        ),
+        migrations.AddField(
+            model_name='prospectstatus',
+            name='prospect',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ccall.Prospect', verbose_name='Prospect'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='prospectstatus',
+            unique_together=set([('pool', 'prospect')]),
+        ),
+        migrations.RunPython(build_prospect_status,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ccall', '0010_prospectstatus'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='call',
+            name='client_ref',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True, verbose_name='Client reference'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:34
+from __future__ import unicode_literals
+
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def build_call_rollups(apps, schema_editor):
+    """Build the hourly rollups of the Calls."""
+    Call = apps.get_model('ccall', 'Call')
+    CallRollup = apps.get_model('ccall', 'CallRollup')
+    db_alias = schema_editor.connection.alias
+    rollups = {}
+    for call in Call.objects.using(db_alias).values(
+            'call_time', 'project_id', 'pool_id', 'caller_id',
+            'result_code__is_complete', 'pledge_amount').iterator():
+        hour = call['call_time'].astimezone(timezone.utc).replace(
+            minute=0, second=0, microsecond=0)
+        key = (hour, call['project_id'], call['pool_id'], call['caller_id'])
+        if key not in rollups:
+            rollups[key] = CallRollup(
+                hour=hour, project_id=call['project_id'],
+                pool_id=call['pool_id'], caller_id=call['caller_id'])
+        rollup = rollups[key]
+        rollup.calls += 1
+        rollup.completed += bool(call['result_code__is_complete'])
+        if call['pledge_amount']:
+            rollup.pledges += 1
+            rollup.pledge_amount += call['pledge_amount']
+    CallRollup.objects.using(db_alias).bulk_create(
+        rollups.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ccall', '0011_call_client_ref'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CallRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(verbose_name='Hour')),
+                ('calls', models.PositiveIntegerField(default=0, verbose_name='Calls')),
+                ('completed', models.PositiveIntegerField(default=0, verbose_name='Completed calls')),
+                ('pledges', models.PositiveIntegerField(default=0, verbose_name='Pledges')),
+                ('pledge_amount', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=14, verbose_name='Pledge amount')),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True, verbose_name='Updated at')),
+                ('caller', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Caller')),
+                ('pool', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='ccall.Pool', verbose_name='Pool')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ccall.Project', verbose_name='Project')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='call',
+            name='call_time',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Time'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='callrollup',
+            unique_together=set([('hour', 'project', 'pool', 'caller')]),
+        ),
+        migrations.RunPython(build_call_rollups,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:36
+from __future__ import unicode_literals
+
+import logging
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+ccall_log = logging.getLogger('ccall')
+
+
+def remove_duplicate_calls(apps, schema_editor):
+    """
+    Delete the Calls repeating the natural key of an earlier one, so that
+    the unique constraint can be added.
+    """
+    Call = apps.get_model('ccall', 'Call')
+    db_alias = schema_editor.connection.alias
+    key = ('caller', 'prospect', 'project', 'pool', 'attempt')
+    duplicates = Call.objects.using(db_alias).filter(
+        pool__isnull=False).values(*key).annotate(
+            count=Count('pk'), first=Min('pk')).filter(
+                count__gt=1).order_by()
+    removed = 0
+    for row in duplicates.iterator():
+        first = row.pop('first')
+        row.pop('count')
+        count, _ = Call.objects.using(db_alias).filter(**row).exclude(
+            pk=first).delete()
+        removed += count
+    if removed:
+        ccall_log.warning(
+            'Removed %s duplicate Calls, run rebuild_prospect_status and '
+            'rebuild_call_rollups', removed)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ccall', '0012_callrollup'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_calls,
+                             migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='call',
+            unique_together=set([('caller', 'prospect', 'project', 'pool', 'attempt')]),
+        ),
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(fields=['pool', 'prospect', 'attempt'], name='ccall_call_pool_attempt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='call',
+            index=models.Index(fields=['caller', 'call_time'], name='ccall_call_caller_time_idx'),
+        ),
+    ]
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:39
+from __future__ import unicode_literals
+
+import logging
+import re
+from itertools import islice
+
+from django.db import (
+    OperationalError, connections, migrations, models, transaction)
+from django.db.models import Case, Value, When
+
+ccall_log = logging.getLogger('ccall')
+
+# frozen copies of ccall.search and ccall.utils, as of this migration
+FTS_TABLE = 'ccall_prospect_search'
+FTS_COLUMNS = ('nric', 'name', 'email', 'phones')
+# Prospects whose phone digits are written per UPDATE
+BACKFILL_CHUNK_SIZE = 500
+
+# Prospect columns with a trigram index on PostgreSQL, and their expression
+TRIGRAM_INDEXES = (
+    ('nric', 'UPPER("nric"::text)'),
+    ('name', 'UPPER("name"::text)'),
+    ('email', 'UPPER("email"::text)'),
+    ('phone_digits', '"phone_digits"'),
+)
+
+
+def normalize_phone(value):
+    """Digits of a phone number, without the Singapore country code."""
+    digits = re.sub(r'\D', '', value or '')
+    if len(digits) > 8 and digits.startswith('65'):
+        digits = digits[2:]
+    return digits
+
+
+def phone_digits(*phones):
+    """Normalised digits of phone numbers, space separated."""
+    return ' '.join(digits for digits in map(normalize_phone, phones)
+                    if digits)
+
+
+def chunked(iterable, size):
+    """Yield successive lists of at most size items from iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bulk_update(queryset, objs, fields):
+    """
+    Write fields of saved objs back to the database.
+    Uses one UPDATE ... SET field = CASE pk WHEN ... per batch of objs.
+    """
+    if not objs or not fields:
+        return
+    opts = queryset.model._meta
+    fields = [opts.get_field(name) for name in fields]
+    # one pk and one value per field per object, plus the pk IN (...) list
+    batch_size = connections[queryset.db].ops.bulk_batch_size(
+        [opts.pk] * (2 * len(fields) + 1), objs)
+    for batch in chunked(objs, max(batch_size, 1)):
+        values = {}
+        for field in fields:
+            whens = [When(pk=obj.pk, then=Value(field.pre_save(obj, False),
+                                                output_field=field))
+                     for obj in batch]
+            values[field.name] = Case(*whens, output_field=field)
+        queryset.filter(pk__in=[obj.pk for obj in batch]).update(**values)
+
+
+def build_search_index(apps, schema_editor):
+    """
+    Fill the phone digits of the Prospects, and build their search index:
+    a FTS5 table on SQLite, trigram indexes on PostgreSQL.
+    """
+    Prospect = apps.get_model('ccall', 'Prospect')
+    db_alias = schema_editor.connection.alias
+    vendor = schema_editor.connection.vendor
+    prospects = Prospect.objects.using(db_alias)
+    with_phones = prospects.exclude(phone_home='', phone_mobile='').only(
+        'phone_home', 'phone_mobile')
+    for chunk in chunked(with_phones.iterator(), BACKFILL_CHUNK_SIZE):
+        for prospect in chunk:
+            prospect.phone_digits = phone_digits(prospect.phone_home,
+                                                 prospect.phone_mobile)
+        bulk_update(prospects, chunk, ['phone_digits'])
+    if vendor == 'sqlite':
+        try:
+            with transaction.atomic(using=db_alias):
+                schema_editor.execute(
+                    "CREATE VIRTUAL TABLE {} USING fts5({}, "
+                    "prefix='2 3 4')".format(FTS_TABLE,
+                                             ', '.join(FTS_COLUMNS)))
+        except OperationalError:
+            ccall_log.warning('SQLite has no FTS5, Prospects are searched '
+                              'without an index')
+            return
+        schema_editor.execute(
+            'INSERT INTO {} (rowid, {}) SELECT id, nric, name, email, '
+            'phone_digits FROM ccall_prospect'.format(
+                FTS_TABLE, ', '.join(FTS_COLUMNS)))
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for field, expression in TRIGRAM_INDEXES:
+            schema_editor.execute(
+                'CREATE INDEX ccall_prospect_{}_trgm ON ccall_prospect '
+                'USING gin (({}) gin_trgm_ops)'.format(field, expression))
+
+
+def drop_search_index(apps, schema_editor):
+    """Drop the search index of the Prospects."""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS {}'.format(FTS_TABLE))
+    elif vendor == 'postgresql':
+        for field, _ in TRIGRAM_INDEXES:
+            schema_editor.execute(
+                'DROP INDEX IF EXISTS ccall_prospect_{}_trgm'.format(field))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ccall', '0013_call_natural_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prospect',
+            name='phone_digits',
+            field=models.CharField(blank=True, editable=False, max_length=17, verbose_name='Phone digits'),
+        ),
+        migrations.RunPython(build_search_index, drop_search_index),
+    ]
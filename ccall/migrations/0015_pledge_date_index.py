@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ccall', '0014_prospect_search'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pledge',
+            name='pledge_date',
+            field=models.DateField(db_index=True, verbose_name='Pledge date'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 13:20
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def delete_poolless_rollups(apps, schema_editor):
+    """Delete the rollups of Calls left without a Pool."""
+    CallRollup = apps.get_model('ccall', 'CallRollup')
+    db_alias = schema_editor.connection.alias
+    CallRollup.objects.using(db_alias).filter(pool__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ccall', '0015_pledge_date_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_poolless_rollups,
+                             migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='callrollup',
+            name='pool',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ccall.Pool', verbose_name='Pool'),
+        ),
+    ]
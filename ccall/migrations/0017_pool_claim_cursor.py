@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 13:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ccall', '0016_callrollup_pool_not_null'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pool',
+            name='claim_cursor',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Claim cursor'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 13:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def set_heartbeats(apps, schema_editor):
+    """Date the heartbeat of the running UploadJobs from their start."""
+    UploadJob = apps.get_model('ccall', 'UploadJob')
+    db_alias = schema_editor.connection.alias
+    UploadJob.objects.using(db_alias).filter(status='Running').update(
+        heartbeat_at=F('started_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ccall', '0017_pool_claim_cursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last heartbeat'),
+        ),
+        migrations.RunPython(set_heartbeats, migrations.RunPython.noop),
+    ]
@@ -4,15 +4,25 @@
 from __future__ import unicode_literals
 
 import logging
+from collections import Counter, OrderedDict
 
 from django.core.validators import MinValueValidator
-from django.db import IntegrityError, models, transaction
+from django.db import connections, models, router, transaction
+from django.db.models import Max
+from django.utils import timezone
 
+from ..instrumentation import instrumented_upload, upload_chunks
+from ..models.call_rollup import CallRollup
 from ..models.pool import Pool
 from ..models.project import Project
 from ..models.prospect import Prospect
+from ..models.prospect_status import ProspectStatus
 from ..models.result_code import ResultCode
 from ..models.user import PhonathonUser
+from ..pgcopy import (COPY_CHUNK_SIZE, INVALID_VALUE_ERRORS, StagingTable,
+                      db_value, uses_copy)
+from ..utils import (UPLOAD_CHUNK_SIZE, bulk_create_rows, bulk_update_rows,
+                     count_merged, diff_row, null_blanks)
 
 ccall_log = logging.getLogger('ccall')
 
@@ -27,70 +37,342 @@ class CallManager(models.Manager):
                         pool=pool,
                         attempt=attempt)
 
-    def from_upload(self, data):
-        """Process data from Call upload."""
+    @instrumented_upload
+    def from_upload(self, data, chunk_size=UPLOAD_CHUNK_SIZE, stats=None):
+        """
+        Process data from Call upload.
+        Natural keys are resolved per chunk with one query per referenced
+        model (none for the lookup tables once cached), and existing Calls
+        are matched with one query per chunk.
+        Unchanged Calls are not written, and counted in stats['skipped'].
+        Repeated rows of a created Call are counted in stats['merged'].
+        On PostgreSQL, the rows are staged with COPY instead, see
+        _copy_upload.
+        """
+        if uses_copy(self):
+            return self._copy_upload(data, stats)
         created = []
         updated = []
+        for chunk in upload_chunks(data, chunk_size):
+            chunk_created, chunk_updated = self._upload_chunk(chunk, stats)
+            created.extend(chunk_created)
+            updated.extend(chunk_updated)
+        return created, updated
+
+    def _upload_chunk(self, data, stats):
+        """Process one chunk of data from Call upload."""
+        # resolve caller, prospect, project, pool, result code in bulk
+        callers = {obj.username: obj for obj in PhonathonUser.objects.filter(
+            username__in={obj.get('caller') for obj in data})}
+        prospects = {obj.nric: obj for obj in Prospect.objects.filter(
+            nric__in={obj.get('prospect') for obj in data})}
+        projects = Project.objects.in_bulk_by_natural_key(
+            obj.get('project') for obj in data)
+        pools = Pool.objects.in_bulk_by_natural_key(
+            (projects[obj['project']].pk, obj.get('pool')) for obj in data
+            if obj.get('project') in projects)
+        result_codes = ResultCode.objects.in_bulk_by_natural_key(
+            obj.get('result_code') for obj in data)
+
+        resolved = []
         for obj in data:
             try:
                 # get caller, prospect, project, pool, result code
-                obj['caller'] = PhonathonUser.objects.get_by_natural_key(
-                    obj['caller'])
-                obj['prospect'] = Prospect.objects.get_by_natural_key(
-                    obj['prospect'])
-                obj['project'] = Project.objects.get_by_natural_key(
-                    obj['project'])
-                obj['pool'] = Pool.objects.get_by_natural_key(
-                    obj['project'], obj['pool'])
-                obj['result_code'] = ResultCode.objects.get_by_natural_key(
-                    obj['result_code'])
-                args = (obj['caller'], obj['prospect'], obj['project'],
-                        obj['pool'], obj['attempt'])
-                call_obj = self.get_by_natural_key(*args)
-                # update Call
-                update_obj = {}
-                for attr, value in obj.items():
-                    if value != getattr(call_obj, attr):
-                        setattr(call_obj, attr, value)
-                        update_obj[attr] = value
-                updated.append(call_obj)
-                ccall_log.debug('Updated Call object %s: %s',
-                                str(call_obj), update_obj)
-            except PhonathonUser.DoesNotExist:
-                # no caller
-                ccall_log.error(
-                    'Cannot create Call object, no PhonathonUser: %s', obj)
-            except Prospect.DoesNotExist:
-                # no prospect
-                ccall_log.error(
-                    'Cannot create Call object, no Prospect: %s', obj)
-            except Project.DoesNotExist:
-                # no project
-                ccall_log.error(
-                    'Cannot create Call object, no Project: %s', obj)
-            except Pool.DoesNotExist:
-                # no pool
-                ccall_log.error(
-                    'Cannot create Call object, no Pool: %s', obj)
-            except ResultCode.DoesNotExist:
-                # no result code
+                if obj['caller'] not in callers:
+                    ccall_log.error(
+                        'Cannot create Call object, no PhonathonUser: %s', obj)
+                    continue
+                obj['caller'] = callers[obj['caller']]
+                if obj['prospect'] not in prospects:
+                    ccall_log.error(
+                        'Cannot create Call object, no Prospect: %s', obj)
+                    continue
+                obj['prospect'] = prospects[obj['prospect']]
+                if obj['project'] not in projects:
+                    ccall_log.error(
+                        'Cannot create Call object, no Project: %s', obj)
+                    continue
+                obj['project'] = projects[obj['project']]
+                pool_key = (obj['project'].pk, obj['pool'])
+                if pool_key not in pools:
+                    ccall_log.error(
+                        'Cannot create Call object, no Pool: %s', obj)
+                    continue
+                obj['pool'] = pools[pool_key]
+                if obj['result_code'] not in result_codes:
+                    ccall_log.error(
+                        'Cannot create Call object, no ResultCode: %s', obj)
+                    continue
+                obj['result_code'] = result_codes[obj['result_code']]
+                key = (obj['caller'].pk, obj['prospect'].pk,
+                       obj['project'].pk, obj['pool'].pk, int(obj['attempt']))
+                resolved.append((key, obj))
+            except BaseException as exc_:
+                ccall_log.exception(exc_)
                 ccall_log.error(
-                    'Cannot create Call object, no ResultCode: %s', obj)
-            except Call.DoesNotExist:
-                # create Call
-                try:
-                    with transaction.atomic():
-                        call_obj = self.create(** obj)
-                    created.append(call_obj)
-                    ccall_log.debug('Created Call object: %s', obj)
-                except IntegrityError:
-                    ccall_log.error('Cannot create Call object: %s', obj)
+                    'Exception encountered on Call object: %s', obj)
+        if not resolved:
+            return [], []
+
+        # match existing calls by natural key
+        keys = [key for key, _ in resolved]
+        existing = {
+            (call_obj.caller_id, call_obj.prospect_id, call_obj.project_id,
+             call_obj.pool_id, call_obj.attempt): call_obj
+            for call_obj in self.filter(
+                caller__in={key[0] for key in keys},
+                prospect__in={key[1] for key in keys},
+                project__in={key[2] for key in keys},
+                pool__in={key[3] for key in keys},
+                attempt__in={key[4] for key in keys})}
+
+        updated = []
+        changes = []
+        skipped = 0
+        pending = OrderedDict()
+        repeats = Counter()
+        for key, obj in resolved:
+            try:
+                if key in existing:
+                    # update Call, unless unchanged
+                    call_obj = existing[key]
+                    update_obj = diff_row(call_obj, obj)
+                    if update_obj:
+                        changes.append((call_obj, update_obj))
+                        ccall_log.debug('Updated Call object %s: %s',
+                                        key, update_obj)
+                    else:
+                        skipped += 1
+                    updated.append(call_obj)
+                elif key in pending:
+                    # repeated row for a Call created in this chunk
+                    for attr, value in null_blanks(self.model, obj).items():
+                        setattr(pending[key][0], attr, value)
+                    repeats[key] += 1
+                else:
+                    # create Call
+                    pending[key] = (self.model(**null_blanks(self.model, obj)),
+                                    obj)
             except BaseException as exc_:
                 ccall_log.exception(exc_)
                 ccall_log.error(
                     'Exception encountered on Call object: %s', obj)
+        created = []
+        failed = set()
+        if changes or pending:
+            with transaction.atomic(using=self.db):
+                failed = bulk_update_rows(self, changes)
+                created = bulk_create_rows(self, list(pending.values()))
+                # keep the status of the Prospects in their Pools, and the
+                # hourly rollups, in step
+                ProspectStatus.objects.db_manager(self.db).refresh(
+                    [(obj.pool_id, obj.prospect_id) for obj in created] +
+                    [(obj.pool_id, obj.prospect_id) for obj, _ in changes
+                     if obj.pk not in failed])
+                CallRollup.objects.db_manager(self.db).refresh_calls(
+                    created + [obj for obj, _ in changes
+                               if obj.pk not in failed])
+        if failed:
+            updated = [obj for obj in updated if obj.pk not in failed]
+        if stats is not None:
+            stats['skipped'] += skipped
+            stats['merged'] += count_merged(pending, repeats, created)
         return created, updated
 
+    def _copy_upload(self, data, stats):
+        """
+        Process data from Call upload through a staging table filled with
+        COPY. Natural keys are resolved with one UPDATE of the staging table,
+        then the Calls are merged with one INSERT ... ON CONFLICT on the
+        natural key. The last of repeated rows wins, and unchanged Calls are
+        not written.
+        """
+        connection = connections[self.db]
+        opts = self.model._meta
+        keys = ('caller', 'prospect', 'project', 'pool', 'result_code')
+        fields = [opts.get_field(name) for name in (
+            'attempt', 'comment', 'pledge_amount', 'pledge_method',
+            'pledge_meta')]
+        field_names = {field.name for field in opts.fields}
+        quote = connection.ops.quote_name
+        uploaded = set()
+        with transaction.atomic(using=self.db), StagingTable(
+                connection, 'ccall_call_staging',
+                [(key, 'text') for key in keys] +
+                [(field.column, field.db_type(connection))
+                 for field in fields],
+                resolved=[(opts.get_field(key).column, 'integer')
+                          for key in keys]) as staging:
+            for chunk in upload_chunks(data, COPY_CHUNK_SIZE):
+                rows = []
+                for obj in chunk:
+                    if not field_names.issuperset(obj):
+                        ccall_log.error(
+                            'Cannot create Call object, unknown fields: %s',
+                            obj)
+                        continue
+                    try:
+                        rows.append([obj[key] for key in keys] + [
+                            db_value(field, obj[field.name]
+                                     if field.name in obj or
+                                     field.name == 'attempt'
+                                     else field.get_default(), connection)
+                            for field in fields])
+                        uploaded.update(obj)
+                    except (KeyError,) + INVALID_VALUE_ERRORS:
+                        ccall_log.error(
+                            'Cannot create Call object, invalid values: %s',
+                            obj)
+                staging.copy(rows)
+
+            staging.execute(
+                'UPDATE {{staging}} AS s SET caller_id = u.id, '
+                'prospect_id = p.id, project_id = pr.id, pool_id = po.id, '
+                'result_code_id = r.id '
+                'FROM {user} AS u, {prospect} AS p, {project} AS pr, '
+                '{pool} AS po, {result_code} AS r '
+                'WHERE u.username = s.caller AND p.nric = s.prospect '
+                'AND pr.name = s.project AND po.project_id = pr.id '
+                'AND po.name = s.pool '
+                'AND r.result_code = s.result_code'.format(
+                    user=quote(PhonathonUser._meta.db_table),
+                    prospect=quote(Prospect._meta.db_table),
+                    project=quote(Project._meta.db_table),
+                    pool=quote(Pool._meta.db_table),
+                    result_code=quote(ResultCode._meta.db_table)))
+            unresolved = staging.execute(
+                'SELECT caller, prospect, project, pool, result_code, '
+                'attempt FROM {staging} WHERE caller_id IS NULL '
+                'ORDER BY _row')
+            for row in unresolved:
+                ccall_log.error(
+                    'Cannot create Call object, no PhonathonUser, Prospect, '
+                    'Project, Pool or ResultCode: %s',
+                    dict(zip(keys + ('attempt',), row)))
+
+            natural_key = ('caller_id, prospect_id, project_id, pool_id, '
+                           'attempt')
+            columns = ['result_code_id'] + [
+                quote(field.column) for field in fields[1:]]
+            changed = ['result_code_id'] + [
+                quote(field.column) for field in fields[1:]
+                if field.name in uploaded]
+            written = dict(staging.execute(
+                'INSERT INTO {table} ({key}, {columns}, call_time) '
+                'SELECT DISTINCT ON ({key}) {key}, {columns}, %s '
+                'FROM {{staging}} WHERE caller_id IS NOT NULL '
+                'ORDER BY {key}, _row DESC '
+                'ON CONFLICT ({key}) DO UPDATE SET {changes} '
+                'WHERE ({current}) IS DISTINCT FROM ({new}) '
+                'RETURNING id, xmax = 0'.format(
+                    table=quote(opts.db_table), key=natural_key,
+                    columns=', '.join(columns),
+                    changes=', '.join('{0} = EXCLUDED.{0}'.format(column)
+                                      for column in changed),
+                    current=', '.join('{}.{}'.format(
+                        quote(opts.db_table), column) for column in changed),
+                    new=', '.join('EXCLUDED.{}'.format(column)
+                                  for column in changed)),
+                [timezone.now()]))
+            matched = list(self.raw(staging.format(
+                'SELECT * FROM {table} WHERE ({key}) IN '
+                '(SELECT {key} FROM {{staging}} '
+                'WHERE caller_id IS NOT NULL)'.format(
+                    table=quote(opts.db_table), key=natural_key))))
+            created = [obj for obj in matched if written.get(obj.pk)]
+            updated = [obj for obj in matched if not written.get(obj.pk)]
+            # keep the status of the Prospects in their Pools, and the
+            # hourly rollups, in step
+            changes = [obj for obj in matched if obj.pk in written]
+            ProspectStatus.objects.db_manager(self.db).refresh(
+                [(obj.pool_id, obj.prospect_id) for obj in changes])
+            CallRollup.objects.db_manager(self.db).refresh_calls(changes)
+        if stats is not None:
+            stats['skipped'] += len(matched) - len(written)
+            # resolved rows sharing a natural key
+            stats['merged'] += staging.rows - len(unresolved) - len(matched)
+        ccall_log.debug('Merged %s Call rows: %s created, %s updated',
+                        staging.rows, len(created),
+                        len(written) - len(created))
+        return created, updated
+
+    def from_results(self, caller, results):
+        """
+        Record call results submitted by a caller, all or none.
+        results is a list of validated dicts with the natural keys of the
+        Prospect, Project, Pool and ResultCode, the Call fields and an
+        optional client_ref. Attempts follow the latest Call of each
+        Prospect in its Pool. Results whose client_ref is already recorded,
+        or repeated within results, are skipped, so that submissions can be
+        retried. Returns the created Calls, in order, and a dict of result
+        index to error, empty unless nothing was written.
+        """
+        prospects = {obj.nric: obj for obj in Prospect.objects.filter(
+            nric__in={obj['prospect'] for obj in results})}
+        projects = Project.objects.in_bulk_by_natural_key(
+            obj['project'] for obj in results)
+        pools = Pool.objects.in_bulk_by_natural_key(
+            (projects[obj['project']].pk, obj['pool']) for obj in results
+            if obj['project'] in projects)
+        result_codes = ResultCode.objects.in_bulk_by_natural_key(
+            obj['result_code'] for obj in results)
+        errors = {}
+        for index, obj in enumerate(results):
+            if obj['prospect'] not in prospects:
+                errors[index] = 'No Prospect {}'.format(obj['prospect'])
+            elif obj['project'] not in projects:
+                errors[index] = 'No Project {}'.format(obj['project'])
+            elif (projects[obj['project']].pk, obj['pool']) not in pools:
+                errors[index] = 'No Pool {}'.format(obj['pool'])
+            elif obj['result_code'] not in result_codes:
+                errors[index] = 'No ResultCode {}'.format(
+                    obj['result_code'])
+        if errors:
+            return [], errors
+
+        with transaction.atomic(using=self.db):
+            recorded = set(self.filter(client_ref__in={
+                obj['client_ref'] for obj in results
+                if obj.get('client_ref')}).values_list(
+                    'client_ref', flat=True))
+            pending = []
+            for obj in results:
+                if obj.get('client_ref') and obj['client_ref'] in recorded:
+                    ccall_log.debug('Skipped recorded Call %s',
+                                    obj['client_ref'])
+                    continue
+                fields = {attr: value for attr, value in obj.items()
+                          if attr not in ('prospect', 'project', 'pool',
+                                          'result_code')}
+                pending.append(self.model(
+                    caller=caller, prospect=prospects[obj['prospect']],
+                    project=projects[obj['project']],
+                    pool=pools[(projects[obj['project']].pk, obj['pool'])],
+                    result_code=result_codes[obj['result_code']],
+                    **fields))
+                if obj.get('client_ref'):
+                    # a client_ref repeated within results is recorded once
+                    recorded.add(obj['client_ref'])
+            if not pending:
+                return [], {}
+            # number the attempts after the latest Call of each Prospect
+            latest = {
+                (row['pool_id'], row['prospect_id']): row['attempt__max']
+                for row in self.filter(
+                    pool__in={obj.pool_id for obj in pending},
+                    prospect__in={obj.prospect_id for obj in pending}).values(
+                        'pool_id', 'prospect_id').annotate(Max('attempt'))}
+            for call_obj in pending:
+                key = (call_obj.pool_id, call_obj.prospect_id)
+                latest[key] = call_obj.attempt = latest.get(key, 0) + 1
+            self.bulk_create(pending)
+            ProspectStatus.objects.db_manager(self.db).refresh(
+                (obj.pool_id, obj.prospect_id) for obj in pending)
+            CallRollup.objects.db_manager(self.db).refresh_calls(pending)
+        ccall_log.debug('Recorded %s Calls by %s', len(pending),
+                        caller.username)
+        return pending, {}
+
 
 class Call(models.Model):
     """Model for a Call."""
@@ -106,7 +388,8 @@ class Call(models.Model):
     )
     caller = models.ForeignKey(
         PhonathonUser, verbose_name='Caller', on_delete=models.CASCADE)
-    call_time = models.DateTimeField(verbose_name='Time', auto_now=True)
+    call_time = models.DateTimeField(
+        verbose_name='Time', auto_now=True, db_index=True)
     prospect = models.ForeignKey(
         Prospect, verbose_name='Prospect', on_delete=models.CASCADE)
     project = models.ForeignKey(
@@ -125,10 +408,55 @@ class Call(models.Model):
         verbose_name='Pledge method', max_length=10,
         choices=METHODS, blank=True)
     pledge_meta = models.TextField(verbose_name='Pledge metadata', blank=True)
+    client_ref = models.UUIDField(
+        verbose_name='Client reference', null=True, blank=True, unique=True,
+        editable=False)
+
+    class Meta:
+        unique_together = ('caller', 'prospect', 'project', 'pool',
+                           'attempt',)
+        indexes = [
+            # latest Call of a Prospect in a Pool
+            models.Index(fields=['pool', 'prospect', 'attempt'],
+                         name='ccall_call_pool_attempt_idx'),
+            # Calls of a caller over time
+            models.Index(fields=['caller', 'call_time'],
+                         name='ccall_call_caller_time_idx'),
+        ]
 
     def __str__(self):
         return '{} - {}'.format(self.prospect, self.caller)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Call, cls).from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        # the status to refresh if the Call is moved to another Pool, and
+        # the rollup to refresh as call_time moves on
+        instance._status_key = (loaded.get('pool_id'),
+                                loaded.get('prospect_id'))
+        instance._rollup_key = (
+            loaded.get('call_time'), loaded.get('project_id'),
+            loaded.get('pool_id'), loaded.get('caller_id'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        Save the Call, and refresh the status of its Prospect in its Pool
+        and the rollups of its hour within the same transaction.
+        """
+        using = kwargs.get('using') or router.db_for_write(
+            Call, instance=self)
+        with transaction.atomic(using=using):
+            super(Call, self).save(*args, **kwargs)
+            keys = {(self.pool_id, self.prospect_id),
+                    getattr(self, '_status_key', (None, None))}
+            ProspectStatus.objects.db_manager(using).refresh(keys)
+            CallRollup.objects.db_manager(using).refresh_calls([self])
+        self._status_key = (self.pool_id, self.prospect_id)
+        self._rollup_key = (self.call_time, self.project_id, self.pool_id,
+                            self.caller_id)
+
     def natural_key(self):
         return (self.caller, self.prospect, self.project,
                 self.pool, self.attempt,)
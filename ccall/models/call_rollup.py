@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-"""
+"""Models for a CallRollup."""
+
+from __future__ import unicode_literals
+
+import logging
+from datetime import timedelta
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, Q, Sum, When
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from ..models.pool import Pool
+from ..models.project import Project
+from ..models.user import PhonathonUser
+from ..utils import UPLOAD_CHUNK_SIZE, bulk_update, chunked
+
+ccall_log = logging.getLogger('ccall')
+
+# fields of the unique key of CallRollup
+ROLLUP_KEY_FIELDS = ('hour', 'project_id', 'pool_id', 'caller_id')
+# counts of CallRollup aggregated from the Calls
+ROLLUP_FIELDS = ('calls', 'completed', 'pledges', 'pledge_amount')
+# how far back of its cursor a dashboard poll looks for updated rollups
+ROLLUP_CURSOR_OVERLAP = timedelta(seconds=10)
+# keys refreshed per query, each of five parameters
+ROLLUP_KEYS_BATCH_SIZE = 100
+
+
+def floor_hour(value):
+    """The start of the UTC hour of a datetime."""
+    return value.astimezone(timezone.utc).replace(
+        minute=0, second=0, microsecond=0)
+
+
+class CallRollupManager(models.Manager):
+    """Custom manager for model CallRollup."""
+
+    def _aggregate(self, calls):
+        """
+        Build unsaved CallRollups from calls, keyed by (hour, project_id,
+        pool_id, caller_id), with one GROUP BY query. Calls left without a
+        Pool, whose Pool was deleted along with its rollups, are not
+        counted.
+        """
+        rows = calls.filter(pool__isnull=False).annotate(
+            call_hour=TruncHour('call_time', tzinfo=timezone.utc)).values(
+                'call_hour', 'project_id', 'pool_id', 'caller_id').annotate(
+                    n_calls=Count('pk'),
+                    n_completed=Count(Case(When(
+                        result_code__is_complete=True, then=1))),
+                    n_pledges=Count(Case(When(pledge_amount__gt=0, then=1))),
+                    total=Sum('pledge_amount')).order_by()
+        rollups = {}
+        for row in rows:
+            obj = self.model(
+                hour=row['call_hour'], project_id=row['project_id'],
+                pool_id=row['pool_id'], caller_id=row['caller_id'],
+                calls=row['n_calls'], completed=row['n_completed'],
+                pledges=row['n_pledges'],
+                pledge_amount=row['total'] or Decimal('0'))
+            rollups[obj.key] = obj
+        return rollups
+
+    def refresh_calls(self, calls):
+        """
+        Refresh the rollups of calls, as saved and, for Calls loaded from
+        the database, as loaded.
+        """
+        keys = set()
+        for call_obj in calls:
+            keys.add((call_obj.call_time, call_obj.project_id,
+                      call_obj.pool_id, call_obj.caller_id))
+            keys.add(getattr(call_obj, '_rollup_key', None))
+        self.refresh(key for key in keys if key is not None)
+
+    def refresh(self, keys):
+        """
+        Recompute the rollups of (hour, project_id, pool_id, caller_id)
+        keys from their Calls, with a fixed number of queries per
+        ROLLUP_KEYS_BATCH_SIZE keys. Only the Calls of those keys are read,
+        after their rollups are locked, so that concurrent refreshes of a
+        key take turns and each counts the Calls committed by the one
+        before. Rollups left without Calls are zeroed rather than deleted,
+        so that pollers see the change.
+        """
+        from ..models.call import Call
+        keys = sorted({(floor_hour(hour), project_id, pool_id, caller_id)
+                       for hour, project_id, pool_id, caller_id in keys
+                       if hour and pool_id is not None})
+        for batch in chunked(keys, ROLLUP_KEYS_BATCH_SIZE):
+            # the locks are held until the outermost transaction ends
+            with transaction.atomic(using=self.db, savepoint=False):
+                # in the order of their ids, so that refreshes do not
+                # deadlock
+                existing = {obj.key: obj for obj in self.select_for_update(
+                    ).filter(reduce(or_, (
+                        Q(**dict(zip(ROLLUP_KEY_FIELDS, key)))
+                        for key in batch))).order_by('pk')}
+                latest = self._aggregate(Call.objects.filter(reduce(or_, (
+                    Q(call_time__gte=hour,
+                      call_time__lt=hour + timedelta(hours=1),
+                      project_id=project_id, pool_id=pool_id,
+                      caller_id=caller_id)
+                    for hour, project_id, pool_id, caller_id in batch))))
+                changed = []
+                for key, obj in existing.items():
+                    new = latest.get(key) or self.model()
+                    if any(getattr(obj, field) != getattr(new, field)
+                           for field in ROLLUP_FIELDS):
+                        for field in ROLLUP_FIELDS:
+                            setattr(obj, field, getattr(new, field))
+                        changed.append(obj)
+                bulk_update(self.all(), changed,
+                            ROLLUP_FIELDS + ('updated_at',))
+                added = [obj for key, obj in latest.items()
+                         if key not in existing]
+                try:
+                    if added:
+                        # waits for a concurrent transaction creating the
+                        # same keys
+                        with transaction.atomic(using=self.db):
+                            self.bulk_create(added)
+                except IntegrityError:
+                    # created concurrently: lock and count them again
+                    self.refresh(obj.key for obj in added)
+
+    def changed_since(self, cursor):
+        """
+        Rollups updated after cursor, a datetime, with their Project, Pool
+        and caller. Rows updated shortly before the cursor are included
+        again, since their transaction may have committed after it was
+        taken; the dashboard applies rows by id, so repeats are harmless.
+        """
+        return self.filter(
+            updated_at__gt=cursor - ROLLUP_CURSOR_OVERLAP).select_related(
+                'project', 'pool', 'caller').order_by('updated_at', 'pk')
+
+    def rebuild(self):
+        """Recompute every rollup from scratch. Returns the number."""
+        from ..models.call import Call
+        with transaction.atomic(using=self.db):
+            self.all().delete()
+            rollups = list(self._aggregate(Call.objects.all()).values())
+            self.bulk_create(rollups, batch_size=UPLOAD_CHUNK_SIZE)
+        ccall_log.debug('Rebuilt %s CallRollup objects', len(rollups))
+        return len(rollups)
+
+
+class CallRollup(models.Model):
+    """
+    Model for the Calls made by a caller in a Pool in one hour.
+    Derived from the Calls, and kept up to date whenever a Call is
+    written. updated_at serves as a cursor for polling dashboards.
+    """
+    objects = CallRollupManager()
+
+    hour = models.DateTimeField(verbose_name='Hour')
+    project = models.ForeignKey(
+        Project, verbose_name='Project', on_delete=models.CASCADE)
+    # not null, so that the unique key holds for every rollup
+    pool = models.ForeignKey(
+        Pool, verbose_name='Pool', on_delete=models.CASCADE)
+    caller = models.ForeignKey(
+        PhonathonUser, verbose_name='Caller', on_delete=models.CASCADE)
+    calls = models.PositiveIntegerField(verbose_name='Calls', default=0)
+    completed = models.PositiveIntegerField(
+        verbose_name='Completed calls', default=0)
+    pledges = models.PositiveIntegerField(verbose_name='Pledges', default=0)
+    pledge_amount = models.DecimalField(
+        verbose_name='Pledge amount', decimal_places=2, max_digits=14,
+        default=Decimal('0'))
+    updated_at = models.DateTimeField(
+        verbose_name='Updated at', auto_now=True, db_index=True)
+
+    class Meta:
+        unique_together = ('hour', 'project', 'pool', 'caller',)
+
+    def __str__(self):
+        return '{} - {} ({:%Y-%m-%d %H:00})'.format(
+            self.pool, self.caller, self.hour)
+
+    @property
+    def key(self):
+        """The (hour, project_id, pool_id, caller_id) of the rollup."""
+        return (self.hour, self.project_id, self.pool_id, self.caller_id)
+
+    def to_dict(self):
+        """Counts of the rollup, as reported to the dashboard."""
+        return {
+            'id': self.pk,
+            'hour': self.hour.isoformat(),
+            'project': self.project.name,
+            'pool': self.pool.name,
+            'caller': self.caller.name,
+            'calls': self.calls,
+            'completed': self.completed,
+            'pledges': self.pledges,
+            'pledge_amount': str(self.pledge_amount),
+        }
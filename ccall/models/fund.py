@@ -4,45 +4,83 @@
 from __future__ import unicode_literals
 
 import logging
+from collections import Counter, OrderedDict
 
-from django.db import IntegrityError, models, transaction
+from django.db import models
+
+from ..instrumentation import instrumented_upload, upload_chunks
+from ..lookups import CachedLookupManager
+from ..utils import (UPLOAD_CHUNK_SIZE, bulk_create_rows, bulk_update_rows,
+                     count_merged, diff_row)
 
 ccall_log = logging.getLogger('ccall')
 
 
-class FundManager(models.Manager):
+class FundManager(CachedLookupManager):
     """Custom manager for model Fund."""
+    natural_key_fields = ('name',)
 
-    def get_by_natural_key(self, name):
-        return self.get(name=name)
+    @instrumented_upload
+    def from_upload(self, data, chunk_size=UPLOAD_CHUNK_SIZE, stats=None):
+        """
+        Process data from Fund upload.
+        Unchanged Funds are not written, and counted in stats['skipped'].
+        Repeated rows of a created Fund are counted in stats['merged'].
+        """
+        created = []
+        updated = []
+        for chunk in upload_chunks(data, chunk_size):
+            chunk_created, chunk_updated = self._upload_chunk(chunk, stats)
+            created.extend(chunk_created)
+            updated.extend(chunk_updated)
+        return created, updated
 
-    def from_upload(self, data):
-        """Process data from Fund upload."""
+    def _upload_chunk(self, data, stats):
+        """Process one chunk of data from Fund upload."""
+        existing = {obj.name: obj for obj in self.filter(
+            name__in={obj.get('name') for obj in data})}
+        pending = OrderedDict()
+        repeats = Counter()
+        updated = []
+        changes = []
+        skipped = 0
         for obj in data:
             try:
                 natural_value = obj['name']
-                model_obj = self.get_by_natural_key(natural_value)
-                # update obj
-                update_obj = {}
-                for attr, value in obj.items():
-                    if value != str(getattr(model_obj, attr)):
-                        setattr(model_obj, attr, value)
-                        update_obj[attr] = value
-                model_obj.save()
-                ccall_log.debug('Updated Fund object %s: %s',
-                                natural_value, update_obj)
-            except Fund.DoesNotExist:
-                # create new obj
-                try:
-                    with transaction.atomic():
-                        model_obj = self.create(**obj)
-                    ccall_log.debug('Created Fund object: %s', obj)
-                except IntegrityError:
-                    ccall_log.error('Cannot create Fund object: %s', obj)
+                if natural_value in existing:
+                    # update obj, unless unchanged
+                    model_obj = existing[natural_value]
+                    update_obj = diff_row(model_obj, obj)
+                    if update_obj:
+                        changes.append((model_obj, update_obj))
+                        ccall_log.debug('Updated Fund object %s: %s',
+                                        natural_value, update_obj)
+                    else:
+                        skipped += 1
+                    updated.append(model_obj)
+                elif natural_value in pending:
+                    # repeated row for a Fund created in this chunk
+                    for attr, value in obj.items():
+                        setattr(pending[natural_value][0], attr, value)
+                    repeats[natural_value] += 1
+                else:
+                    # create new obj
+                    pending[natural_value] = (self.model(**obj), obj)
             except BaseException as exc_:
                 ccall_log.exception(exc_)
                 ccall_log.error(
                     'Exception encountered on Fund object: %s', obj)
+        failed = bulk_update_rows(self, changes)
+        if failed:
+            updated = [obj for obj in updated if obj.pk not in failed]
+        created = bulk_create_rows(self, list(pending.values()))
+        if stats is not None:
+            stats['skipped'] += skipped
+            stats['merged'] += count_merged(pending, repeats, created)
+        if changes or created:
+            # bulk writes send no signals
+            self.clear_lookup_cache()
+        return created, updated
 
 
 class Fund(models.Model):
@@ -5,48 +5,170 @@ from __future__ import unicode_literals
 
 import logging
 from datetime import datetime
+from decimal import Decimal, InvalidOperation
 
 from django.core.validators import MinValueValidator
-from django.db import IntegrityError, models, transaction
+from django.db import connections, models, transaction
 
+from ..instrumentation import instrumented_upload, upload_chunks
 from ..models.fund import Fund
 from ..models.prospect import Prospect
+from ..pgcopy import (COPY_CHUNK_SIZE, INVALID_VALUE_ERRORS, StagingTable,
+                      db_value, uses_copy)
+from ..utils import UPLOAD_CHUNK_SIZE, bulk_create_rows
 
 ccall_log = logging.getLogger('ccall')
 
 
+def _parse_column(values, parse):
+    """
+    Parse the distinct values of an uploaded column in one pass.
+    Returns a dict of value to parsed value, or to None if invalid.
+    """
+    parsed = {}
+    for value in set(values):
+        try:
+            parsed[value] = parse(value)
+        except (TypeError, ValueError, InvalidOperation):
+            parsed[value] = None
+    return parsed
+
+
+def _parse_date(value):
+    """Parse a date in the upload format."""
+    return datetime.strptime(value, r'%d/%m/%Y').date()
+
+
 class PledgeManager(models.Manager):
     """Custom manager for model Pledge."""
 
-    def from_upload(self, data):
-        """Process data from Pledge upload."""
+    @instrumented_upload
+    def from_upload(self, data, chunk_size=UPLOAD_CHUNK_SIZE, stats=None):
+        """
+        Process data from Pledge upload.
+        Funds and Prospects are resolved once per chunk, so rows are checked
+        against in-memory maps and the Pledges are created in bulk. Pledges
+        have no natural key, so no row is ever skipped and stats is left
+        untouched. On PostgreSQL, the rows are staged with COPY instead, see
+        _copy_upload.
+        """
+        if uses_copy(self):
+            return self._copy_upload(data), []
+        created = []
+        for chunk in upload_chunks(data, chunk_size):
+            created.extend(self._upload_chunk(chunk))
+        return created, []
+
+    def _upload_chunk(self, data):
+        """Process one chunk of data from Pledge upload."""
+        funds = Fund.objects.in_bulk_by_natural_key(
+            obj.get('pledge_fund') for obj in data)
+        prospects = {obj.nric: obj for obj in Prospect.objects.filter(
+            nric__in={obj.get('prospect') for obj in data})}
+        dates = _parse_column(
+            (obj.get('pledge_date') for obj in data), _parse_date)
+        amounts = _parse_column(
+            (obj.get('pledge_amount') for obj in data), Decimal)
+        field_names = {field.name for field in self.model._meta.fields}
+        pending = []
         for obj in data:
-            try:
-                # get the prospect & fund by natural key
-                obj['prospect'] = Prospect.objects.get_by_natural_key(
-                    obj['prospect'])
-                obj['pledge_fund'] = Fund.objects.get_by_natural_key(
-                    obj['pledge_fund'])
-                obj['pledge_date'] = datetime.strptime(
-                    obj['pledge_date'], r'%d/%m/%Y')
-                try:
-                    with transaction.atomic():
-                        self.create(**obj)
-                    ccall_log.debug('Created Pledge object: %s', obj)
-                except IntegrityError:
-                    ccall_log.error('Cannot create Pledge object: %s', obj)
-            except Prospect.DoesNotExist:
+            if not field_names.issuperset(obj):
+                ccall_log.error(
+                    'Cannot create Pledge object, unknown fields: %s', obj)
+            elif obj.get('prospect') not in prospects:
                 # no prospect
                 ccall_log.error(
                     'Cannot create Pledge object, no Prospect: %s', obj)
-            except Fund.DoesNotExist:
+            elif obj.get('pledge_fund') not in funds:
                 # no fund
                 ccall_log.error(
                     'Cannot create Pledge object, no Fund: %s', obj)
-            except BaseException as exc_:
-                ccall_log.exception(exc_)
+            elif dates[obj.get('pledge_date')] is None:
+                ccall_log.error(
+                    'Cannot create Pledge object, invalid date: %s', obj)
+            elif amounts[obj.get('pledge_amount')] is None:
+                ccall_log.error(
+                    'Cannot create Pledge object, invalid amount: %s', obj)
+            else:
+                pledge_obj = self.model(
+                    prospect=prospects[obj['prospect']],
+                    pledge_fund=funds[obj['pledge_fund']],
+                    pledge_date=dates[obj['pledge_date']],
+                    pledge_amount=amounts[obj['pledge_amount']])
+                pending.append((pledge_obj, obj))
+        return bulk_create_rows(self, pending)
+
+    def _copy_upload(self, data):
+        """
+        Process data from Pledge upload through a staging table filled with
+        COPY. Prospects and Funds are resolved with one UPDATE of the staging
+        table, then the Pledges are created with one INSERT.
+        """
+        connection = connections[self.db]
+        opts = self.model._meta
+        amount_field = opts.get_field('pledge_amount')
+        date_field = opts.get_field('pledge_date')
+        field_names = {field.name for field in opts.fields}
+        quote = connection.ops.quote_name
+        with transaction.atomic(using=self.db), StagingTable(
+                connection, 'ccall_pledge_staging',
+                [('prospect', 'text'), ('pledge_fund', 'text'),
+                 ('pledge_amount', amount_field.db_type(connection)),
+                 ('pledge_date', date_field.db_type(connection))],
+                resolved=[('prospect_id', 'integer'),
+                          ('pledge_fund_id', 'integer')]) as staging:
+            for chunk in upload_chunks(data, COPY_CHUNK_SIZE):
+                rows = []
+                for obj in chunk:
+                    if not field_names.issuperset(obj):
+                        ccall_log.error(
+                            'Cannot create Pledge object, unknown fields: '
+                            '%s', obj)
+                        continue
+                    try:
+                        rows.append([
+                            obj['prospect'], obj['pledge_fund'],
+                            db_value(amount_field, obj.get('pledge_amount'),
+                                     connection),
+                            db_value(date_field,
+                                     _parse_date(obj.get('pledge_date')),
+                                     connection)])
+                    except (KeyError,) + INVALID_VALUE_ERRORS:
+                        ccall_log.error(
+                            'Cannot create Pledge object, invalid values: '
+                            '%s', obj)
+                staging.copy(rows)
+
+            staging.execute(
+                'UPDATE {{staging}} AS s SET prospect_id = p.id, '
+                'pledge_fund_id = f.id FROM {prospect} AS p, {fund} AS f '
+                'WHERE p.nric = s.prospect AND f.name = s.pledge_fund'.format(
+                    prospect=quote(Prospect._meta.db_table),
+                    fund=quote(Fund._meta.db_table)))
+            for row in staging.execute(
+                    'SELECT prospect, pledge_fund, pledge_amount, '
+                    'pledge_date FROM {staging} WHERE prospect_id IS NULL '
+                    'ORDER BY _row'):
                 ccall_log.error(
-                    'Exception encountered on Pledge object: %s', obj)
+                    'Cannot create Pledge object, no Prospect or Fund: %s',
+                    dict(zip(('prospect', 'pledge_fund', 'pledge_amount',
+                              'pledge_date'), row)))
+            columns = [quote(field.column) for field in opts.concrete_fields]
+            created = [
+                self.model.from_db(self.db, [
+                    field.attname for field in opts.concrete_fields], row)
+                for row in staging.execute(
+                    'INSERT INTO {table} (prospect_id, pledge_fund_id, '
+                    'pledge_amount, pledge_date) '
+                    'SELECT prospect_id, pledge_fund_id, pledge_amount, '
+                    'pledge_date FROM {{staging}} '
+                    'WHERE prospect_id IS NOT NULL ORDER BY _row '
+                    'RETURNING {columns}'.format(
+                        table=quote(opts.db_table),
+                        columns=', '.join(columns)))]
+        ccall_log.debug('Merged %s Pledge rows: %s created', staging.rows,
+                        len(created))
+        return created
 
 
 class Pledge(models.Model):
@@ -57,7 +179,7 @@ class Pledge(models.Model):
         verbose_name='Pledge amount', decimal_places=2,
         max_digits=12, validators=[MinValueValidator(0)])
     pledge_fund = models.ForeignKey(Fund, on_delete=models.CASCADE)
-    pledge_date = models.DateField(verbose_name='Pledge date')
+    pledge_date = models.DateField(verbose_name='Pledge date', db_index=True)
     prospect = models.ForeignKey(Prospect, on_delete=models.CASCADE)
 
     def __str__(self):
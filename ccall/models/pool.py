@@ -7,36 +7,89 @@ import logging
 
 from django.db import models
 
+from ..instrumentation import instrumented_upload
+from ..lookups import CachedLookupManager
 from ..models.project import Project
 from ..models.prospect import Prospect
+from ..utils import UPLOAD_CHUNK_SIZE, chunked
 
 ccall_log = logging.getLogger('ccall')
 
 
-class PoolManager(models.Manager):
+class PoolManager(CachedLookupManager):
     """Custom manager for model Pool."""
-
-    def get_by_natural_key(self, project, name):
-        return self.get(project=project, name=name)
-
-    def from_upload(self, project, name, data):
-        """Process data from Pool upload."""
+    natural_key_fields = ('project', 'name')
+
+    @instrumented_upload
+    def from_upload(self, project, name, data, replace=False, stats=None):
+        """
+        Process data from Pool upload.
+        With replace, Prospects not in data are removed from the Pool.
+        """
+        created = []
+        updated = []
         try:
             # get the pool by natural key
             pool_obj = self.get_by_natural_key(project, name)
-            created, updated = Prospect.objects.from_upload(data)
-            pool_obj.prospects.add(*(created + updated))
+            created, updated = Prospect.objects.from_upload(
+                data, stats=stats)
+            self.sync_prospects(
+                pool_obj, [obj.pk for obj in created + updated], replace)
             ccall_log.debug('Updated Pool object %s', name)
         except Pool.DoesNotExist:
             # create the pool
             pool_obj = self.create(project=project, name=name)
-            created, updated = Prospect.objects.from_upload(data)
-            pool_obj.prospects.add(*(created + updated))
+            created, updated = Prospect.objects.from_upload(
+                data, stats=stats)
+            self.sync_prospects(
+                pool_obj, [obj.pk for obj in created + updated], replace)
             ccall_log.debug('Created Pool object %s', name)
         except BaseException as exc_:
             ccall_log.exception(exc_)
             ccall_log.error(
                 'Exception encountered on Pool object: %s', name)
+        return created, updated
+
+    def sync_prospects(self, pool_obj, prospect_ids, replace=False):
+        """
+        Add Prospects to a Pool with set-based writes to the through table.
+        Only missing links are inserted. With replace, the Pool members not
+        in prospect_ids are deleted. Returns the (added, removed) counts.
+        """
+        through = Pool.prospects.through
+        prospect_ids = set(prospect_ids)
+        members = through.objects.filter(pool=pool_obj)
+        if replace:
+            current = set(members.values_list('prospect_id', flat=True))
+        else:
+            # only the links for the uploaded Prospects are relevant
+            current = set()
+            for batch in chunked(sorted(prospect_ids), UPLOAD_CHUNK_SIZE):
+                current.update(members.filter(
+                    prospect_id__in=batch).values_list(
+                        'prospect_id', flat=True))
+        added = sorted(prospect_ids - current)
+        through.objects.bulk_create(
+            [through(pool_id=pool_obj.pk, prospect_id=prospect_id)
+             for prospect_id in added])
+        removed = sorted(current - prospect_ids) if replace else []
+        for batch in chunked(removed, UPLOAD_CHUNK_SIZE):
+            through.objects.filter(
+                pool=pool_obj, prospect_id__in=batch).delete()
+        if removed:
+            # the ids of removed members may be given to new ones
+            self.rewind_claim_cursor([pool_obj.pk])
+        ccall_log.debug('Synced Pool object %s: %s added, %s removed',
+                        pool_obj.name, len(added), len(removed))
+        return len(added), len(removed)
+
+    def rewind_claim_cursor(self, pool_ids):
+        """
+        Walk the members of Pools by id from the first one again on their
+        next claim, after changes that may leave earlier members still to
+        be called.
+        """
+        self.filter(pk__in=list(pool_ids)).update(claim_cursor=0)
 
 
 class Pool(models.Model):
@@ -51,6 +104,11 @@ class Pool(models.Model):
     prospects = models.ManyToManyField(
         to=Prospect, related_name='prospect_set',
         related_query_name='prospects', verbose_name='Prospects', blank=True)
+    # id of the membership up to which every Prospect of the Pool is done
+    # calling, moved by the Reservation manager so that claims start after
+    # it
+    claim_cursor = models.PositiveIntegerField(
+        verbose_name='Claim cursor', default=0, editable=False)
 
     class Meta:
         unique_together = ('name', 'project',)
@@ -58,6 +116,14 @@ class Pool(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """
+        Save the Pool, rewinding its claim cursor, since the maximum number
+        of attempts may have been raised.
+        """
+        self.claim_cursor = 0
+        super(Pool, self).save(*args, **kwargs)
+
     @property
     def is_active(self):
         return bool(self.max_attempts)
@@ -5,12 +5,12 @@ from __future__ import unicode_literals
 
 from django.db import models
 
+from ..lookups import CachedLookupManager
 
-class ProjectManager(models.Manager):
-    """Custom manager for Project."""
 
-    def get_by_natural_key(self, name):
-        return self.get(name=name)
+class ProjectManager(CachedLookupManager):
+    """Custom manager for Project."""
+    natural_key_fields = ('name',)
 
 
 class Project(models.Model):
@@ -4,11 +4,19 @@
 from __future__ import unicode_literals
 
 import logging
+from collections import Counter, OrderedDict
 
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import IntegrityError, models, transaction
+from django.db import connections, models, transaction
 from django.utils import timezone
 
+from ..instrumentation import instrumented_upload, upload_chunks
+from ..pgcopy import (COPY_CHUNK_SIZE, INVALID_VALUE_ERRORS, StagingTable,
+                      db_value, uses_copy)
+from ..search import phone_digits, prospect_index
+from ..utils import (UPLOAD_CHUNK_SIZE, bulk_create_rows, bulk_update,
+                     bulk_update_rows, chunked, count_merged, diff_row)
+
 ccall_log = logging.getLogger('ccall')
 
 
@@ -18,37 +26,160 @@ class ProspectManager(models.Manager):
     def get_by_natural_key(self, nric):
         return self.get(nric=nric)
 
-    def from_upload(self, data):
-        """Process data from Prospect upload."""
+    @instrumented_upload
+    def from_upload(self, data, chunk_size=UPLOAD_CHUNK_SIZE, stats=None):
+        """
+        Process data from Prospect upload.
+        Existing Prospects are fetched once per chunk; new ones are bulk
+        created and changed ones are written back in batched UPDATEs.
+        Unchanged Prospects are not written, and counted in stats['skipped'].
+        Repeated rows of a created Prospect are counted in stats['merged'].
+        On PostgreSQL, the rows are staged with COPY instead, see
+        _copy_upload.
+        """
+        if uses_copy(self):
+            return self._copy_upload(data, stats)
         created = []
         updated = []
+        for chunk in upload_chunks(data, chunk_size):
+            chunk_created, chunk_updated = self._upload_chunk(chunk, stats)
+            created.extend(chunk_created)
+            updated.extend(chunk_updated)
+        return created, updated
+
+    def _upload_chunk(self, data, stats):
+        """Process one chunk of data from Prospect upload."""
+        existing = {obj.nric: obj for obj in self.filter(
+            nric__in={obj.get('nric') for obj in data})}
+        pending = OrderedDict()
+        repeats = Counter()
+        updated = []
+        changes = []
+        skipped = 0
         for obj in data:
             try:
                 natural_value = obj['nric']
-                model_obj = self.get_by_natural_key(natural_value)
-                # update prospect
-                update_obj = {}
-                for attr, value in obj.items():
-                    if value != str(getattr(model_obj, attr)):
-                        setattr(model_obj, attr, value)
-                        update_obj[attr] = value
-                model_obj.save()
-                updated.append(model_obj)
-                ccall_log.debug('Updated Prospect object %s: %s',
-                                natural_value, update_obj)
-            except Prospect.DoesNotExist:
-                # create new prospect
-                try:
-                    with transaction.atomic():
-                        model_obj = self.create(**obj)
-                    created.append(model_obj)
-                    ccall_log.debug('Created Prospect object: %s', obj)
-                except IntegrityError:
-                    ccall_log.error('Cannot create Prospect object: %s', obj)
+                if natural_value in existing:
+                    # update prospect, unless unchanged
+                    model_obj = existing[natural_value]
+                    update_obj = diff_row(model_obj, obj)
+                    if model_obj.set_phone_digits():
+                        update_obj['phone_digits'] = model_obj.phone_digits
+                    if update_obj:
+                        changes.append((model_obj, update_obj))
+                        ccall_log.debug('Updated Prospect object %s: %s',
+                                        natural_value, update_obj)
+                    else:
+                        skipped += 1
+                    updated.append(model_obj)
+                elif natural_value in pending:
+                    # repeated row for a Prospect created in this chunk
+                    for attr, value in obj.items():
+                        setattr(pending[natural_value][0], attr, value)
+                    repeats[natural_value] += 1
+                else:
+                    # create new prospect
+                    pending[natural_value] = (self.model(**obj), obj)
             except BaseException as exc_:
                 ccall_log.exception(exc_)
                 ccall_log.error(
                     'Exception encountered on Prospect object: %s', obj)
+        failed = bulk_update_rows(self, changes)
+        if failed:
+            updated = [obj for obj in updated if obj.pk not in failed]
+        for model_obj, _ in pending.values():
+            model_obj.set_phone_digits()
+        created = bulk_create_rows(self, list(pending.values()))
+        if stats is not None:
+            stats['skipped'] += skipped
+            stats['merged'] += count_merged(pending, repeats, created)
+        if created and created[0].pk is None:
+            # backends that cannot return ids from bulk inserts
+            created = list(self.filter(
+                nric__in=[obj.nric for obj in created]))
+        # bulk writes send no signals, index the Prospects here
+        prospect_index(self.db).update(
+            created + [obj for obj, _ in changes if obj.pk not in failed])
+        return created, updated
+
+    def _copy_upload(self, data, stats):
+        """
+        Process data from Prospect upload through a staging table filled
+        with COPY, merged into the Prospects with one INSERT ... ON CONFLICT
+        on the NRIC. The last of repeated rows wins, and unchanged Prospects
+        are not written.
+        """
+        connection = connections[self.db]
+        fields = [field for field in self.model._meta.concrete_fields
+                  if not field.primary_key]
+        quote = connection.ops.quote_name
+        uploaded = set()
+        with transaction.atomic(using=self.db), StagingTable(
+                connection, 'ccall_prospect_staging',
+                [(field.column, field.db_type(connection))
+                 for field in fields]) as staging:
+            for chunk in upload_chunks(data, COPY_CHUNK_SIZE):
+                rows = []
+                for obj in chunk:
+                    try:
+                        if 'nric' not in obj:
+                            raise KeyError('nric')
+                        model_obj = self.model(**obj)
+                        model_obj.set_phone_digits()
+                        rows.append([db_value(
+                            field, getattr(model_obj, field.attname),
+                            connection) for field in fields])
+                        uploaded.update(obj)
+                    except (KeyError,) + INVALID_VALUE_ERRORS:
+                        ccall_log.error(
+                            'Cannot create Prospect object: %s', obj)
+                staging.copy(rows)
+
+            # phone digits of updated Prospects are recomputed below, from
+            # the phones uploaded and the ones kept
+            columns = [quote(field.column) for field in fields]
+            changed = [quote(field.column) for field in fields
+                       if field.name in uploaded and field.name != 'nric']
+            if changed:
+                conflict = (
+                    'DO UPDATE SET {} WHERE ({}) IS DISTINCT FROM ({})'.format(
+                        ', '.join('{0} = EXCLUDED.{0}'.format(column)
+                                  for column in changed),
+                        ', '.join('{}.{}'.format(
+                            quote(self.model._meta.db_table), column)
+                            for column in changed),
+                        ', '.join('EXCLUDED.{}'.format(column)
+                                  for column in changed)))
+            else:
+                conflict = 'DO NOTHING'
+            written = dict(staging.execute(
+                'INSERT INTO {table} ({columns}) '
+                'SELECT DISTINCT ON (nric) {columns} FROM {{staging}} '
+                'ORDER BY nric, _row DESC '
+                'ON CONFLICT (nric) {conflict} '
+                'RETURNING id, xmax = 0'.format(
+                    table=quote(self.model._meta.db_table),
+                    columns=', '.join(columns), conflict=conflict)))
+            matched = list(self.raw(staging.format(
+                'SELECT * FROM {table} WHERE nric IN '
+                '(SELECT nric FROM {{staging}})'.format(
+                    table=quote(self.model._meta.db_table)))))
+            created = [obj for obj in matched if written.get(obj.pk)]
+            updated = [obj for obj in matched if not written.get(obj.pk)]
+            digits = [obj for obj in updated if obj.set_phone_digits()]
+            for batch in chunked(digits, UPLOAD_CHUNK_SIZE):
+                bulk_update(self.all(), batch, ['phone_digits'])
+            changed_ids = {pk for pk, inserted in written.items()
+                           if not inserted}
+            changed_ids.update(obj.pk for obj in digits)
+        if stats is not None:
+            stats['skipped'] += len(updated) - len(changed_ids)
+            # staged rows sharing an NRIC
+            stats['merged'] += staging.rows - len(matched)
+        prospect_index(self.db).update(
+            created + [obj for obj in updated if obj.pk in changed_ids])
+        ccall_log.debug('Merged %s Prospect rows: %s created, %s updated',
+                        staging.rows, len(created), len(changed_ids))
         return created, updated
 
 
@@ -95,6 +226,9 @@ class Prospect(models.Model):
         max_length=8, verbose_name='Home phone', blank=True)
     phone_mobile = models.CharField(
         max_length=8, verbose_name='Mobile phone', blank=True)
+    phone_digits = models.CharField(
+        max_length=17, verbose_name='Phone digits', blank=True,
+        editable=False)
     education_school = models.CharField(
         max_length=50, verbose_name='School graduated from')
     education_degree = models.CharField(max_length=50, verbose_name='Degree')
@@ -105,5 +239,25 @@ class Prospect(models.Model):
     def __str__(self):
         return '{} ({})'.format(self.name, self.nric)
 
+    def save(self, *args, **kwargs):
+        """Save the Prospect, with the digits of its phone numbers."""
+        self.set_phone_digits()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and (
+                {'phone_home', 'phone_mobile'} & set(update_fields)):
+            kwargs['update_fields'] = list(update_fields) + ['phone_digits']
+        super(Prospect, self).save(*args, **kwargs)
+
     def natural_key(self):
         return self.nric
+
+    def set_phone_digits(self):
+        """
+        Normalise the phone numbers into phone_digits, for search.
+        Returns whether phone_digits changed.
+        """
+        digits = phone_digits(self.phone_home, self.phone_mobile)
+        if digits == self.phone_digits:
+            return False
+        self.phone_digits = digits
+        return True
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-"""
+"""Models for a ProspectStatus."""
+
+from __future__ import unicode_literals
+
+import logging
+
+from django.db import IntegrityError, models, transaction
+
+from ..models.pool import Pool
+from ..models.prospect import Prospect
+from ..models.result_code import ResultCode
+from ..utils import UPLOAD_CHUNK_SIZE, bulk_update, chunked
+
+ccall_log = logging.getLogger('ccall')
+
+# fields of ProspectStatus derived from the latest Call
+STATUS_FIELDS = ('attempts', 'last_result_code', 'last_call_time',
+                 'is_complete')
+
+
+class ProspectStatusManager(models.Manager):
+    """Custom manager for model ProspectStatus."""
+
+    def _latest_calls(self, calls):
+        """
+        Yield the latest Call of each (pool, prospect) in calls, as
+        (pool_id, prospect_id, attempt, result_code_id, call_time,
+        is_complete) tuples. The latest Call is the highest attempt.
+        """
+        rows = calls.filter(pool__isnull=False).order_by(
+            'pool_id', 'prospect_id', 'attempt', 'pk').values_list(
+                'pool_id', 'prospect_id', 'attempt', 'result_code_id',
+                'call_time', 'result_code__is_complete')
+        latest = None
+        for row in rows.iterator():
+            if latest is not None and latest[:2] != row[:2]:
+                yield latest
+            latest = row
+        if latest is not None:
+            yield latest
+
+    def _new_status(self, row):
+        """Build an unsaved ProspectStatus from a latest Call row."""
+        pool_id, prospect_id, attempt, result_code_id, call_time, \
+            is_complete = row
+        return self.model(
+            pool_id=pool_id, prospect_id=prospect_id, attempts=attempt,
+            last_result_code_id=result_code_id, last_call_time=call_time,
+            is_complete=is_complete)
+
+    def refresh(self, keys):
+        """
+        Recompute the statuses of (pool_id, prospect_id) keys from their
+        Calls, with a fixed number of queries per chunk of keys. The
+        statuses are locked before their Calls are read, so that
+        concurrent refreshes of a key take turns and each reads the Calls
+        committed by the one before. Statuses of keys without Calls are
+        deleted.
+        """
+        from ..models.call import Call
+        keys = {key for key in keys if key[0] is not None}
+        for batch in chunked(sorted(keys), UPLOAD_CHUNK_SIZE):
+            batch = set(batch)
+            pools = {pool_id for pool_id, _ in batch}
+            prospects = {prospect_id for _, prospect_id in batch}
+            # the locks are held until the outermost transaction ends
+            with transaction.atomic(using=self.db, savepoint=False):
+                # in the order of their ids, so that refreshes do not
+                # deadlock
+                existing = {
+                    (obj.pool_id, obj.prospect_id): obj
+                    for obj in self.select_for_update().filter(
+                        pool_id__in=pools,
+                        prospect_id__in=prospects).order_by('pk')
+                    if (obj.pool_id, obj.prospect_id) in batch}
+                latest = {row[:2]: self._new_status(row)
+                          for row in self._latest_calls(Call.objects.filter(
+                              pool_id__in=pools, prospect_id__in=prospects))
+                          if row[:2] in batch}
+                self._write(existing, latest)
+
+    def _write(self, existing, latest):
+        """
+        Write the latest statuses over the existing ones, by key: update
+        the changed, delete those without Calls and create the new.
+        """
+        attnames = [self.model._meta.get_field(field).attname
+                    for field in STATUS_FIELDS]
+        changed = []
+        # Pools with Prospects that may be left to call again
+        reopened = {key[0] for key in existing if key not in latest}
+        for key, new in latest.items():
+            obj = existing.get(key)
+            if obj is None:
+                continue
+            if any(getattr(obj, attname) != getattr(new, attname)
+                   for attname in attnames):
+                new.pk = obj.pk
+                changed.append(new)
+                if new.attempts < obj.attempts or \
+                        obj.is_complete and not new.is_complete:
+                    reopened.add(obj.pool_id)
+        bulk_update(self.all(), changed, STATUS_FIELDS)
+        if reopened:
+            Pool.objects.db_manager(self.db).rewind_claim_cursor(reopened)
+        removed = [obj.pk for key, obj in existing.items()
+                   if key not in latest]
+        if removed:
+            self.filter(pk__in=removed).delete()
+        added = [obj for key, obj in latest.items() if key not in existing]
+        try:
+            if added:
+                # waits for a concurrent transaction creating the same keys
+                with transaction.atomic(using=self.db):
+                    self.bulk_create(added)
+        except IntegrityError:
+            # created concurrently: lock and read them again
+            self.refresh(key for key in latest if key not in existing)
+
+    def rebuild(self, chunk_size=UPLOAD_CHUNK_SIZE):
+        """
+        Recompute every status from scratch, streaming the Calls in
+        (pool, prospect) order. Returns the number of statuses.
+        """
+        from ..models.call import Call
+        count = 0
+        with transaction.atomic(using=self.db):
+            self.all().delete()
+            for batch in chunked(self._latest_calls(Call.objects.all()),
+                                 chunk_size):
+                self.bulk_create([self._new_status(row) for row in batch])
+                count += len(batch)
+        ccall_log.debug('Rebuilt %s ProspectStatus objects', count)
+        return count
+
+
+class ProspectStatus(models.Model):
+    """
+    Model for the calling status of a Prospect in a Pool.
+    Derived from the latest Call of the Prospect in the Pool, and kept up
+    to date whenever a Call is written.
+    """
+    objects = ProspectStatusManager()
+
+    pool = models.ForeignKey(
+        Pool, verbose_name='Pool', on_delete=models.CASCADE)
+    prospect = models.ForeignKey(
+        Prospect, verbose_name='Prospect', on_delete=models.CASCADE)
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name='Attempts', default=0)
+    last_result_code = models.ForeignKey(
+        ResultCode, verbose_name='Last result code', null=True,
+        on_delete=models.SET_NULL)
+    last_call_time = models.DateTimeField(
+        verbose_name='Last call time', null=True)
+    is_complete = models.BooleanField(
+        verbose_name='Complete status', default=False)
+
+    class Meta:
+        unique_together = ('pool', 'prospect',)
+        verbose_name_plural = 'prospect statuses'
+
+    def __str__(self):
+        return '{} - {}'.format(self.prospect, self.pool)
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-"""
+"""Models for a Reservation."""
+
+from __future__ import unicode_literals
+
+import logging
+from datetime import timedelta
+
+from django.db import (IntegrityError, OperationalError, connections, models,
+                       transaction)
+from django.db.models import Exists, OuterRef, Prefetch, Q, Subquery
+from django.utils import timezone
+
+from ..models.call import Call
+from ..models.pool import Pool
+from ..models.prospect import Prospect
+from ..models.prospect_status import ProspectStatus
+from ..models.user import Assignment, PhonathonUser
+
+ccall_log = logging.getLogger('ccall')
+
+# how long a Prospect stays reserved for a caller
+RESERVATION_LEASE = timedelta(minutes=15)
+# default and maximum number of Prospects reserved per batch
+RESERVATION_BATCH_SIZE = 10
+RESERVATION_BATCH_SIZE_MAX = 50
+# number of claim attempts per Pool before giving up on it
+CLAIM_ATTEMPTS = 3
+
+
+class ReservationManager(models.Manager):
+    """Custom manager for model Reservation."""
+
+    def release_expired(self):
+        """Delete the Reservations past their lease. Returns the count."""
+        count, _ = self.filter(expires_at__lte=timezone.now()).delete()
+        return count
+
+    def release(self, caller, ids=None):
+        """
+        Delete the Reservations of a caller, or only those with the given
+        ids. Returns the count.
+        """
+        reservations = self.filter(caller=caller)
+        if ids is not None:
+            reservations = reservations.filter(pk__in=ids)
+        count, _ = reservations.delete()
+        return count
+
+    def candidates(self, pool):
+        """
+        Pool memberships of the Prospects of a Pool still to be called,
+        in upload order, after the claim cursor of the Pool. Prospects
+        whose latest Call in the Pool has a complete result, who have
+        reached the maximum number of attempts, or who hold an unexpired
+        Reservation, are left out. Statuses are read from ProspectStatus,
+        one row per member.
+        """
+        status = ProspectStatus.objects.filter(
+            pool=pool, prospect=OuterRef('prospect_id'))
+        members = Pool.prospects.through.objects.filter(
+            pool=pool, pk__gt=pool.claim_cursor)
+        return members.annotate(
+            last_attempt=Subquery(status.values('attempts')[:1]),
+            last_complete=Subquery(status.values('is_complete')[:1]),
+            reserved=Exists(self.filter(
+                prospect=OuterRef('prospect_id'),
+                expires_at__gt=timezone.now())),
+        ).filter(
+            Q(last_attempt__isnull=True) |
+            Q(last_attempt__lt=pool.max_attempts, last_complete=False),
+            reserved=False,
+        ).order_by('pk')
+
+    def advance_cursor(self, pool):
+        """
+        Move the claim cursor of a Pool past the leading members done
+        calling, so that claims do not walk them again, and set it on
+        pool. The Pool row is locked meanwhile, so that the cursor is not
+        moved past members reopened by a concurrent transaction.
+        """
+        done = ProspectStatus.objects.filter(
+            pool=pool, prospect=OuterRef('prospect_id')).filter(
+                Q(is_complete=True) | Q(attempts__gte=pool.max_attempts))
+        with transaction.atomic(using=self.db):
+            cursor = Pool.objects.db_manager(self.db).select_for_update(
+            ).filter(pk=pool.pk).values_list('claim_cursor', flat=True)
+            cursor = cursor.first() or 0
+            members = Pool.prospects.through.objects.filter(
+                pool=pool, pk__gt=cursor).order_by('pk')
+            first_open = members.annotate(done=Exists(done)).filter(
+                done=False).values_list('pk', flat=True).first()
+            if first_open is not None:
+                new_cursor = first_open - 1
+            else:
+                new_cursor = members.values_list(
+                    'pk', flat=True).last() or cursor
+            if new_cursor > cursor:
+                Pool.objects.db_manager(self.db).filter(pk=pool.pk).update(
+                    claim_cursor=new_cursor)
+        pool.claim_cursor = max(cursor, new_cursor)
+
+    def held(self, caller):
+        """
+        Unexpired Reservations of a caller in reservation order, with their
+        Prospect, Pool, Project and Call history loaded in two queries.
+        """
+        calls = Call.objects.select_related('caller', 'result_code').order_by(
+            'call_time', 'pk')
+        return self.filter(
+            caller=caller, expires_at__gt=timezone.now()).select_related(
+                'prospect', 'pool__project').prefetch_related(
+                    Prefetch('prospect__call_set', queryset=calls)).order_by(
+                        'pk')
+
+    def claim_next(self, caller):
+        """
+        Reserve the next Prospect for a caller, walking their Pool
+        Assignments in order. A caller holding an unexpired Reservation is
+        given it again. Returns None if no Prospect is left to call.
+        """
+        current = self.filter(
+            caller=caller, expires_at__gt=timezone.now()).select_related(
+                'prospect', 'pool__project').order_by('pk').first()
+        if current is not None:
+            return current
+        claimed = self._claim(caller, 1)
+        if not claimed:
+            return None
+        # the one just created, should the caller claim twice at once
+        return self.filter(
+            caller=caller, prospect_id=claimed[0]).select_related(
+                'prospect', 'pool__project').get()
+
+    def claim_batch(self, caller, size=RESERVATION_BATCH_SIZE):
+        """
+        Reserve up to size Prospects for a caller, counting the ones they
+        already hold, whose lease is renewed. Returns the held Reservations
+        as loaded by held.
+        """
+        size = min(size, RESERVATION_BATCH_SIZE_MAX)
+        now = timezone.now()
+        count = self.filter(caller=caller, expires_at__gt=now).update(
+            expires_at=now + RESERVATION_LEASE)
+        if count < size:
+            self._claim(caller, size - count)
+        return list(self.held(caller))
+
+    def _claim(self, caller, count):
+        """
+        Reserve count Prospects for a caller, walking their Pool
+        Assignments in order. Returns the ids of the Prospects reserved.
+        """
+        self.release_expired()
+        assignments = Assignment.objects.filter(
+            user=caller, pool__max_attempts__gt=0).select_related(
+                'pool').order_by('order')
+        claimed = []
+        for assignment in assignments:
+            claimed.extend(self._claim_in_pool(
+                caller, assignment.pool, count - len(claimed)))
+            if len(claimed) >= count:
+                break
+        return claimed
+
+    def _claim_in_pool(self, caller, pool, count):
+        """
+        Reserve up to count Prospects of one Pool. Returns the ids of the
+        Prospects reserved. An attempt failing because the database is
+        locked, as SQLite reports concurrent writes, is retried like one
+        losing Prospects to other callers.
+        """
+        features = connections[self.db].features
+        claimed = []
+        for _ in range(CLAIM_ATTEMPTS):
+            expires_at = timezone.now() + RESERVATION_LEASE
+            reserved = []
+            try:
+                self.advance_cursor(pool)
+                with transaction.atomic(using=self.db):
+                    members = self.candidates(pool)
+                    if features.has_select_for_update_skip_locked:
+                        # rows being claimed by other callers are passed over
+                        members = members.select_for_update(skip_locked=True)
+                    reservations = [
+                        self.model(caller=caller, pool=pool,
+                                   prospect_id=prospect_id,
+                                   attempt=(last_attempt or 0) + 1,
+                                   expires_at=expires_at)
+                        for prospect_id, last_attempt in members.values_list(
+                            'prospect_id', 'last_attempt')[
+                                :count - len(claimed)]]
+                    if not reservations:
+                        return claimed
+                    try:
+                        with transaction.atomic(using=self.db):
+                            self.bulk_create(reservations)
+                        reserved = [obj.prospect_id for obj in reservations]
+                    except IntegrityError:
+                        # some were reserved by other callers since the
+                        # candidates were fetched, reserve the others
+                        for reservation in reservations:
+                            try:
+                                with transaction.atomic(using=self.db):
+                                    reservation.save(force_insert=True)
+                                reserved.append(reservation.prospect_id)
+                            except IntegrityError:
+                                continue
+            except OperationalError as exc_:
+                # e.g. "database is locked" on SQLite, which cannot skip
+                # the rows locked by other callers
+                ccall_log.warning(
+                    'Cannot reserve Prospects of Pool %s for %s, retrying: '
+                    '%s', pool.name, caller.username, exc_)
+                continue
+            claimed.extend(reserved)
+            ccall_log.debug('Reserved %s Prospects of Pool %s for %s',
+                            len(claimed), pool.name, caller.username)
+            if len(claimed) >= count:
+                return claimed
+        ccall_log.warning('Cannot reserve %s Prospects of Pool %s for %s',
+                          count - len(claimed), pool.name, caller.username)
+        return claimed
+
+
+class Reservation(models.Model):
+    """
+    Model for a Prospect reserved for a caller.
+    A Prospect is reserved by at most one caller at a time, until the
+    Reservation is released or its lease expires.
+    """
+    objects = ReservationManager()
+
+    caller = models.ForeignKey(
+        PhonathonUser, verbose_name='Caller', on_delete=models.CASCADE)
+    prospect = models.OneToOneField(
+        Prospect, verbose_name='Prospect', on_delete=models.CASCADE)
+    pool = models.ForeignKey(
+        Pool, verbose_name='Pool', on_delete=models.CASCADE)
+    attempt = models.PositiveSmallIntegerField(verbose_name='Attempt')
+    reserved_at = models.DateTimeField(
+        verbose_name='Reserved at', auto_now_add=True)
+    expires_at = models.DateTimeField(
+        verbose_name='Expires at', db_index=True)
+
+    def __str__(self):
+        return '{} - {}'.format(self.prospect, self.caller)
+
+    def to_dict(self, history=False):
+        """
+        Reserved Prospect, as reported to the caller. With history, the
+        Calls of the Prospect are included, oldest first.
+        """
+        prospect = self.prospect
+        data = {
+            'id': self.pk,
+            'pool': self.pool.name,
+            'project': self.pool.project.name,
+            'attempt': self.attempt,
+            'expires_at': self.expires_at.isoformat(),
+            'prospect': {
+                'id': prospect.pk,
+                'nric': prospect.nric,
+                'salutation': prospect.salutation,
+                'name': prospect.name,
+                'email': prospect.email,
+                'phone_home': prospect.phone_home,
+                'phone_mobile': prospect.phone_mobile,
+            },
+        }
+        if history:
+            data['calls'] = [{
+                'attempt': call_obj.attempt,
+                'call_time': call_obj.call_time.isoformat(),
+                'pool_id': call_obj.pool_id,
+                'caller': call_obj.caller.name,
+                'result_code': call_obj.result_code.result_code,
+                'comment': call_obj.comment,
+            } for call_obj in prospect.call_set.all()]
+        return data
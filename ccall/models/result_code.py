@@ -5,12 +5,12 @@ from __future__ import unicode_literals
 
 from django.db import models
 
+from ..lookups import CachedLookupManager
 
-class ResultCodeManager(models.Manager):
-    """Custom manager for ResultCode."""
 
-    def get_by_natural_key(self, result_code):
-        return self.get(result_code=result_code)
+class ResultCodeManager(CachedLookupManager):
+    """Custom manager for ResultCode."""
+    natural_key_fields = ('result_code',)
 
 
 class ResultCode(models.Model):
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-"""
+"""Models for an UploadJob."""
+
+from __future__ import unicode_literals
+
+import logging
+from datetime import timedelta
+
+from django.db import models
+from django.db.models import F
+from django.utils import timezone
+
+from ..models.project import Project
+from ..models.user import PhonathonUser
+
+ccall_log = logging.getLogger('ccall')
+
+# a running job whose worker has not reported progress for this long is
+# taken to have been stopped, e.g. killed during a deploy
+UPLOAD_JOB_TIMEOUT = timedelta(minutes=15)
+
+
+class UploadJobManager(models.Manager):
+    """Custom manager for model UploadJob."""
+
+    def claim(self):
+        """
+        Claim the oldest queued UploadJob for processing.
+        The status is switched with a conditional UPDATE, so concurrent
+        workers never claim the same job. Returns None if none is queued.
+        """
+        for pk in self.filter(status=UploadJob.STATUS_QUEUED).order_by(
+                'pk').values_list('pk', flat=True)[:10]:
+            now = timezone.now()
+            claimed = self.filter(
+                pk=pk, status=UploadJob.STATUS_QUEUED).update(
+                    status=UploadJob.STATUS_RUNNING, started_at=now,
+                    heartbeat_at=now)
+            if claimed:
+                return self.get(pk=pk)
+        return None
+
+    def fail_stale(self, timeout=UPLOAD_JOB_TIMEOUT):
+        """
+        Fail the running UploadJobs whose worker has not reported progress
+        for timeout, so that their status page stops polling. They are not
+        queued again, as their rows may be partly processed. Returns the
+        number of jobs failed.
+        """
+        count = 0
+        stale = self.filter(status=UploadJob.STATUS_RUNNING,
+                            heartbeat_at__lt=timezone.now() - timeout)
+        for job in stale:
+            # only if no worker reported progress meanwhile
+            if self.filter(pk=job.pk, status=UploadJob.STATUS_RUNNING,
+                           heartbeat_at=job.heartbeat_at).exists():
+                job.finish(error='The upload worker stopped while '
+                                 'processing the file, upload it again')
+                ccall_log.error('Failed stale UploadJob: %s', job.pk)
+                count += 1
+        return count
+
+
+class UploadJob(models.Model):
+    """Model for a queued CSV data upload."""
+    objects = UploadJobManager()
+
+    # choices for model
+    MODEL_USER = 'Caller'
+    MODEL_FUND = 'Fund'
+    MODEL_PROSPECT = 'Prospect'
+    MODEL_PLEDGE = 'Pledge'
+    MODEL_CALL = 'Call'
+    MODEL_POOL = 'Pool'
+    MODELS = (
+        (MODEL_USER, MODEL_USER),
+        (MODEL_FUND, MODEL_FUND),
+        (MODEL_PROSPECT, MODEL_PROSPECT),
+        (MODEL_PLEDGE, MODEL_PLEDGE),
+        (MODEL_CALL, MODEL_CALL),
+        (MODEL_POOL, MODEL_POOL),
+    )
+    # choices for status
+    STATUS_QUEUED = 'Queued'
+    STATUS_RUNNING = 'Running'
+    STATUS_DONE = 'Done'
+    STATUS_FAILED = 'Failed'
+    STATUSES = (
+        (STATUS_QUEUED, STATUS_QUEUED),
+        (STATUS_RUNNING, STATUS_RUNNING),
+        (STATUS_DONE, STATUS_DONE),
+        (STATUS_FAILED, STATUS_FAILED),
+    )
+
+    model = models.CharField(
+        max_length=10, choices=MODELS, verbose_name='Data type')
+    uploaded_file = models.FileField(
+        upload_to='uploads/%Y/%m/%d/', verbose_name='Upload file')
+    project = models.ForeignKey(
+        Project, on_delete=models.CASCADE, null=True, blank=True,
+        verbose_name='Project')
+    pool_name = models.CharField(
+        max_length=50, blank=True, verbose_name='Pool name')
+    replace = models.BooleanField(
+        default=False, verbose_name='Remove Prospects not in file')
+    user = models.ForeignKey(
+        PhonathonUser, on_delete=models.SET_NULL, null=True, blank=True,
+        verbose_name='Uploaded by')
+    status = models.CharField(
+        max_length=10, choices=STATUSES, default=STATUS_QUEUED,
+        db_index=True)
+    rows_processed = models.PositiveIntegerField(default=0)
+    rows_created = models.PositiveIntegerField(default=0)
+    rows_updated = models.PositiveIntegerField(default=0)
+    rows_skipped = models.PositiveIntegerField(default=0)
+    # repeated rows of a new object, merged into it
+    rows_merged = models.PositiveIntegerField(default=0)
+    rows_failed = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(
+        verbose_name='Queued at', auto_now_add=True)
+    started_at = models.DateTimeField(
+        verbose_name='Started at', null=True, blank=True)
+    # last time the worker reported progress
+    heartbeat_at = models.DateTimeField(
+        verbose_name='Last heartbeat', null=True, blank=True)
+    finished_at = models.DateTimeField(
+        verbose_name='Finished at', null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return '{} upload #{} ({})'.format(self.model, self.pk, self.status)
+
+    @property
+    def rows_per_second(self):
+        """Throughput of the upload so far."""
+        if not self.started_at:
+            return 0.0
+        end = self.finished_at or timezone.now()
+        elapsed = (end - self.started_at).total_seconds()
+        return self.rows_processed / elapsed if elapsed > 0 else 0.0
+
+    def add_progress(self, processed, created, updated, skipped=0,
+                     merged=0):
+        """
+        Record the outcome of one processed chunk.
+        updated counts every matched row, including the skipped ones, and
+        merged the repeated rows of created objects. The other rows failed.
+        """
+        failed = processed - created - updated - merged
+        updated -= skipped
+        self.heartbeat_at = timezone.now()
+        UploadJob.objects.filter(pk=self.pk).update(
+            rows_processed=F('rows_processed') + processed,
+            rows_created=F('rows_created') + created,
+            rows_updated=F('rows_updated') + updated,
+            rows_skipped=F('rows_skipped') + skipped,
+            rows_merged=F('rows_merged') + merged,
+            rows_failed=F('rows_failed') + failed,
+            heartbeat_at=self.heartbeat_at)
+        self.rows_processed += processed
+        self.rows_created += created
+        self.rows_updated += updated
+        self.rows_skipped += skipped
+        self.rows_merged += merged
+        self.rows_failed += failed
+
+    def finish(self, error=''):
+        """
+        Mark the job as done, or as failed with an error, and delete the
+        uploaded file. Its name is kept for reference.
+        """
+        self.status = self.STATUS_FAILED if error else self.STATUS_DONE
+        self.error = error
+        self.finished_at = timezone.now()
+        self.save(update_fields=['status', 'error', 'finished_at'])
+        if self.uploaded_file:
+            self.uploaded_file.storage.delete(self.uploaded_file.name)
+
+    def to_dict(self):
+        """Status of the job, as reported to the client."""
+        return {
+            'id': self.pk,
+            'model': self.model,
+            'status': self.status,
+            'rows_processed': self.rows_processed,
+            'rows_created': self.rows_created,
+            'rows_updated': self.rows_updated,
+            'rows_skipped': self.rows_skipped,
+            'rows_merged': self.rows_merged,
+            'rows_failed': self.rows_failed,
+            'rows_per_second': round(self.rows_per_second, 1),
+            'error': self.error,
+        }
@@ -4,60 +4,260 @@
 from __future__ import unicode_literals
 
 import logging
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 
 from django.core.validators import MinValueValidator
-from django.contrib.auth.models import AbstractUser, UserManager
-from django.db import IntegrityError, models, transaction
+from django.contrib.auth.hashers import check_password, make_password
+from django.contrib.auth.models import AbstractUser, Group, UserManager
+from django.db import models, transaction
+from django.db.models import Exists, OuterRef
 from django.utils import timezone
+from django.utils.functional import cached_property
 
+from ..auth import clear_cached_users
+from ..instrumentation import instrumented_upload, upload_chunks
 from ..models.pool import Pool
+from ..utils import (UPLOAD_CHUNK_SIZE, bulk_create_rows, bulk_update_rows,
+                     chunked, count_merged, diff_row)
 
 ccall_log = logging.getLogger('ccall')
 
+# depth of the bulk_group_changes blocks entered by each thread
+_bulk_group_changes = threading.local()
+
+
+@contextmanager
+def bulk_group_changes():
+    """
+    Within the block, group changes made by this thread leave the staff
+    status of the users alone, for the caller to recompute in bulk.
+    """
+    depth = getattr(_bulk_group_changes, 'depth', 0)
+    _bulk_group_changes.depth = depth + 1
+    try:
+        yield
+    finally:
+        _bulk_group_changes.depth = depth
+
+
+def in_bulk_group_changes():
+    """Whether this thread is within a bulk_group_changes block."""
+    return getattr(_bulk_group_changes, 'depth', 0) > 0
+
+
+# fewest passwords to hash in a chunk for a pool of processes to be worth
+# feeding, below it they are hashed in this process
+HASH_POOL_MIN_PASSWORDS = 32
+
+
+def _hash_password(task):
+    """
+    Hash a raw password for an upload.
+    task is a (raw password, stored hash) pair. Returns None if the stored
+    hash already verifies the raw password, else a new hash.
+    """
+    raw_password, encoded = task
+    if encoded and check_password(raw_password, encoded):
+        return None
+    return make_password(raw_password)
+
 
 class PhonathonUserManager(UserManager):
     """Custom manager for model PhonathonUser."""
 
-    def from_upload(self, data):
-        """Process data from User upload."""
+    @instrumented_upload
+    def from_upload(self, data, chunk_size=UPLOAD_CHUNK_SIZE, workers=None,
+                    executor=None, stats=None):
+        """
+        Process data from User upload.
+        Passwords are only rehashed if the stored hash does not verify the
+        uploaded password. Hashes are computed in this process, unless more
+        than one workers is given: chunks with at least
+        HASH_POOL_MIN_PASSWORDS passwords to hash are then spread across a
+        pool of workers processes, or across executor if given, which is
+        left running. Hashes are written in bulk per chunk.
+        Unchanged users are not written, and counted in stats['skipped'].
+        Repeated rows of a created user are counted in stats['merged'].
+        """
+        created = []
+        updated = []
+        workers = workers or 1
+        own_executor = None
+        if executor is None and workers > 1:
+            # worker processes are only started once a hash is submitted
+            executor = own_executor = ProcessPoolExecutor(workers)
+        try:
+            for chunk in upload_chunks(data, chunk_size):
+                chunk_created, chunk_updated = self._upload_chunk(
+                    chunk, executor, workers, stats)
+                created.extend(chunk_created)
+                updated.extend(chunk_updated)
+        finally:
+            if own_executor is not None:
+                own_executor.shutdown()
+        return created, updated
+
+    def _upload_chunk(self, data, executor, workers, stats):
+        """Process one chunk of data from User upload."""
+        existing = {obj.username: obj for obj in self.filter(
+            username__in={obj.get('username') for obj in data})}
+        pending = OrderedDict()
+        repeats = Counter()
+        matched = []
         for obj in data:
             try:
                 # default password = username if not exist
                 username = obj['username']
                 if 'password' not in obj or not obj['password']:
                     obj['password'] = username
-                user_obj = self.get_by_natural_key(username)
-                # update user
-                update_obj = {}
-                for attr, value in obj.items():
-                    if value != getattr(user_obj, attr):
-                        setattr(user_obj, attr, value)
-                        update_obj[attr] = value
-                # manually set password
-                user_obj.set_password(obj['password'])
-                user_obj.save()
-                ccall_log.debug('Updated PhonathonUser object %s: %s',
-                                username, update_obj)
-            except PhonathonUser.DoesNotExist:
-                # create new user
-                try:
-                    with transaction.atomic():
-                        user_obj = self.create_user(**obj)
-                        ccall_log.debug(
-                            'Created PhonathonUser object: %s', obj)
-                except IntegrityError:
-                    ccall_log.error(
-                        'Cannot create PhonathonUser object: %s', obj)
+                if username in existing:
+                    # update user
+                    user_obj = existing[username]
+                    update_obj = diff_row(user_obj, {
+                        attr: value for attr, value in obj.items()
+                        if attr != 'password'})
+                    matched.append((user_obj, update_obj, obj['password']))
+                elif username in pending:
+                    # repeated row for a user created in this chunk
+                    user_obj, _, _ = pending[username]
+                    for attr, value in obj.items():
+                        if attr != 'password':
+                            setattr(user_obj, attr, value)
+                    pending[username] = (user_obj, obj, obj['password'])
+                    repeats[username] += 1
+                else:
+                    # create new user
+                    pending[username] = (
+                        self._new_user(obj), obj, obj['password'])
             except BaseException as exc_:
                 ccall_log.exception(exc_)
                 ccall_log.error(
                     'Exception encountered on PhonathonUser object: %s', obj)
 
+        # hash passwords, skipping the ones that still verify
+        tasks = [(raw_password, user_obj.password)
+                 for user_obj, _, raw_password in matched]
+        tasks.extend((raw_password, '')
+                     for _, _, raw_password in pending.values())
+        if executor is not None and len(tasks) >= HASH_POOL_MIN_PASSWORDS:
+            hashes = list(executor.map(
+                _hash_password, tasks,
+                chunksize=max(1, len(tasks) // (workers * 4))))
+        else:
+            hashes = [_hash_password(task) for task in tasks]
+
+        updated = []
+        changes = []
+        skipped = 0
+        for (user_obj, update_obj, _), encoded in zip(matched, hashes):
+            if encoded is not None:
+                user_obj.password = encoded
+                update_obj['password'] = '********'
+            if update_obj:
+                changes.append((user_obj, update_obj))
+                ccall_log.debug('Updated PhonathonUser object %s: %s',
+                                user_obj.username, update_obj)
+            else:
+                skipped += 1
+            updated.append(user_obj)
+        failed = bulk_update_rows(self, changes)
+        # bulk writes send no signals, drop the changed users from the cache
+        self.clear_user_cache(obj.pk for obj, _ in changes)
+        if failed:
+            updated = [obj for obj in updated if obj.pk not in failed]
+
+        for (user_obj, _, _), encoded in zip(
+                pending.values(), hashes[len(matched):]):
+            user_obj.password = encoded
+        created = bulk_create_rows(self, [
+            (user_obj, obj) for user_obj, obj, _ in pending.values()])
+        if stats is not None:
+            stats['skipped'] += skipped
+            stats['merged'] += count_merged(pending, repeats, created)
+        return created, updated
+
+    def refresh_staff_status(self, user_ids):
+        """
+        Recompute the staff status of users by id from their groups, with
+        one UPDATE. Returns the number of users.
+        """
+        staff_groups = self.model.groups.through.objects.filter(
+            phonathonuser=OuterRef('pk'),
+            group__name__in=[name for name, _ in self.model.ROLE_GROUPS])
+        user_ids = list(user_ids)
+        self.clear_user_cache(user_ids)
+        return self.filter(pk__in=user_ids).update(
+            is_staff=Exists(staff_groups))
+
+    def clear_user_cache(self, user_ids):
+        """
+        Drop users by id from the cache of authenticated users, after
+        writes bypassing signals.
+        """
+        clear_cached_users(user_ids, using=self.db)
+
+    def assign_group(self, users, name, replace=()):
+        """
+        Add users (a queryset or list of users) to the group name, removing
+        them from the other groups named in replace, then recompute their
+        staff status. Each group change and the staff status take one
+        statement per UPLOAD_CHUNK_SIZE users, and users are not saved one
+        by one. Returns the ids of the users.
+        """
+        if hasattr(users, 'values_list'):
+            user_ids = list(users.values_list('pk', flat=True))
+        else:
+            user_ids = [obj.pk for obj in users]
+        groups = Group.objects.db_manager(self.db)
+        group = groups.get(name=name)
+        removed = list(groups.filter(name__in=replace).exclude(pk=group.pk))
+        with transaction.atomic(using=self.db), bulk_group_changes():
+            for batch in chunked(user_ids, UPLOAD_CHUNK_SIZE):
+                for removed_group in removed:
+                    removed_group.user_set.remove(*batch)
+                group.user_set.add(*batch)
+                self.refresh_staff_status(batch)
+        ccall_log.debug('Assigned %s users to group %s', len(user_ids), name)
+        return user_ids
+
+    def _new_user(self, obj):
+        """Build an unsaved user from an uploaded row, as create_user does."""
+        extra_fields = {attr: value for attr, value in obj.items()
+                        if attr != 'password'}
+        extra_fields['username'] = self.model.normalize_username(
+            extra_fields['username'])
+        if 'email' in extra_fields:
+            extra_fields['email'] = self.normalize_email(
+                extra_fields['email'])
+        return self.model(**extra_fields)
+
 
 class PhonathonUser(AbstractUser):
     """Model for a User."""
     objects = PhonathonUserManager()
 
+    # roles, from the least to the most privileged
+    ROLE_CALLER = 1
+    ROLE_SUPERVISOR = 2
+    ROLE_MANAGER = 3
+    ROLE_ADMIN = 4
+    ROLES = OrderedDict([
+        (ROLE_CALLER, 'Caller'),
+        (ROLE_SUPERVISOR, 'Supervisor'),
+        (ROLE_MANAGER, 'Manager'),
+        (ROLE_ADMIN, 'Admin'),
+    ])
+    # groups granting a role, the most privileged first
+    ROLE_GROUPS = (
+        ('Managers', ROLE_MANAGER),
+        ('Supervisors', ROLE_SUPERVISOR),
+    )
+    # groups users are assigned one of
+    GROUPS = ('Managers', 'Supervisors', 'Callers')
+
     username = models.CharField(max_length=15, unique=True)
     name = models.CharField(
         max_length=50, verbose_name='Full name', blank=False)
@@ -71,10 +271,43 @@ class PhonathonUser(AbstractUser):
     def __str__(self):
         return '{} ({})'.format(self.name, self.username)
 
+    @cached_property
+    def group_names(self):
+        """
+        Names of the groups of the user, loaded once per instance, so once
+        per request for request.user. Cleared by clear_role_cache.
+        """
+        if self.pk is None:
+            return frozenset()
+        return frozenset(self.groups.values_list('name', flat=True))
+
+    def clear_role_cache(self):
+        """Forget the groups loaded by group_names."""
+        self.__dict__.pop('group_names', None)
+
+    @property
+    def role(self):
+        """Most privileged role of the user, one of ROLES."""
+        if self.is_superuser:
+            return self.ROLE_ADMIN
+        for group, role in self.ROLE_GROUPS:
+            if group in self.group_names:
+                return role
+        return self.ROLE_CALLER
+
+    def get_role_display(self):
+        """Name of the role of the user."""
+        return self.ROLES[self.role]
+
     @property
     def is_manager_and_above(self):
         """Check whether an user is a Manager or above."""
-        return self.is_superuser or self.groups.filter(name='Managers').count()
+        return self.role >= self.ROLE_MANAGER
+
+    @property
+    def is_supervisor_and_above(self):
+        """Check whether an user is a Supervisor or above."""
+        return self.role >= self.ROLE_SUPERVISOR
 
 
 class Assignment(models.Model):
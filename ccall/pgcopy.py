@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Staging of uploads with COPY FROM STDIN on PostgreSQL for app ccall."""
+
+from __future__ import unicode_literals
+
+import io
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connections
+
+# number of rows staged per COPY statement, and processed per upload by the
+# upload worker when uploads are staged with COPY
+COPY_CHUNK_SIZE = 50000
+# errors raised by db_value for values a column would reject
+INVALID_VALUE_ERRORS = (TypeError, ValueError, ArithmeticError,
+                        ValidationError)
+
+
+def uses_copy(manager):
+    """
+    Whether uploads through manager are staged with COPY: on PostgreSQL,
+    unless settings.UPLOAD_COPY is False.
+    """
+    return connections[manager.db].vendor == 'postgresql' and \
+        getattr(settings, 'UPLOAD_COPY', True)
+
+
+def copy_text(value):
+    """A value in the text format of COPY."""
+    if value is None:
+        return '\\N'
+    return '{}'.format(value).replace('\\', '\\\\').replace(
+        '\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def db_value(field, value, connection):
+    """
+    An uploaded value of a model field as written by COPY. Values that the
+    column would reject, and that would fail the whole COPY, raise one of
+    INVALID_VALUE_ERRORS instead.
+    """
+    if value == '' and field.null:
+        value = None
+    value = field.to_python(value)
+    if value is None:
+        if not field.null:
+            raise ValueError('{} cannot be null'.format(field.name))
+        return None
+    if field.max_length is not None and len(value) > field.max_length:
+        raise ValueError('{} is longer than {} characters'.format(
+            field.name, field.max_length))
+    if field.get_internal_type().startswith('Positive') and value < 0:
+        raise ValueError('{} cannot be negative'.format(field.name))
+    return field.get_db_prep_save(value, connection)
+
+
+class StagingTable(object):
+    """
+    Temporary table of uploaded rows, filled with COPY FROM STDIN, for the
+    duration of a with block within a transaction. Rows are numbered in
+    upload order in the _row column, so that the last of repeated rows can
+    be told apart.
+    """
+
+    def __init__(self, connection, name, columns, resolved=()):
+        self.connection = connection
+        self.name = name
+        # (column, type) pairs copied, and of the columns filled in later
+        self.columns = list(columns)
+        self.resolved = list(resolved)
+        self.rows = 0
+
+    def quoted(self, name):
+        """A quoted column or table name."""
+        return self.connection.ops.quote_name(name)
+
+    def __enter__(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS {}'.format(
+                self.quoted(self.name)))
+            cursor.execute(
+                'CREATE TEMPORARY TABLE {} (_row integer, {}) '
+                'ON COMMIT DROP'.format(self.quoted(self.name), ', '.join(
+                    '{} {}'.format(self.quoted(column), db_type)
+                    for column, db_type in self.columns + self.resolved)))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            with self.connection.cursor() as cursor:
+                cursor.execute('DROP TABLE {}'.format(
+                    self.quoted(self.name)))
+
+    def copy(self, rows):
+        """Append rows, sequences of values in column order, with one COPY."""
+        buffer = io.StringIO()
+        for values in rows:
+            self.rows += 1
+            buffer.write('\t'.join(
+                [str(self.rows)] + [copy_text(value) for value in values]))
+            buffer.write('\n')
+        if not buffer.tell():
+            return
+        buffer.seek(0)
+        with self.connection.cursor() as cursor:
+            cursor.copy_expert('COPY {} (_row, {}) FROM STDIN'.format(
+                self.quoted(self.name), ', '.join(
+                    self.quoted(column) for column, _ in self.columns)),
+                buffer)
+
+    def format(self, sql):
+        """sql with {staging} replaced by the quoted name of the table."""
+        return sql.format(staging=self.quoted(self.name))
+
+    def execute(self, sql, params=None):
+        """Run sql, formatted. Returns the rows returned, if any."""
+        with self.connection.cursor() as cursor:
+            cursor.execute(self.format(sql), params)
+            return cursor.fetchall() if cursor.description else []
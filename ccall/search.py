@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Search index of the Prospects of app ccall."""
+
+from __future__ import unicode_literals
+
+import logging
+import re
+from functools import reduce
+from operator import and_, or_
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Q
+
+from .utils import UPLOAD_CHUNK_SIZE, bulk_update, chunked
+
+ccall_log = logging.getLogger('ccall')
+
+# SQLite FTS5 table holding the searchable columns of each Prospect, by id
+FTS_TABLE = 'ccall_prospect_search'
+FTS_COLUMNS = ('nric', 'name', 'email', 'phones')
+# maximum number of Prospects returned by a search
+SEARCH_RESULTS_MAX = 1000
+# fields matched by the fallback search, trigram indexed on PostgreSQL
+SEARCH_FIELDS = ('nric', 'name', 'email', 'phone_digits')
+
+
+def normalize_phone(value):
+    """Digits of a phone number, without the Singapore country code."""
+    digits = re.sub(r'\D', '', value or '')
+    if len(digits) > 8 and digits.startswith('65'):
+        digits = digits[2:]
+    return digits
+
+
+def phone_digits(*phones):
+    """Normalised digits of phone numbers, space separated."""
+    return ' '.join(digits for digits in map(normalize_phone, phones)
+                    if digits)
+
+
+def has_fts_table(connection):
+    """Whether the FTS5 table of Prospects exists on a connection."""
+    with connection.cursor() as cursor:
+        return FTS_TABLE in connection.introspection.table_names(cursor)
+
+
+class ProspectIndex(object):
+    """
+    Search index of Prospects over their NRIC, name, email and phones.
+    On SQLite with FTS5 the index is a full-text table, written along with
+    the Prospects. Elsewhere the Prospect columns are searched directly,
+    with trigram indexes on PostgreSQL.
+    """
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.connection = connections[using]
+
+    @property
+    def uses_fts(self):
+        """Whether the full-text table is available, checked once per db."""
+        key = (self.using, self.connection.settings_dict['NAME'])
+        if key not in _fts_tables:
+            _fts_tables[key] = self.connection.vendor == 'sqlite' and \
+                has_fts_table(self.connection)
+        return _fts_tables[key]
+
+    def update(self, prospects):
+        """Write the searchable columns of saved Prospects to the index."""
+        if not self.uses_fts:
+            return
+        prospects = [obj for obj in prospects if obj.pk is not None]
+        for batch in chunked(prospects, UPLOAD_CHUNK_SIZE):
+            self.remove([obj.pk for obj in batch])
+            with self.connection.cursor() as cursor:
+                cursor.executemany(
+                    'INSERT INTO {} (rowid, {}) VALUES (%s, {})'.format(
+                        FTS_TABLE, ', '.join(FTS_COLUMNS),
+                        ', '.join(['%s'] * len(FTS_COLUMNS))),
+                    [(obj.pk, obj.nric, obj.name, obj.email,
+                      obj.phone_digits) for obj in batch])
+
+    def remove(self, ids):
+        """Remove Prospects from the index by id."""
+        if not self.uses_fts or not ids:
+            return
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {} WHERE rowid IN ({})'.format(
+                    FTS_TABLE, ', '.join(['%s'] * len(ids))), list(ids))
+
+    def rebuild(self):
+        """
+        Recompute the phone digits of every Prospect, and index them all
+        from scratch. Returns the number of Prospects.
+        """
+        from .models.prospect import Prospect
+        if self.uses_fts:
+            with self.connection.cursor() as cursor:
+                cursor.execute('DELETE FROM {}'.format(FTS_TABLE))
+        count = 0
+        prospects = Prospect.objects.using(self.using).only(
+            'nric', 'name', 'email', 'phone_home', 'phone_mobile',
+            'phone_digits').order_by('pk')
+        for batch in chunked(prospects.iterator(), UPLOAD_CHUNK_SIZE):
+            bulk_update(Prospect.objects.using(self.using),
+                        [obj for obj in batch if obj.set_phone_digits()],
+                        ['phone_digits'])
+            self.update(batch)
+            count += len(batch)
+        ccall_log.debug('Indexed %s Prospects for search', count)
+        return count
+
+    def match_expression(self, query):
+        """
+        FTS5 query matching every word of query as a prefix. A query of
+        digits only is matched against the phone numbers.
+        """
+        if not re.search(r'[^\d\s()+-]', query):
+            digits = normalize_phone(query)
+            return 'phones : "{}"*'.format(digits) if digits else ''
+        words = re.findall(r'\w+', query.lower(), re.UNICODE)
+        return ' '.join('"{}"*'.format(word) for word in words)
+
+    def search_ids(self, query, limit=20):
+        """Ids of the Prospects matching query, best matches first."""
+        limit = min(limit, SEARCH_RESULTS_MAX)
+        if self.uses_fts:
+            expression = self.match_expression(query)
+            if not expression:
+                return []
+            with self.connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT rowid FROM {0} WHERE {0} MATCH %s '
+                    'ORDER BY rank LIMIT %s'.format(FTS_TABLE),
+                    [expression, limit])
+                return [row[0] for row in cursor.fetchall()]
+        return list(self.filter(query).order_by('name', 'pk').values_list(
+            'pk', flat=True)[:limit])
+
+    def filter(self, query):
+        """Prospects with every word of query in one of their columns."""
+        from .models.prospect import Prospect
+        prospects = Prospect.objects.using(self.using)
+        if not re.search(r'[^\d\s()+-]', query):
+            digits = normalize_phone(query)
+            if not digits:
+                return prospects.none()
+            return prospects.filter(phone_digits__contains=digits)
+        words = query.split()
+        if not words:
+            return prospects.none()
+        return prospects.filter(reduce(and_, (
+            reduce(or_, (Q(**{'{}__icontains'.format(field): word})
+                         for field in SEARCH_FIELDS))
+            for word in words)))
+
+    def search(self, query, limit=20):
+        """Prospects matching query, best matches first."""
+        from .models.prospect import Prospect
+        ids = self.search_ids(query, limit)
+        prospects = Prospect.objects.using(self.using).in_bulk(ids)
+        return [prospects[pk] for pk in ids if pk in prospects]
+
+
+# whether the full-text table exists, by (alias, database name)
+_fts_tables = {}
+
+
+def prospect_index(using=DEFAULT_DB_ALIAS):
+    """The ProspectIndex of a database."""
+    return ProspectIndex(using)
@@ -3,16 +3,126 @@
 
 from __future__ import unicode_literals
 
-from django.db.models.signals import m2m_changed
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
 
-from .models.user import PhonathonUser
+from .models.call import Call
+from .models.call_rollup import CallRollup
+from .models.fund import Fund
+from .models.pool import Pool
+from .models.project import Project
+from .models.prospect import Prospect
+from .models.prospect_status import ProspectStatus
+from .models.result_code import ResultCode
+from .models.user import PhonathonUser, in_bulk_group_changes
+from .search import prospect_index
+from .utils import apply_sqlite_pragmas
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    """Tune new SQLite connections with the PRAGMAs of the settings."""
+    if connection.vendor == 'sqlite':
+        apply_sqlite_pragmas(connection)
+
+
+@receiver(m2m_changed, sender=PhonathonUser.groups.through)
+def add_staff_status(sender, action, instance, reverse, pk_set, using,
+                     **kwargs):
+    """
+    Add staff status to managers and supervisors. Does nothing within
+    bulk_group_changes, where the staff status is recomputed in bulk.
+    """
+    if action not in ['post_remove', 'post_add', 'post_clear']:
+        return
+    if reverse:
+        # users added to or removed from a group
+        if pk_set and not in_bulk_group_changes():
+            PhonathonUser.objects.db_manager(using).refresh_staff_status(
+                pk_set)
+        return
+    # the groups of the user changed, reload its role on next access
+    instance.clear_role_cache()
+    if action != 'post_clear' and not in_bulk_group_changes():
+        instance.is_staff = any(group in instance.group_names
+                                for group, _ in PhonathonUser.ROLE_GROUPS)
+        instance.save(update_fields=['is_staff'])
+
+
+@receiver([post_save, post_delete], sender=PhonathonUser)
+def clear_cached_user(sender, instance, using, **kwargs):
+    """Drop a changed user from the cache of authenticated users."""
+    sender.objects.db_manager(using).clear_user_cache([instance.pk])
 
 
 @receiver(m2m_changed, sender=PhonathonUser.groups.through)
-def add_staff_status(sender, action, instance, **kwargs):
-    """Add staff status to managers and supervisors."""
-    if action in ['post_remove', 'post_add']:
-        instance.is_staff = instance.groups.filter(
-            name__in=['Managers', 'Supervisors']).exists()
-        instance.save()
+def clear_cached_group_users(sender, action, instance, reverse, pk_set,
+                             using, **kwargs):
+    """
+    Drop users whose groups changed from the cache of authenticated users,
+    as their role changed.
+    """
+    users = PhonathonUser.objects.db_manager(using)
+    if not reverse:
+        if action in ['post_remove', 'post_add', 'post_clear']:
+            users.clear_user_cache([instance.pk])
+    elif action in ['post_remove', 'post_add']:
+        users.clear_user_cache(pk_set or ())
+    elif action == 'pre_clear':
+        # the users of a cleared group are only known before
+        users.clear_user_cache(
+            instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=Pool.prospects.through)
+def rewind_claim_cursor(sender, action, instance, reverse, pk_set, using,
+                        **kwargs):
+    """
+    Rewind the claim cursor of Pools losing members, whose ids may be given
+    to new members.
+    """
+    pools = Pool.objects.db_manager(using)
+    if not reverse:
+        if action in ['post_remove', 'post_clear']:
+            pools.rewind_claim_cursor([instance.pk])
+    elif action == 'post_remove':
+        pools.rewind_claim_cursor(pk_set or ())
+    elif action == 'pre_clear':
+        # the Pools of a cleared Prospect are only known before
+        pools.rewind_claim_cursor(
+            instance.prospect_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Call)
+def refresh_prospect_status(sender, instance, using, **kwargs):
+    """Refresh the status of the Prospect of a deleted Call."""
+    ProspectStatus.objects.db_manager(using).refresh(
+        [(instance.pool_id, instance.prospect_id)])
+
+
+@receiver(post_delete, sender=Call)
+def refresh_call_rollup(sender, instance, using, **kwargs):
+    """Refresh the rollups of a deleted Call."""
+    CallRollup.objects.db_manager(using).refresh_calls([instance])
+
+
+@receiver(post_save, sender=Prospect)
+def index_prospect(sender, instance, using, **kwargs):
+    """Write a saved Prospect to the search index."""
+    prospect_index(using).update([instance])
+
+
+@receiver(post_delete, sender=Prospect)
+def unindex_prospect(sender, instance, using, **kwargs):
+    """Remove a deleted Prospect from the search index."""
+    prospect_index(using).remove([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Fund)
+@receiver([post_save, post_delete], sender=Pool)
+@receiver([post_save, post_delete], sender=Project)
+@receiver([post_save, post_delete], sender=ResultCode)
+def clear_lookup_cache(sender, using, **kwargs):
+    """Invalidate the cached lookup table of a changed model."""
+    sender._default_manager.db_manager(using).clear_lookup_cache()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Mixins for tests."""
+
+from __future__ import unicode_literals
+
+from contextlib import contextmanager
+
+from ..instrumentation import record_uploads
+
+
+class QueryBudgetMixin(object):
+    """Assertions on the SQL statements run by uploads, for a TestCase."""
+
+    @contextmanager
+    def assertQueryBudget(self, queries_per_1000_rows, chunk_queries=None):
+        """
+        Fail if an upload within the block runs more statements than
+        queries_per_1000_rows for every 1,000 rows, or with chunk_queries,
+        more than chunk_queries statements for any one chunk.
+        Yields the list of recorded UploadMetrics.
+        """
+        with record_uploads() as uploads:
+            yield uploads
+        self.assertTrue(uploads, 'No upload was run')
+        for metrics in uploads:
+            if metrics.queries_per_1000_rows > queries_per_1000_rows:
+                self.fail('{} exceeds the budget of {} queries per 1,000 '
+                          'rows ({:.1f} queries per 1,000 rows)'.format(
+                              metrics, queries_per_1000_rows,
+                              metrics.queries_per_1000_rows))
+            if chunk_queries is None:
+                continue
+            for i, chunk in enumerate(metrics.chunks):
+                if chunk['queries'] > chunk_queries:
+                    self.fail('{} exceeds the budget of {} queries per '
+                              'chunk ({} queries for chunk {} of {} '
+                              'rows)'.format(metrics, chunk_queries,
+                                             chunk['queries'], i,
+                                             chunk['rows']))
+
+    def assertConstantQueries(self, upload, small_rows, large_rows,
+                              queries_per_1000_rows):
+        """
+        Fail unless upload runs as many statements for large_rows as for
+        small_rows, and within queries_per_1000_rows for large_rows, so
+        that the statements do not depend on the number of rows.
+        """
+        with record_uploads() as small:
+            upload(small_rows)
+        self.assertTrue(small, 'No upload was run')
+        with self.assertQueryBudget(queries_per_1000_rows) as large:
+            upload(large_rows)
+        # the outer upload finishes last
+        self.assertEqual(
+            large[-1].queries, small[-1].queries,
+            '{} runs more statements than {}'.format(large[-1], small[-1]))
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Tests for the cache of authenticated users."""
+
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from ..auth import session_user_key
+from ..models.user import PhonathonUser
+
+# tables read to authenticate a request without the cache
+AUTH_TABLES = ('ccall_phonathonuser', 'django_session', 'auth_group')
+# users are only cached in a cache shared by every process
+CACHE_DIR = os.path.join(tempfile.gettempdir(), 'ccall-test-auth-cache')
+
+
+@override_settings(
+    CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR}},
+    SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+class TestCachedUser(TestCase):
+    """Tests for serving request.user from the cache."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = PhonathonUser.objects.create_user(
+            username='caller', password='caller', name='Caller')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+        super(TestCachedUser, cls).tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username='caller', password='caller')
+
+    def auth_queries(self, path='/ccall/'):
+        """Response to a GET of path, and its queries of AUTH_TABLES."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        return response, [
+            query['sql'] for query in queries
+            if any(table in query['sql'] for table in AUTH_TABLES)]
+
+    def test_cached_user(self):
+        """Test hot requests read neither the user nor the session."""
+        response, queries = self.auth_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(queries)
+        response, queries = self.auth_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+        self.assertEqual(response.context['user'], self.user)
+
+    def test_group_change(self):
+        """Test users are reloaded once their groups change."""
+        response, _ = self.auth_queries('/admin/dashboard/')
+        self.assertEqual(response.status_code, 302)
+        self.user.groups.add(Group.objects.get(name='Supervisors'))
+        response, _ = self.auth_queries('/admin/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        PhonathonUser.objects.assign_group([self.user], 'Callers',
+                                           replace=PhonathonUser.GROUPS)
+        response, _ = self.auth_queries('/admin/dashboard/')
+        self.assertEqual(response.status_code, 302)
+
+    def test_password_change(self):
+        """Test sessions are logged out once the password changes."""
+        self.auth_queries()
+        self.user.set_password('changed')
+        self.user.save()
+        response, _ = self.auth_queries()
+        self.assertEqual(response.status_code, 302)
+
+    def test_password_not_cached(self):
+        """Test the password hash of a cached user is neither cached nor
+        overwritten when the cached user is saved."""
+        self.auth_queries()
+        response, _ = self.auth_queries()
+        cookie = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        _, _, cached = cache.get(session_user_key(cookie))
+        self.assertNotIn('password', cached.__dict__)
+        user = response.context['user']
+        PhonathonUser.objects.filter(pk=self.user.pk).update(name='Renamed')
+        user.name = 'Caller'
+        user.save()
+        user = PhonathonUser.objects.get(pk=self.user.pk)
+        self.assertEqual(user.name, 'Caller')
+        self.assertTrue(user.check_password('caller'))
+
+    def test_sessions_keep_apart(self):
+        """Test the user is cached by session."""
+        self.auth_queries()
+        self.client.logout()
+        response, _ = self.auth_queries()
+        self.assertEqual(response.status_code, 302)
+
+    @override_settings(
+        SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookies(self):
+        """Test users are cached with sessions kept in signed cookies."""
+        self.client.login(username='caller', password='caller')
+        self.auth_queries()
+        response, queries = self.auth_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_local_memory_cache(self):
+        """Test users are not cached in a local-memory cache, which other
+        processes would not see invalidated."""
+        self.auth_queries()
+        response, queries = self.auth_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(queries)
+        self.assertEqual(response.context['user'], self.user)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Tests for benchmarks."""
+
+from __future__ import unicode_literals
+
+from collections import Counter
+
+from django.test import TestCase
+
+from ..benchmarks import generators
+from ..benchmarks.concurrency import (database_profiles, load_writers,
+                                      upload_prospects, write_calls)
+from ..benchmarks.database import measure, peak_rss_kb
+from ..benchmarks.lookups import load_calls, time_lookups
+from ..benchmarks.uploads import run_upload_benchmark_process
+from ..instrumentation import QueryCounter
+from ..models.call import Call
+from ..models.fund import Fund
+from ..models.pledge import Pledge
+from ..models.pool import Pool
+from ..models.project import Project
+from ..models.prospect import Prospect
+from ..models.result_code import ResultCode
+from ..models.user import PhonathonUser
+
+
+class TestGenerators(TestCase):
+    """Tests for the synthetic upload data."""
+
+    def test_generated_rows_upload(self):
+        """Test generated rows are accepted by the upload managers."""
+        project = Project.objects.create(name='Project 1')
+        PhonathonUser.objects.from_upload(
+            generators.user_rows(2), workers=1)
+        Fund.objects.from_upload(generators.fund_rows(2))
+        Pool.objects.from_upload(
+            project, 'Pool 1', generators.prospect_rows(4))
+        Pledge.objects.from_upload(generators.pledge_rows(5, 4, 2))
+        Call.objects.from_upload(generators.call_rows(
+            10, 2, 4, 'Project 1', 'Pool 1', ['No Answer']))
+        self.assertEqual(Prospect.objects.count(), 4)
+        self.assertEqual(Pledge.objects.count(), 5)
+        self.assertEqual(Call.objects.count(), 10)
+        self.assertEqual(Call.objects.filter(attempt=3).count(), 2)
+
+
+class TestLookupBenchmark(TestCase):
+    """Tests for the Call lookup benchmark."""
+
+    def test_lookups(self):
+        """Test synthetic Calls are loaded and each lookup is one query."""
+        keys = load_calls(40, chunk_size=15)
+        self.assertEqual(Call.objects.count(), 40)
+        self.assertEqual(len(set(keys)), 40)
+        results = []
+        time_lookups(keys, 'with indexes', results, lookups=10)
+        self.assertEqual(
+            [result['benchmark'] for result in results],
+            ['natural key with indexes', 'latest call with indexes',
+             'caller calls with indexes'])
+        self.assertEqual({result['queries'] for result in results}, {10})
+
+
+class TestConcurrencyBenchmark(TestCase):
+    """Tests for the concurrent write benchmark."""
+
+    def test_writers(self):
+        """Test each writer records a Call per Prospect of its own."""
+        pool, assignments = load_writers(3, 4)
+        self.assertEqual(len(assignments), 3)
+        counts = Counter()
+        result_code_id = ResultCode.objects.get(result_code='No Answer').pk
+        for caller_id, prospect_ids in assignments:
+            write_calls(caller_id, prospect_ids, pool, result_code_id,
+                        counts, end_request=lambda: None)
+        self.assertEqual(counts, Counter(writes=12))
+        self.assertEqual(Call.objects.filter(pool=pool).count(), 12)
+        upload_prospects(generators.prospect_rows(5), 12, counts)
+        self.assertEqual(counts['uploaded'], 5)
+        self.assertEqual(Prospect.objects.count(), 17)
+
+    def test_profiles(self):
+        """Test two profiles are compared on the configured backend."""
+        self.assertEqual(len(database_profiles()), 2)
+
+
+class TestQueryCounter(TestCase):
+    """Tests for counting queries."""
+
+    def test_query_counter(self):
+        """Test statements are counted within the block only."""
+        with QueryCounter() as counter:
+            Fund.objects.create(name='NTU Bursaries')
+            Fund.objects.count()
+        Fund.objects.count()
+        self.assertEqual(counter.queries, 2)
+
+    def test_query_counter_nested(self):
+        """Test nested counters both count statements."""
+        with QueryCounter() as outer:
+            Fund.objects.count()
+            with QueryCounter() as inner:
+                Fund.objects.count()
+        self.assertEqual(outer.queries, 2)
+        self.assertEqual(inner.queries, 1)
+
+
+class TestPeakRss(TestCase):
+    """Tests for reporting the peak RSS of benchmark runs."""
+
+    def test_measure(self):
+        """Test runs report the peak RSS of the process at their end."""
+        results = []
+        with measure('count', 1, results):
+            Fund.objects.count()
+        self.assertLessEqual(results[0]['peak_rss_kb'], peak_rss_kb())
+        self.assertGreater(results[0]['peak_rss_kb'], 0)
+        self.assertEqual(results[0]['queries'], 1)
+
+    def test_process_per_size(self):
+        """Test a size runs in a fresh process, which reports its own peak
+        RSS."""
+        results = run_upload_benchmark_process(5, chunk_size=2)
+        self.assertEqual(
+            [result['benchmark'] for result in results],
+            ['upload Caller', 'upload Fund', 'upload Prospect',
+             'upload Pledge', 'upload Pool', 'upload Call'])
+        self.assertTrue(all(result['peak_rss_kb'] > 0 for result in results))
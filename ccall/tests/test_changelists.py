@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Tests for the admin change lists of large tables."""
+
+from __future__ import unicode_literals
+
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from ..admin import CallAdmin
+from ..changelists import EstimatedCountPaginator, estimate_count
+from ..models.call import Call
+from ..models.pool import Pool
+from ..models.project import Project
+from ..models.prospect import Prospect
+from ..models.result_code import ResultCode
+from ..models.user import PhonathonUser
+
+
+class TestLargeTableAdmin(TestCase):
+    """Tests for the Call and Pledge change lists."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = PhonathonUser.objects.create_superuser(
+            username='super', password='super', name='Super',
+            email='super@example.com')
+        project = Project.objects.create(name='Project 1')
+        pool = Pool.objects.create(name='Pool 1', project=project)
+        cls.no_answer = no_answer = ResultCode.objects.get(
+            result_code='No Answer')
+        for i in range(5):
+            Call.objects.create(
+                caller=cls.user, project=project, pool=pool, attempt=1,
+                result_code=no_answer, prospect=Prospect.objects.create(
+                    nric='S000000{}A'.format(i), name='Prospect {}'.format(i),
+                    education_school='School of Humanities',
+                    education_degree='B.A (Econs)', education_year=2017))
+        cls.calls = list(Call.objects.order_by('-pk'))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_estimated_count(self):
+        """Test lists above the threshold are counted approximately."""
+        calls = Call.objects.order_by('-pk')
+        with mock.patch('ccall.changelists.ESTIMATED_COUNT_THRESHOLD', 2):
+            paginator = EstimatedCountPaginator(calls, 2)
+            self.assertEqual(paginator.count, estimate_count(Call.objects))
+            self.assertTrue(paginator.estimated)
+            paginator = EstimatedCountPaginator(
+                calls.filter(attempt=1), 2)
+            self.assertEqual(paginator.count, 3)
+        paginator = EstimatedCountPaginator(calls, 2)
+        self.assertEqual(paginator.count, 5)
+        self.assertFalse(paginator.estimated)
+
+    def test_keyset_pages(self):
+        """Test pages follow the last primary key of the previous one."""
+        with mock.patch.object(CallAdmin, 'list_per_page', 2):
+            response = self.client.get('/admin/ccall/call/')
+            self.assertEqual(list(response.context['cl'].result_list),
+                             self.calls[:2])
+            next_page_url = response.context['cl'].next_page_url
+            self.assertEqual(next_page_url,
+                             '?after={}'.format(self.calls[1].pk))
+            response = self.client.get('/admin/ccall/call/' + next_page_url)
+            self.assertEqual(list(response.context['cl'].result_list),
+                             self.calls[2:4])
+            response = self.client.get('/admin/ccall/call/', {
+                'after': self.calls[3].pk,
+                'result_code__id__exact': self.no_answer.pk})
+            self.assertEqual(list(response.context['cl'].result_list),
+                             self.calls[4:])
+            self.assertIsNone(response.context['cl'].next_page_url)
+
+    def test_no_query_per_row(self):
+        """Test the number of queries does not grow with the rows shown."""
+        counts = []
+        # the user is cached by the first request
+        self.client.get('/admin/ccall/call/')
+        for per_page in (1, 5):
+            with mock.patch.object(CallAdmin, 'list_per_page', per_page):
+                with CaptureQueriesContext(connection) as queries:
+                    self.client.get('/admin/ccall/call/')
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_pledge_changelist(self):
+        """Test the Pledge change list is shown."""
+        response = self.client.get('/admin/ccall/pledge/')
+        self.assertEqual(response.status_code, 200)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Tests for the CSV exports."""
+
+from __future__ import unicode_literals
+
+import csv
+import io
+import os
+import shutil
+import tempfile
+from datetime import date
+from decimal import Decimal
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from ..exports import export_rows
+from ..models.call import Call
+from ..models.fund import Fund
+from ..models.pledge import Pledge
+from ..models.pool import Pool
+from ..models.project import Project
+from ..models.prospect import Prospect
+from ..models.result_code import ResultCode
+from ..models.user import PhonathonUser
+
+
+def read_export(content):
+    """Rows of an exported CSV file, as dicts."""
+    return list(csv.DictReader(io.StringIO(content)))
+
+
+class TestExports(TestCase):
+    """Tests for exporting Calls, Pledges and Prospects."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = PhonathonUser.objects.create_superuser(
+            username='super', password='super', name='Super',
+            email='super@example.com')
+        project = Project.objects.create(name='Project 1')
+        pool = Pool.objects.create(name='Pool 1', project=project)
+        fund = Fund.objects.create(name='NTU Bursaries')
+        for i in range(5):
+            prospect = Prospect.objects.create(
+                nric='S000000{}A'.format(i), name='Prospect, {}'.format(i),
+                education_school='School of Humanities',
+                education_degree='B.A (Econs)', education_year=2017,
+                phone_mobile='9123456{}'.format(i))
+            Call.objects.create(
+                caller=cls.user, project=project, pool=pool, attempt=1,
+                prospect=prospect, comment='Line 1\nLine 2',
+                result_code=ResultCode.objects.get(
+                    result_code='Specified Pledge (DM)'),
+                pledge_amount=Decimal('50.00') if i % 2 else None)
+            Pledge.objects.create(
+                prospect=prospect, pledge_fund=fund,
+                pledge_amount=Decimal('100.50'),
+                pledge_date=date(2017, 3, i + 1))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def export(self, model_name):
+        """Rows of the export of every object of model_name, as dicts."""
+        output = io.StringIO()
+        call_command('export_csv', model_name, stdout=output,
+                     stderr=open(os.devnull, 'w'))
+        return read_export(output.getvalue())
+
+    def test_export_chunks(self):
+        """Test rows are read in chunks, one query per chunk."""
+        with self.assertNumQueries(3):
+            rows = list(export_rows(Call.objects.all(), chunk_size=2))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0][:3], ['caller', 'call_time', 'prospect'])
+        self.assertEqual([row[2] for row in rows[1:]],
+                         ['S000000{}A'.format(i) for i in range(5)])
+
+    def test_pledge_round_trip(self):
+        """Test exported Pledges are uploaded back unchanged."""
+        rows = self.export('Pledge')
+        self.assertEqual(rows[0], {
+            'prospect': 'S0000000A', 'pledge_amount': '100.50',
+            'pledge_fund': 'NTU Bursaries', 'pledge_date': '01/03/2017'})
+        values = ('prospect__nric', 'pledge_amount', 'pledge_fund__name',
+                  'pledge_date')
+        pledges = list(Pledge.objects.order_by('pk').values_list(*values))
+        Pledge.objects.all().delete()
+        created, _ = Pledge.objects.from_upload(rows)
+        self.assertEqual(len(created), 5)
+        self.assertEqual(
+            list(Pledge.objects.order_by('pk').values_list(*values)), pledges)
+
+    def test_prospect_round_trip(self):
+        """Test exported Prospects are uploaded back unchanged."""
+        rows = self.export('Prospect')
+        self.assertEqual(rows[1]['name'], 'Prospect, 1')
+        created, updated = Prospect.objects.from_upload(rows)
+        self.assertEqual((len(created), len(updated)), (0, 5))
+        response = self.client.post('/admin/ccall/prospect/', {
+            'action': 'export_csv', 'select_across': '1', 'index': '0',
+            '_selected_action': [Prospect.objects.first().pk]})
+        rows = read_export(response.getvalue().decode())
+        Prospect.objects.all().delete()
+        created, _ = Prospect.objects.from_upload(rows)
+        self.assertEqual(len(created), 5)
+        self.assertEqual(Prospect.objects.get(nric='S0000001A').phone_mobile,
+                         '91234561')
+
+    def test_call_round_trip(self):
+        """Test exported Calls are uploaded back, blank amounts included."""
+        rows = self.export('Call')
+        self.assertEqual(rows[0]['comment'], 'Line 1\nLine 2')
+        self.assertEqual([row['pledge_amount'] for row in rows],
+                         ['', '50.00', '', '50.00', ''])
+        Call.objects.all().delete()
+        created, _ = Call.objects.from_upload(rows)
+        self.assertEqual(len(created), 5)
+        self.assertEqual(
+            list(Call.objects.order_by('prospect__nric').values_list(
+                'pledge_amount', flat=True)),
+            [None, Decimal('50.00'), None, Decimal('50.00'), None])
+
+    def test_admin_action(self):
+        """Test the selected Calls are streamed as CSV from the admin."""
+        call = Call.objects.order_by('pk').first()
+        response = self.client.post('/admin/ccall/call/', {
+            'action': 'export_csv', 'index': '0',
+            '_selected_action': [call.pk]})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertIn('attachment; filename="call_',
+                      response['Content-Disposition'])
+        rows = read_export(response.getvalue().decode())
+        self.assertEqual([row['prospect'] for row in rows], ['S0000000A'])
+
+    def test_command_output(self):
+        """Test the export is written to a file."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'pledges.csv')
+        call_command('export_csv', 'Pledge', output=path,
+                     stderr=open(os.devnull, 'w'))
+        with io.open(path, encoding='utf-8', newline='') as csv_file:
+            self.assertEqual(len(read_export(csv_file.read())), 5)
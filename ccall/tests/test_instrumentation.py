@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Tests for instrumentation."""
+
+from __future__ import unicode_literals
+
+from django.test import TestCase, override_settings
+
+from .mixins import QueryBudgetMixin
+from ..benchmarks import generators
+from ..instrumentation import record_uploads
+from ..models.call import Call
+from ..models.fund import Fund
+from ..models.pledge import Pledge
+from ..models.pool import Pool
+from ..models.project import Project
+from ..models.prospect import Prospect
+from ..models.result_code import ResultCode
+from ..models.user import PhonathonUser
+
+# size of the uploads checked against their budgets
+ROWS = 1000
+
+
+class TestUploadMetrics(TestCase):
+    """Tests for counting queries per upload and per chunk."""
+
+    def test_record_uploads(self):
+        """Test rows and queries are recorded per upload and per chunk."""
+        with record_uploads() as uploads:
+            created, _ = Fund.objects.from_upload(
+                generators.fund_rows(5), chunk_size=2)
+        self.assertEqual(len(created), 5)
+        self.assertEqual(len(uploads), 1)
+        metrics = uploads[0]
+        self.assertEqual(metrics.name, 'Fund')
+        self.assertEqual(metrics.rows, 5)
+        self.assertEqual([chunk['rows'] for chunk in metrics.chunks],
+                         [2, 2, 1])
+        self.assertEqual(metrics.queries,
+                         sum(chunk['queries'] for chunk in metrics.chunks))
+        self.assertEqual(metrics.queries_per_1000_rows,
+                         metrics.queries * 200.0)
+
+    def test_record_uploads_nested(self):
+        """Test an upload within another is recorded for both."""
+        project = Project.objects.create(name='Project 1')
+        with record_uploads() as uploads:
+            Pool.objects.from_upload(
+                project, 'Pool 1', generators.prospect_rows(3))
+        self.assertEqual([metrics.name for metrics in uploads],
+                         ['Prospect', 'Pool'])
+        self.assertEqual(uploads[1].rows, 3)
+        # syncing the Pool runs outside the Prospect upload
+        self.assertGreater(uploads[1].queries, uploads[0].queries)
+
+    def test_record_uploads_outside_block(self):
+        """Test uploads are only recorded within the block."""
+        with record_uploads() as uploads:
+            pass
+        Fund.objects.from_upload(generators.fund_rows(1))
+        self.assertEqual(uploads, [])
+
+
+@override_settings(PASSWORD_HASHERS=[
+    'django.contrib.auth.hashers.MD5PasswordHasher'])
+class TestQueryBudget(QueryBudgetMixin, TestCase):
+    """Tests for the query budgets of the upload managers."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = Project.objects.create(name='Project 1')
+        cls.result_codes = list(
+            ResultCode.objects.values_list('result_code', flat=True))
+
+    def call_rows(self):
+        """Rows for a Call upload in Pool 1."""
+        return generators.call_rows(
+            ROWS, 10, ROWS, 'Project 1', 'Pool 1', self.result_codes)
+
+    def test_budget_exceeded(self):
+        """Test an upload over its budget fails the test."""
+        with self.assertRaises(AssertionError):
+            with self.assertQueryBudget(1):
+                Fund.objects.from_upload(generators.fund_rows(10))
+
+    def test_budget_chunk_exceeded(self):
+        """Test a chunk over its budget fails the test."""
+        with self.assertRaises(AssertionError):
+            with self.assertQueryBudget(1000, chunk_queries=0):
+                Fund.objects.from_upload(generators.fund_rows(10))
+
+    def test_budget_no_upload(self):
+        """Test a block running no upload fails the test."""
+        with self.assertRaises(AssertionError):
+            with self.assertQueryBudget(1000):
+                Fund.objects.count()
+
+    def test_budget_user(self):
+        """Test the query budget of PhonathonUser uploads."""
+        with self.assertQueryBudget(20):
+            PhonathonUser.objects.from_upload(
+                generators.user_rows(ROWS), workers=1)
+        with self.assertQueryBudget(5):
+            PhonathonUser.objects.from_upload(
+                generators.user_rows(ROWS), workers=1)
+
+    def test_budget_fund(self):
+        """Test the query budget of Fund uploads."""
+        with self.assertQueryBudget(10):
+            Fund.objects.from_upload(generators.fund_rows(ROWS))
+        with self.assertQueryBudget(5):
+            Fund.objects.from_upload(generators.fund_rows(ROWS))
+
+    def test_budget_prospect(self):
+        """Test the query budget of Prospect uploads."""
+        with self.assertQueryBudget(30):
+            Prospect.objects.from_upload(generators.prospect_rows(ROWS))
+        # changed rows are written per set of changed columns
+        with self.assertQueryBudget(150):
+            Prospect.objects.from_upload(
+                generators.prospect_rows(ROWS, seed=1))
+
+    def test_budget_pledge(self):
+        """Test the query budget of Pledge uploads."""
+        Fund.objects.from_upload(generators.fund_rows(10))
+        Prospect.objects.from_upload(generators.prospect_rows(ROWS))
+        # the lookup cache is bypassed within the test transaction, so the
+        # Funds are queried per chunk
+        with self.assertQueryBudget(15, chunk_queries=7):
+            Pledge.objects.from_upload(
+                generators.pledge_rows(ROWS, ROWS, 10))
+
+    def test_budget_pool(self):
+        """Test the query budget of Pool uploads."""
+        # Prospects are written to the search index per chunk
+        with self.assertQueryBudget(35):
+            Pool.objects.from_upload(
+                self.project, 'Pool 1', generators.prospect_rows(ROWS))
+
+    def test_budget_call(self):
+        """Test the query budget of Call uploads."""
+        PhonathonUser.objects.from_upload(
+            generators.user_rows(10), workers=1)
+        Pool.objects.from_upload(
+            self.project, 'Pool 1', generators.prospect_rows(ROWS))
+        # Calls, their ProspectStatus and CallRollups are written per chunk
+        with self.assertQueryBudget(60, chunk_queries=30):
+            Call.objects.from_upload(self.call_rows())
+        # rows are resolved in place, so the upload is repeated with fresh
+        # ones
+        with self.assertQueryBudget(15):
+            Call.objects.from_upload(self.call_rows())
+        self.assertEqual(Call.objects.count(), ROWS)
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""Tests for the lookup cache."""
+
+from __future__ import unicode_literals
+
+import csv
+import io
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from ..benchmarks import generators
+from ..jobs import process_job
+from ..models.fund import Fund
+from ..models.pledge import Pledge
+from ..models.pool import Pool
+from ..models.project import Project
+from ..models.prospect import Prospect
+from ..models.result_code import ResultCode
+from ..models.upload_job import UploadJob
+
+LOCMEM_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class TestLookupCache(TransactionTestCase):
+    """Tests for lookups served from memory, outside transactions."""
+    # the result codes are created by a data migration
+    serialized_rollback = True
+
+    def setUp(self):
+        cache.clear()
+        self.clear_tables()
+
+    def tearDown(self):
+        self.clear_tables()
+
+    def clear_tables(self):
+        """Drop the lookup tables loaded in this process."""
+        for model in (Fund, Pool, Project, ResultCode):
+            model.objects.lookup_cache().table = None
+
+    def test_get_by_natural_key_cached(self):
+        """Test lookups hit the database once, then memory."""
+        with self.assertNumQueries(1):
+            result_code = ResultCode.objects.get_by_natural_key('No Answer')
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                ResultCode.objects.get_by_natural_key('No Answer'),
+                result_code)
+            with self.assertRaises(ResultCode.DoesNotExist):
+                ResultCode.objects.get_by_natural_key('Maybe')
+
+    def test_get_by_natural_key_copy(self):
+        """Test lookups return a copy of the cached object."""
+        fund = Fund.objects.create(name='NTU Bursaries')
+        Fund.objects.get_by_natural_key('NTU Bursaries').name = 'Changed'
+        self.assertEqual(
+            Fund.objects.get_by_natural_key('NTU Bursaries'), fund)
+        self.assertEqual(
+            Fund.objects.get_by_natural_key('NTU Bursaries').name,
+            'NTU Bursaries')
+
+    def test_lookups_fresh(self):
+        """Test mutating a looked up object, or its cached relations, does
+        not affect the next lookup."""
+        project = Project.objects.create(name='Project 1')
+        Pool.objects.create(name='Pool 1', project=project)
+        pool = Pool.objects.get_by_natural_key(project, 'Pool 1')
+        pool.project.name = 'Changed'
+        pool.name = 'Changed'
+        pool._state.adding = True
+        pools = Pool.objects.in_bulk_by_natural_key([(project.pk, 'Pool 1')])
+        pools[(project.pk, 'Pool 1')].name = 'Changed'
+        for pool in (Pool.objects.get_by_natural_key(project, 'Pool 1'),
+                     Pool.objects.in_bulk_by_natural_key(
+                         [(project.pk, 'Pool 1')])[(project.pk, 'Pool 1')]):
+            self.assertEqual(pool.name, 'Pool 1')
+            self.assertFalse(pool._state.adding)
+            self.assertEqual(pool.project.name, 'Project 1')
+
+    def test_get_by_natural_key_related(self):
+        """Test lookups by a natural key holding a related object."""
+        project = Project.objects.create(name='Project 1')
+        pool = Pool.objects.create(name='Pool 1', project=project)
+        self.assertEqual(
+            Pool.objects.get_by_natural_key(project, 'Pool 1'), pool)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                Pool.objects.get_by_natural_key(project.pk, 'Pool 1'), pool)
+
+    def test_in_bulk_by_natural_key(self):
+        """Test bulk lookups leave out missing keys."""
+        project = Project.objects.create(name='Project 1')
+        Project.objects.get_by_natural_key('Project 1')
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                Project.objects.in_bulk_by_natural_key(
+                    ['Project 1', 'Project 2']),
+                {'Project 1': project})
+
+    def test_invalidated_on_save(self):
+        """Test saving an object reloads the table."""
+        project = Project.objects.create(name='Project 1')
+        Project.objects.get_by_natural_key('Project 1')
+        project.name = 'Project 2'
+        project.save()
+        self.assertEqual(
+            Project.objects.get_by_natural_key('Project 2'), project)
+        with self.assertRaises(Project.DoesNotExist):
+            Project.objects.get_by_natural_key('Project 1')
+
+    def test_invalidated_on_delete(self):
+        """Test deleting an object reloads the table."""
+        Fund.objects.create(name='NTU Bursaries')
+        Fund.objects.get_by_natural_key('NTU Bursaries')
+        Fund.objects.all().delete()
+        with self.assertRaises(Fund.DoesNotExist):
+            Fund.objects.get_by_natural_key('NTU Bursaries')
+
+    def test_invalidated_on_upload(self):
+        """Test uploading objects in bulk reloads the table."""
+        with self.assertRaises(Fund.DoesNotExist):
+            Fund.objects.get_by_natural_key('NTU Bursaries')
+        Fund.objects.from_upload([{'name': 'NTU Bursaries'}])
+        self.assertTrue(Fund.objects.get_by_natural_key('NTU Bursaries'))
+
+    def test_invalidated_by_other_process(self):
+        """Test a new version in the cache backend reloads the table."""
+        with self.assertRaises(Project.DoesNotExist):
+            Project.objects.get_by_natural_key('Project 1')
+        # written by another process, which bumped the version
+        Project.objects.bulk_create([Project(name='Project 1')])
+        with self.assertRaises(Project.DoesNotExist):
+            Project.objects.get_by_natural_key('Project 1')
+        cache.set(Project.objects.lookup_cache().version_key, 'other')
+        self.assertTrue(Project.objects.get_by_natural_key('Project 1'))
+
+    def test_cached_in_transaction(self):
+        """Test the loaded table serves lookups within a transaction, until
+        the transaction writes to it."""
+        Project.objects.create(name='Project 1')
+        Project.objects.load_lookup_cache()
+        with transaction.atomic():
+            with self.assertNumQueries(0):
+                self.assertTrue(
+                    Project.objects.get_by_natural_key('Project 1'))
+            Project.objects.create(name='Project 2')
+            with self.assertNumQueries(1):
+                self.assertTrue(
+                    Project.objects.get_by_natural_key('Project 2'))
+        self.assertTrue(Project.objects.get_by_natural_key('Project 2'))
+
+    def test_dirty_after_rollback(self):
+        """Test a table written by a rolled back transaction is served
+        again once loaded outside of a transaction."""
+        Project.objects.create(name='Project 1')
+        Project.objects.load_lookup_cache()
+        try:
+            with transaction.atomic():
+                Project.objects.filter(name='Project 1').update(
+                    name='Project 2')
+                Project.objects.clear_lookup_cache()
+                raise ValueError
+        except ValueError:
+            pass
+        with transaction.atomic(), self.assertNumQueries(1):
+            Project.objects.get_by_natural_key('Project 1')
+        Project.objects.load_lookup_cache()
+        with transaction.atomic(), self.assertNumQueries(0):
+            Project.objects.get_by_natural_key('Project 1')
+
+    def test_upload_job_lookups(self):
+        """Test the lookups of an upload job do not grow with its chunks."""
+        Fund.objects.from_upload(generators.fund_rows(2))
+        Prospect.objects.from_upload(generators.prospect_rows(4))
+        rows = io.StringIO()
+        writer = csv.DictWriter(rows, ['prospect', 'pledge_amount',
+                                       'pledge_fund', 'pledge_date'])
+        writer.writeheader()
+        writer.writerows(generators.pledge_rows(8, 4, 2))
+        media_root = tempfile.mkdtemp()
+        fund_queries = []
+        try:
+            with override_settings(MEDIA_ROOT=media_root):
+                for chunk_size in (8, 2):
+                    self.clear_tables()
+                    job = UploadJob.objects.create(
+                        model=UploadJob.MODEL_PLEDGE,
+                        uploaded_file=SimpleUploadedFile(
+                            'pledges.csv', rows.getvalue().encode('utf-8')))
+                    with CaptureQueriesContext(connection) as queries:
+                        process_job(job, chunk_size)
+                    fund_queries.append(len([
+                        query for query in queries
+                        if 'FROM "ccall_fund"' in query['sql']]))
+        finally:
+            shutil.rmtree(media_root)
+        self.assertEqual(Pledge.objects.count(), 16)
+        self.assertEqual(fund_queries, [1, 1])
+
+    def test_not_cached_in_transaction(self):
+        """Test rows seen within a transaction are not cached."""
+        try:
+            with transaction.atomic():
+                Project.objects.create(name='Project 1')
+                self.assertTrue(
+                    Project.objects.get_by_natural_key('Project 1'))
+                raise ValueError
+        except ValueError:
+            pass
+        with self.assertRaises(Project.DoesNotExist):
+            Project.objects.get_by_natural_key('Project 1')
+
+
+class TestLookupCacheTransaction(TestCase):
+    """Tests for lookups within a transaction."""
+
+    def test_get_by_natural_key_uncached(self):
+        """Test lookups query the database within a transaction."""
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                ResultCode.objects.get_by_natural_key('No Answer')
@@ -3,17 +3,41 @@
 
 from __future__ import unicode_literals
 
+import inspect
+import os
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+
 from django.contrib.auth.models import Group
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import (IntegrityError, OperationalError, connection,
+                       transaction)
+from django.db.models import IntegerField, Value
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
+from ..benchmarks import generators
 from ..models.call import Call
+from ..models.call_rollup import CallRollup, CallRollupManager, floor_hour
 from ..models.fund import Fund
 from ..models.pledge import Pledge
 from ..models.pool import Pool
 from ..models.project import Project
 from ..models.prospect import Prospect
+from ..models.prospect_status import ProspectStatus, ProspectStatusManager
+from ..models.reservation import Reservation
 from ..models.result_code import ResultCode
-from ..models.user import PhonathonUser
+from ..models.user import (HASH_POOL_MIN_PASSWORDS, Assignment,
+                           PhonathonUser)
+from ..utils import UPLOAD_CHUNK_SIZE
+from .mixins import QueryBudgetMixin
 
 
 class TestStrings(TestCase):
@@ -88,6 +112,10 @@ class TestPhonathonUser(TestCase):
             'name': 'Error'
         }
 
+    def setUp(self):
+        # roles are cached on the instance, so load one per test
+        self.test_user = PhonathonUser.objects.get(pk=self.test_user.pk)
+
     def test_manager_and_above_manager(self):
         """Test the attribute is_manager_and_above for Managers."""
         self.test_user.groups.add(Group.objects.get(name='Managers'))
@@ -102,6 +130,30 @@ class TestPhonathonUser(TestCase):
         """Test the attribute is_manager_and_above for other users."""
         self.assertFalse(self.test_user.is_manager_and_above)
 
+    def test_role(self):
+        """Test the role of users by group, loaded with one query."""
+        self.test_user.groups.add(Group.objects.get(name='Supervisors'))
+        user = PhonathonUser.objects.get(pk=self.test_user.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(user.role, PhonathonUser.ROLE_SUPERVISOR)
+            self.assertTrue(user.is_supervisor_and_above)
+            self.assertFalse(user.is_manager_and_above)
+            self.assertEqual(user.get_role_display(), 'Supervisor')
+        user.is_superuser = True
+        self.assertEqual(user.role, PhonathonUser.ROLE_ADMIN)
+        self.assertEqual(PhonathonUser().role, PhonathonUser.ROLE_CALLER)
+
+    def test_role_group_changes(self):
+        """Test the cached role follows changes to the groups."""
+        self.assertEqual(self.test_user.role, PhonathonUser.ROLE_CALLER)
+        managers = Group.objects.get(name='Managers')
+        self.test_user.groups.add(managers)
+        self.assertEqual(self.test_user.role, PhonathonUser.ROLE_MANAGER)
+        self.assertTrue(self.test_user.is_staff)
+        self.test_user.groups.remove(managers)
+        self.assertEqual(self.test_user.role, PhonathonUser.ROLE_CALLER)
+        self.assertFalse(self.test_user.is_staff)
+
     def test_from_upload_new_user(self):
         """Test adding new user via custom manager."""
         PhonathonUser.objects.from_upload([self.user_obj_add])
@@ -135,8 +187,120 @@ class TestPhonathonUser(TestCase):
             [self.user_obj_err, self.user_obj_add])
         self.assertEqual(PhonathonUser.objects.count(), 3)
 
+    def test_from_upload_same_password(self):
+        """Test passwords that still verify are not rehashed."""
+        PhonathonUser.objects.from_upload([self.user_obj_add])
+        encoded = PhonathonUser.objects.get_by_natural_key('Test1').password
+        PhonathonUser.objects.from_upload([self.user_obj_add])
+        self.assertEqual(PhonathonUser.objects.get_by_natural_key(
+            'Test1').password, encoded)
+
+    def test_from_upload_unchanged_user(self):
+        """Test unchanged users are skipped via custom manager."""
+        PhonathonUser.objects.from_upload([self.user_obj_add])
+        stats = Counter()
+        PhonathonUser.objects.from_upload([self.user_obj_add], stats=stats)
+        self.assertEqual(stats['skipped'], 1)
+
+    def test_from_upload_changed_password(self):
+        """Test changed passwords are rehashed."""
+        PhonathonUser.objects.from_upload([self.user_obj_add])
+        user_obj = self.user_obj_add.copy()
+        user_obj['password'] = 'Test2'
+        PhonathonUser.objects.from_upload([user_obj])
+        self.assertTrue(PhonathonUser.objects.get_by_natural_key(
+            'Test1').check_password('Test2'))
+
+    @override_settings(PASSWORD_HASHERS=[
+        'django.contrib.auth.hashers.MD5PasswordHasher'])
+    def test_from_upload_worker_processes(self):
+        """Test hashing passwords across worker processes."""
+        data = [{'username': 'Test{}'.format(i), 'name': 'Test User'}
+                for i in range(HASH_POOL_MIN_PASSWORDS)]
+        created, _ = PhonathonUser.objects.from_upload(data, workers=2)
+        self.assertEqual(len(created), HASH_POOL_MIN_PASSWORDS)
+        self.assertTrue(PhonathonUser.objects.get_by_natural_key(
+            'Test3').check_password('Test3'))
+
+    def test_from_upload_in_process(self):
+        """Test passwords are hashed in process by default, and for chunks
+        with few passwords to hash."""
+        data = [{'username': 'Test{}'.format(i), 'name': 'Test User'}
+                for i in range(4)]
+        with mock.patch('ccall.models.user.ProcessPoolExecutor') as pool:
+            PhonathonUser.objects.from_upload(data[:2])
+        pool.assert_not_called()
+        executor = mock.Mock()
+        created, _ = PhonathonUser.objects.from_upload(
+            data[2:], workers=2, executor=executor)
+        self.assertEqual(len(created), 2)
+        executor.map.assert_not_called()
+        executor.shutdown.assert_not_called()
 
-class TestProspect(TestCase):
+
+class TestAssignGroup(TestCase):
+    """Test cases for assigning groups to users in bulk."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = PhonathonUser.objects.create_superuser(
+            username='super', password='super', name='Super',
+            email='super@example.com')
+        callers = Group.objects.get(name='Callers')
+        for i in range(20):
+            PhonathonUser.objects.create_user(
+                username='caller{}'.format(i), name='Caller').groups.add(
+                    callers)
+
+    def assign(self, count, name):
+        """Move count callers to the group name, returning the queries."""
+        user_ids = list(PhonathonUser.objects.filter(
+            username__startswith='caller').order_by('pk').values_list(
+                'pk', flat=True)[:count])
+        with CaptureQueriesContext(connection) as queries:
+            PhonathonUser.objects.assign_group(
+                PhonathonUser.objects.filter(pk__in=user_ids), name,
+                replace=PhonathonUser.GROUPS)
+        return len(queries)
+
+    def test_assign_group(self):
+        """Test users are moved between groups, staff status included."""
+        self.assertEqual(self.assign(5, 'Supervisors'),
+                         self.assign(20, 'Supervisors'))
+        users = PhonathonUser.objects.filter(username__startswith='caller')
+        self.assertTrue(all(users.values_list('is_staff', flat=True)))
+        self.assertFalse(users.filter(groups__name='Callers').exists())
+        self.assertEqual(users.filter(groups__name='Supervisors').count(), 20)
+        self.assign(20, 'Callers')
+        self.assertFalse(any(users.values_list('is_staff', flat=True)))
+        self.assertEqual(users.get(username='caller0').role,
+                         PhonathonUser.ROLE_CALLER)
+
+    def test_group_user_set(self):
+        """Test users added to a group from the group get staff status."""
+        user = PhonathonUser.objects.get(username='caller0')
+        Group.objects.get(name='Managers').user_set.add(user)
+        user.refresh_from_db()
+        self.assertTrue(user.is_staff)
+
+    def test_admin_action(self):
+        """Test managers move the selected users to a group."""
+        user = PhonathonUser.objects.get(username='caller0')
+        self.client.force_login(self.user)
+        self.client.post('/admin/ccall/phonathonuser/', {
+            'action': 'assign_group_managers', 'index': '0',
+            '_selected_action': [user.pk]})
+        user = PhonathonUser.objects.get(pk=user.pk)
+        self.assertEqual(user.role, PhonathonUser.ROLE_MANAGER)
+        self.assertTrue(user.is_staff)
+        supervisor = PhonathonUser.objects.get(username='caller1')
+        Group.objects.get(name='Supervisors').user_set.add(supervisor)
+        self.client.force_login(supervisor)
+        response = self.client.get('/admin/ccall/phonathonuser/')
+        self.assertNotContains(response, 'assign_group_managers')
+
+
+class TestProspect(QueryBudgetMixin, TestCase):
     """Test cases for Prospect."""
 
     @classmethod
@@ -211,6 +375,53 @@ class TestProspect(TestCase):
         self.assertEqual(len(created), 1)
         self.assertEqual(len(updated), 0)
 
+    def test_from_upload_created_prospects_saved(self):
+        """Test bulk created Prospects are returned with primary keys."""
+        created, _ = Prospect.objects.from_upload([self.prospect_obj_add])
+        self.assertEqual(created[0].pk, Prospect.objects.get_by_natural_key(
+            'S1111111A').pk)
+
+    def test_from_upload_repeated_prospect(self):
+        """Test a new Prospect repeated in the same upload."""
+        prospect_obj = self.prospect_obj_add.copy()
+        prospect_obj['name'] = 'Alex Au'
+        created, _ = Prospect.objects.from_upload(
+            [self.prospect_obj_add, prospect_obj])
+        self.assertEqual(len(created), 1)
+        self.assertEqual(Prospect.objects.get_by_natural_key(
+            'S1111111A').name, 'Alex Au')
+
+    def test_from_upload_unchanged_prospect(self):
+        """Test unchanged Prospects are skipped via custom manager."""
+        prospect_obj = self.prospect_obj_upd.copy()
+        prospect_obj['education_year'] = '2017'
+        stats = Counter()
+        # 1 lookup, no write
+        with self.assertNumQueries(1):
+            created, updated = Prospect.objects.from_upload(
+                [prospect_obj], stats=stats)
+        self.assertEqual(len(updated), 1)
+        self.assertEqual(stats['skipped'], 1)
+
+    def test_from_upload_batched_queries(self):
+        """Test Prospects are written with a fixed number of queries."""
+        def rows(count, name):
+            """An update of a Prospect, then count new Prospects."""
+            prospect_obj = self.prospect_obj_upd.copy()
+            prospect_obj['name'] = name
+            data = [prospect_obj]
+            for i in range(count):
+                prospect_obj = self.prospect_obj_add.copy()
+                prospect_obj['nric'] = 'S{:07d}{}'.format(i, name[0])
+                data.append(prospect_obj)
+            return data
+        self.assertConstantQueries(Prospect.objects.from_upload,
+                                   rows(2, 'Bella Low'), rows(20, 'Cara Low'),
+                                   500)
+        self.assertEqual(Prospect.objects.count(), 23)
+        self.assertEqual(Prospect.objects.get_by_natural_key(
+            'S1234567A').name, 'Cara Low')
+
 
 class TestFund(TestCase):
     """Test cases for Fund."""
@@ -237,13 +448,30 @@ class TestFund(TestCase):
         Fund.objects.from_upload([self.fund_obj_add_1, self.fund_obj_add_2])
         self.assertEqual(Fund.objects.count(), 2)
 
+    def test_from_upload_repeated_fund(self):
+        """Test a new Fund repeated in the same upload."""
+        created, _ = Fund.objects.from_upload(
+            [self.fund_obj_add_1, self.fund_obj_add_1.copy()])
+        self.assertEqual(len(created), 1)
+        self.assertEqual(Fund.objects.count(), 1)
+
+    def test_from_upload_unchanged_fund(self):
+        """Test existing Funds are skipped via custom manager."""
+        Fund.objects.from_upload([self.fund_obj_add_1])
+        stats = Counter()
+        created, updated = Fund.objects.from_upload(
+            [self.fund_obj_add_1, self.fund_obj_add_2], stats=stats)
+        self.assertEqual(len(created), 1)
+        self.assertEqual(len(updated), 1)
+        self.assertEqual(stats['skipped'], 1)
+
     def test_from_upload_multiple_fund_with_errors(self):
         """Test adding multiple Funds, with errors."""
         Fund.objects.from_upload([self.fund_obj_err, self.fund_obj_add_1])
         self.assertEqual(Fund.objects.count(), 1)
 
 
-class TestPledge(TestCase):
+class TestPledge(QueryBudgetMixin, TestCase):
     """Test cases for Pledge."""
 
     def setUp(self):
@@ -293,6 +521,25 @@ class TestPledge(TestCase):
             [self.pledge_obj_err, self.pledge_obj_add_1])
         self.assertEqual(Pledge.objects.count(), 1)
 
+    def test_from_upload_pledge_invalid_values(self):
+        """Test Pledges with unknown Funds or invalid amounts."""
+        pledge_obj_fund = self.pledge_obj_add_1.copy()
+        pledge_obj_fund['pledge_fund'] = 'NTU Scholarships'
+        pledge_obj_amount = self.pledge_obj_add_1.copy()
+        pledge_obj_amount['pledge_amount'] = 'fifty'
+        created, _ = Pledge.objects.from_upload(
+            [pledge_obj_fund, pledge_obj_amount, self.pledge_obj_add_2])
+        self.assertEqual(len(created), 1)
+        self.assertEqual(Pledge.objects.get().pledge_amount, 100)
+
+    def test_from_upload_batched_queries(self):
+        """Test Pledges are created with a fixed number of queries."""
+        self.assertConstantQueries(
+            Pledge.objects.from_upload,
+            [self.pledge_obj_add_1, self.pledge_obj_add_2],
+            [self.pledge_obj_add_1, self.pledge_obj_add_2] * 10, 250)
+        self.assertEqual(Pledge.objects.count(), 22)
+
 
 class TestPool(TestCase):
     """Test cases for Pool."""
@@ -355,6 +602,44 @@ class TestPool(TestCase):
         test_pool = Pool.objects.get(name='Test Pool')
         self.assertEqual(test_pool.prospects.count(), 2)
 
+    def test_from_upload_replace_pool(self):
+        """Test replacing the Prospects of a pool via custom manager."""
+        Pool.objects.from_upload(
+            self.project, 'Test Pool', [self.prospect_obj_2], replace=True)
+        test_pool = Pool.objects.get(name='Test Pool')
+        self.assertEqual(
+            list(test_pool.prospects.values_list('nric', flat=True)),
+            ['S1111111A'])
+
+    def test_sync_prospects(self):
+        """Test only missing links are added to a pool."""
+        prospect = Prospect.objects.create(**self.prospect_obj_2)
+        ids = list(Prospect.objects.values_list('pk', flat=True))
+        self.assertEqual(
+            Pool.objects.sync_prospects(self.test_pool, ids), (1, 0))
+        self.assertEqual(
+            Pool.objects.sync_prospects(self.test_pool, ids), (0, 0))
+        self.assertEqual(Pool.objects.sync_prospects(
+            self.test_pool, [prospect.pk], replace=True), (0, 1))
+        self.assertEqual(self.test_pool.prospects.get(), prospect)
+
+    def test_sync_prospects_chunked(self):
+        """Test more Prospects than SQLite's variables are synced in
+        chunks."""
+        Prospect.objects.bulk_create(
+            Prospect(**row) for row in generators.prospect_rows(1200))
+        ids = list(Prospect.objects.values_list('pk', flat=True))
+        Pool.objects.sync_prospects(self.test_pool, ids[:600])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(
+                Pool.objects.sync_prospects(self.test_pool, ids), (600, 0))
+        self.assertEqual(self.test_pool.prospects.count(), 1201)
+        self.assertLessEqual(max(
+            len(in_list.split(','))
+            for query in queries if query['sql'].startswith('SELECT')
+            for in_list in re.findall(r' IN \(([^)]*)\)', query['sql'])),
+            UPLOAD_CHUNK_SIZE)
+
     def test_from_upload_invalid_pool(self):
         """Test adding invalid pool via custom manager."""
         Pool.objects.from_upload(
@@ -362,7 +647,7 @@ class TestPool(TestCase):
         self.assertEqual(Pool.objects.count(), 1)
 
 
-class TestCall(TestCase):
+class TestCall(QueryBudgetMixin, TestCase):
     """Test cases for Call."""
 
     def setUp(self):
@@ -446,3 +731,629 @@ class TestCall(TestCase):
         self.assertEqual(Call.objects.count(), 2)
         self.assertEqual(len(created), 1)
         self.assertEqual(len(updated), 0)
+
+    def test_from_upload_update_call_saved(self):
+        """Test updated Calls are written back via custom manager."""
+        Call.objects.from_upload([self.call_obj_upd])
+        self.assertEqual(
+            Call.objects.get(attempt=1).result_code.result_code,
+            'Not Available')
+
+    def test_from_upload_unchanged_call(self):
+        """Test unchanged Calls are skipped via custom manager."""
+        call_obj = self.call_obj_upd.copy()
+        call_obj['result_code'] = 'No Answer'
+        call_obj['call_time'] = ''
+        stats = Counter()
+        Call.objects.from_upload([call_obj], stats=stats)
+        self.assertEqual(stats['skipped'], 1)
+
+    def test_from_upload_batched_queries(self):
+        """Test Calls are resolved with a fixed number of queries."""
+        def rows(attempts):
+            """Calls of the Prospect for attempts."""
+            data = []
+            for attempt in attempts:
+                call_obj = self.call_obj_add.copy()
+                call_obj['attempt'] = attempt
+                data.append(call_obj)
+            return data
+        self.assertConstantQueries(Call.objects.from_upload,
+                                   rows(range(2, 4)), rows(range(4, 24)),
+                                   1000)
+        self.assertEqual(Call.objects.count(), 23)
+
+    def test_natural_key_unique(self):
+        """Test a second Call with the same natural key is rejected."""
+        call_obj = Call.objects.get()
+        call_obj.pk = None
+        with self.assertRaises(IntegrityError):
+            with transaction.atomic():
+                call_obj.save()
+        self.assertEqual(Call.objects.count(), 1)
+
+    def result(self, **fields):
+        """A validated call result for the Prospect in Pool 1."""
+        result = {'prospect': 'S1234567A', 'project': 'Project 1',
+                  'pool': 'Pool 1', 'result_code': 'No Answer'}
+        result.update(fields)
+        return result
+
+    def test_from_results_attempts(self):
+        """Test submitted Calls follow the latest attempt in order."""
+        caller = PhonathonUser.objects.get(username='Test1')
+        created, errors = Call.objects.from_results(
+            caller, [self.result(), self.result(result_code='No Pledge')])
+        self.assertEqual(errors, {})
+        self.assertEqual([obj.attempt for obj in created], [2, 3])
+        status = ProspectStatus.objects.get()
+        self.assertEqual(status.attempts, 3)
+        self.assertTrue(status.is_complete)
+
+    def test_from_results_errors(self):
+        """Test nothing is written when a result cannot be resolved."""
+        caller = PhonathonUser.objects.get(username='Test1')
+        created, errors = Call.objects.from_results(
+            caller, [self.result(), self.result(pool='Pool 2')])
+        self.assertEqual(created, [])
+        self.assertEqual(list(errors), [1])
+        self.assertEqual(Call.objects.count(), 1)
+
+    def test_from_results_client_ref(self):
+        """Test results already recorded by client_ref are skipped."""
+        caller = PhonathonUser.objects.get(username='Test1')
+        client_ref = uuid.uuid4()
+        Call.objects.from_results(caller, [self.result(client_ref=client_ref)])
+        created, errors = Call.objects.from_results(
+            caller, [self.result(client_ref=client_ref), self.result()])
+        self.assertEqual([obj.attempt for obj in created], [3])
+        self.assertEqual(Call.objects.count(), 3)
+
+    def test_from_results_client_ref_repeated(self):
+        """Test a client_ref repeated within results is recorded once."""
+        caller = PhonathonUser.objects.get(username='Test1')
+        client_ref = uuid.uuid4()
+        created, errors = Call.objects.from_results(
+            caller, [self.result(client_ref=client_ref),
+                     self.result(client_ref=client_ref)])
+        self.assertEqual(errors, {})
+        self.assertEqual(len(created), 1)
+        self.assertEqual(Call.objects.filter(client_ref=client_ref).count(),
+                         1)
+
+
+class TestProspectStatus(TestCase):
+    """Test cases for ProspectStatus."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.caller = PhonathonUser.objects.create_user(
+            username='Test1', password='Test1', name='Test User 1')
+        cls.prospect = Prospect.objects.create(
+            nric='S1234567A', name='Anna Low',
+            education_school='School of Humanities',
+            education_degree='B.A (Econs)', education_year=2017)
+        cls.project = Project.objects.create(name='Project 1')
+        cls.pool_1 = Pool.objects.create(name='Pool 1', project=cls.project)
+        cls.pool_2 = Pool.objects.create(name='Pool 2', project=cls.project)
+        cls.no_answer = ResultCode.objects.get(result_code='No Answer')
+        cls.no_pledge = ResultCode.objects.get(result_code='No Pledge')
+
+    def add_call(self, attempt, result_code):
+        """Record a Call of the Prospect in Pool 1."""
+        return Call.objects.create(
+            caller=self.caller, prospect=self.prospect,
+            project=self.project, pool=self.pool_1, attempt=attempt,
+            result_code=result_code)
+
+    def test_status_created(self):
+        """Test saving a Call creates the status of its Prospect."""
+        call_obj = self.add_call(1, self.no_answer)
+        status = ProspectStatus.objects.get(
+            pool=self.pool_1, prospect=self.prospect)
+        self.assertEqual(status.attempts, 1)
+        self.assertEqual(status.last_result_code, self.no_answer)
+        self.assertEqual(status.last_call_time, call_obj.call_time)
+        self.assertFalse(status.is_complete)
+
+    def test_status_latest_call(self):
+        """Test the status follows the latest attempt."""
+        self.add_call(2, self.no_pledge)
+        self.add_call(1, self.no_answer)
+        status = ProspectStatus.objects.get()
+        self.assertEqual(status.attempts, 2)
+        self.assertTrue(status.is_complete)
+
+    def test_status_updated(self):
+        """Test updating a Call updates the status of its Prospect."""
+        call_obj = self.add_call(1, self.no_answer)
+        call_obj.result_code = self.no_pledge
+        call_obj.save()
+        self.assertTrue(ProspectStatus.objects.get().is_complete)
+
+    def test_status_moved(self):
+        """Test moving a Call to another Pool refreshes both statuses."""
+        call_obj = Call.objects.get(pk=self.add_call(1, self.no_answer).pk)
+        call_obj.pool = self.pool_2
+        call_obj.save()
+        self.assertEqual(
+            list(ProspectStatus.objects.values_list('pool', flat=True)),
+            [self.pool_2.pk])
+
+    def test_status_deleted(self):
+        """Test deleting the Calls of a Prospect deletes its status."""
+        self.add_call(1, self.no_answer)
+        call_obj = self.add_call(2, self.no_pledge)
+        call_obj.delete()
+        self.assertEqual(ProspectStatus.objects.get().attempts, 1)
+        Call.objects.all().delete()
+        self.assertFalse(ProspectStatus.objects.exists())
+
+    def test_status_from_upload(self):
+        """Test uploading Calls refreshes the statuses."""
+        self.add_call(1, self.no_answer)
+        Call.objects.from_upload([
+            {'caller': 'Test1', 'prospect': 'S1234567A',
+             'project': 'Project 1', 'pool': 'Pool 1',
+             'result_code': 'Not Available', 'attempt': 1},
+            {'caller': 'Test1', 'prospect': 'S1234567A',
+             'project': 'Project 1', 'pool': 'Pool 2',
+             'result_code': 'No Pledge', 'attempt': 1}])
+        statuses = {obj.pool.name: obj
+                    for obj in ProspectStatus.objects.all()}
+        self.assertEqual(statuses['Pool 1'].last_result_code.result_code,
+                         'Not Available')
+        self.assertTrue(statuses['Pool 2'].is_complete)
+
+    def test_rebuild(self):
+        """Test statuses are rebuilt from the Calls."""
+        self.add_call(1, self.no_answer)
+        self.add_call(2, self.no_pledge)
+        ProspectStatus.objects.update(attempts=5, is_complete=False)
+        call_command('rebuild_prospect_status', stdout=open(os.devnull, 'w'))
+        status = ProspectStatus.objects.get()
+        self.assertEqual(status.attempts, 2)
+        self.assertTrue(status.is_complete)
+
+
+class TestCallRollup(TestCase):
+    """Test cases for CallRollup."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.caller = PhonathonUser.objects.create_user(
+            username='Test1', password='Test1', name='Test User 1')
+        cls.prospect = Prospect.objects.create(
+            nric='S1234567A', name='Anna Low',
+            education_school='School of Humanities',
+            education_degree='B.A (Econs)', education_year=2017)
+        cls.project = Project.objects.create(name='Project 1')
+        cls.pool = Pool.objects.create(name='Pool 1', project=cls.project)
+
+    def add_call(self, attempt, result_code, **fields):
+        """Record a Call of the Prospect in Pool 1."""
+        fields.setdefault('caller', self.caller)
+        return Call.objects.create(
+            prospect=self.prospect, project=self.project, pool=self.pool,
+            attempt=attempt,
+            result_code=ResultCode.objects.get(result_code=result_code),
+            **fields)
+
+    def test_rollup_created(self):
+        """Test saving Calls counts them in the rollup of their hour."""
+        self.add_call(1, 'No Answer')
+        self.add_call(2, 'Specified Pledge (DM)',
+                      pledge_amount=Decimal('50.00'))
+        rollup = CallRollup.objects.get()
+        self.assertEqual(rollup.hour, floor_hour(timezone.now()))
+        self.assertEqual((rollup.calls, rollup.completed, rollup.pledges),
+                         (2, 1, 1))
+        self.assertEqual(rollup.pledge_amount, Decimal('50.00'))
+
+    def test_rollup_moved(self):
+        """Test saving a Call from an earlier hour moves it to this hour."""
+        call_obj = self.add_call(1, 'No Answer')
+        earlier = timezone.now() - timedelta(hours=3)
+        Call.objects.filter(pk=call_obj.pk).update(call_time=earlier)
+        CallRollup.objects.rebuild()
+        Call.objects.get(pk=call_obj.pk).save()
+        rollups = dict(CallRollup.objects.values_list('hour', 'calls'))
+        self.assertEqual(rollups, {floor_hour(earlier): 0,
+                                   floor_hour(timezone.now()): 1})
+
+    def test_rollup_hours_only(self):
+        """Test editing an old Call reads the Calls of two hours only."""
+        old_call = self.add_call(1, 'No Answer')
+        recent_call = self.add_call(2, 'No Answer')
+        Call.objects.filter(pk=old_call.pk).update(
+            call_time=timezone.now() - timedelta(days=7))
+        recent = timezone.now() - timedelta(days=3)
+        Call.objects.filter(pk=recent_call.pk).update(call_time=recent)
+        CallRollup.objects.rebuild()
+        with CaptureQueriesContext(connection) as queries:
+            Call.objects.get(pk=old_call.pk).save()
+        aggregates = [query['sql'] for query in queries
+                      if 'GROUP BY' in query['sql'] and
+                      'ccall_callrollup' not in query['sql'] and
+                      'call_time' in query['sql']]
+        self.assertEqual(len(aggregates), 1)
+        self.assertEqual(aggregates[0].count('"call_time" >='), 2)
+        rollups = dict(CallRollup.objects.values_list('hour', 'calls'))
+        self.assertEqual(rollups[floor_hour(recent)], 1)
+        self.assertEqual(rollups[floor_hour(timezone.now())], 1)
+
+    def test_rollup_keys_only(self):
+        """Test saving a Call leaves the rollups of other callers alone."""
+        other = PhonathonUser.objects.create_user(
+            username='Test2', password='Test2', name='Test User 2')
+        self.add_call(1, 'No Answer', caller=other)
+        CallRollup.objects.filter(caller=other).update(calls=5)
+        self.add_call(2, 'No Answer')
+        rollups = dict(CallRollup.objects.values_list('caller', 'calls'))
+        self.assertEqual(rollups, {self.caller.pk: 1, other.pk: 5})
+
+    def test_rollup_locked_first(self):
+        """Test the rollups are read, and locked, before the Calls."""
+        call_obj = self.add_call(1, 'No Answer')
+        with CaptureQueriesContext(connection) as queries:
+            call_obj.save()
+        tables = [table for query in queries
+                  for table in ('"ccall_callrollup"', 'GROUP BY')
+                  if query['sql'].startswith('SELECT') and
+                  table in query['sql']]
+        self.assertEqual(tables, ['"ccall_callrollup"', 'GROUP BY'])
+
+    def test_rollup_without_pool(self):
+        """Test Calls left without a Pool are not counted."""
+        call_obj = self.add_call(1, 'No Answer')
+        Call.objects.filter(pk=call_obj.pk).update(pool=None)
+        CallRollup.objects.rebuild()
+        self.assertFalse(CallRollup.objects.exists())
+        call_obj = Call.objects.get(pk=call_obj.pk)
+        call_obj.save()
+        self.assertFalse(CallRollup.objects.exists())
+
+    def test_rollup_deleted(self):
+        """Test deleting a Call zeroes its rollup and bumps updated_at."""
+        call_obj = self.add_call(1, 'No Answer')
+        updated_at = CallRollup.objects.get().updated_at
+        call_obj.delete()
+        rollup = CallRollup.objects.get()
+        self.assertEqual(rollup.calls, 0)
+        self.assertGreater(rollup.updated_at, updated_at)
+        self.assertEqual(
+            list(CallRollup.objects.changed_since(updated_at)), [rollup])
+
+    def test_rollup_from_upload(self):
+        """Test uploaded Calls are counted in the rollups."""
+        Call.objects.from_upload([{
+            'caller': 'Test1', 'prospect': 'S1234567A',
+            'project': 'Project 1', 'pool': 'Pool 1',
+            'result_code': 'No Answer', 'attempt': attempt}
+            for attempt in (1, 2)])
+        self.assertEqual(CallRollup.objects.get().calls, 2)
+
+    def test_rebuild(self):
+        """Test the rollups are rebuilt from the Calls."""
+        self.add_call(1, 'No Answer')
+        CallRollup.objects.update(calls=5)
+        call_command('rebuild_call_rollups', stdout=open(os.devnull, 'w'))
+        self.assertEqual(CallRollup.objects.get().calls, 1)
+
+
+@skipUnless(connection.vendor == 'postgresql',
+            'SQLite runs one writer at a time')
+class TestConcurrentRefresh(TransactionTestCase):
+    """Tests for refreshes of the same key by concurrent transactions."""
+    # the result codes are created by a data migration
+    serialized_rollback = True
+
+    def setUp(self):
+        self.caller = PhonathonUser.objects.create_user(
+            username='Test1', password='Test1', name='Test User 1')
+        self.prospect = Prospect.objects.create(
+            nric='S1234567A', name='Anna Low',
+            education_school='School of Humanities',
+            education_degree='B.A (Econs)', education_year=2017)
+        self.project = Project.objects.create(name='Project 1')
+        self.pool = Pool.objects.create(name='Pool 1', project=self.project)
+        self.no_answer = ResultCode.objects.get(result_code='No Answer')
+        self.add_call(1).save()
+
+    def add_call(self, attempt):
+        """An unsaved Call of the Prospect."""
+        return Call(caller=self.caller, prospect=self.prospect,
+                    project=self.project, pool=self.pool, attempt=attempt,
+                    result_code=self.no_answer)
+
+    def interleave(self, manager_class, read_calls, refresh):
+        """
+        Record attempts 2 and 3 in two threads, each refreshing with
+        refresh(call) in its transaction. The second records its Call
+        once the first has read the Calls with read_calls, and refreshes
+        before the first writes.
+        """
+        read = getattr(manager_class, read_calls)
+        first_read = threading.Event()
+        second_started = threading.Event()
+
+        def read_then_wait(manager, calls):
+            result = read(manager, calls)
+            if inspect.isgenerator(result):
+                result = list(result)
+            if threading.current_thread().name == 'first':
+                first_read.set()
+                second_started.wait(5)
+                # let the second refresh reach the lock
+                time.sleep(0.5)
+            return result
+
+        def record(attempt, wait=None, started=None):
+            try:
+                if wait is not None:
+                    wait.wait(5)
+                with transaction.atomic():
+                    call_obj = self.add_call(attempt)
+                    Call.objects.bulk_create([call_obj])
+                    call_obj = Call.objects.get(attempt=attempt)
+                    if started is not None:
+                        started.set()
+                    refresh(call_obj)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=record, args=(2,), name='first'),
+            threading.Thread(target=record, name='second', args=(
+                3, first_read, second_started))]
+        with mock.patch.object(manager_class, read_calls, read_then_wait):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+    def test_rollups(self):
+        """Test the later refresh counts the Calls of the earlier one."""
+        self.interleave(CallRollupManager, '_aggregate',
+                        lambda obj: CallRollup.objects.refresh_calls([obj]))
+        self.assertEqual(CallRollup.objects.get().calls, 3)
+
+    def test_statuses(self):
+        """Test the later refresh reads the Calls of the earlier one."""
+        self.interleave(
+            ProspectStatusManager, '_latest_calls',
+            lambda obj: ProspectStatus.objects.refresh(
+                [(obj.pool_id, obj.prospect_id)]))
+        self.assertEqual(ProspectStatus.objects.get().attempts, 3)
+
+
+class TestReservation(TestCase):
+    """Test cases for Reservation."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.caller_1 = PhonathonUser.objects.create_user(
+            username='Test1', password='Test1', name='Test User 1')
+        cls.caller_2 = PhonathonUser.objects.create_user(
+            username='Test2', password='Test2', name='Test User 2')
+        cls.project = Project.objects.create(name='Project 1')
+        cls.pool_1 = Pool.objects.create(
+            name='Pool 1', project=cls.project, max_attempts=2)
+        cls.pool_2 = Pool.objects.create(
+            name='Pool 2', project=cls.project, max_attempts=2)
+        cls.prospects = [Prospect.objects.create(
+            nric='S000000{}A'.format(i), name='Prospect {}'.format(i),
+            education_school='School of Humanities',
+            education_degree='B.A (Econs)', education_year=2017)
+            for i in range(3)]
+        cls.pool_1.prospects.add(*cls.prospects[:2])
+        cls.pool_2.prospects.add(cls.prospects[2])
+        for caller in (cls.caller_1, cls.caller_2):
+            Assignment.objects.create(user=caller, pool=cls.pool_2, order=2)
+            Assignment.objects.create(user=caller, pool=cls.pool_1, order=1)
+
+    def add_call(self, prospect, attempt, result_code):
+        """Record a Call of a Prospect in Pool 1."""
+        Call.objects.create(
+            caller=self.caller_1, prospect=prospect, project=self.project,
+            pool=self.pool_1, attempt=attempt,
+            result_code=ResultCode.objects.get(result_code=result_code))
+
+    def test_claim_next_order(self):
+        """Test Prospects are reserved in Assignment and upload order."""
+        reservation = Reservation.objects.claim_next(self.caller_1)
+        self.assertEqual(reservation.prospect, self.prospects[0])
+        self.assertEqual(reservation.pool, self.pool_1)
+        self.assertEqual(reservation.attempt, 1)
+
+    def test_claim_next_current(self):
+        """Test a caller is given their unexpired Reservation again."""
+        reservation = Reservation.objects.claim_next(self.caller_1)
+        self.assertEqual(Reservation.objects.claim_next(self.caller_1),
+                         reservation)
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_claim_next_distinct(self):
+        """Test callers are never given the same Prospect."""
+        reservations = [Reservation.objects.claim_next(caller)
+                        for caller in (self.caller_1, self.caller_2)]
+        self.assertEqual([obj.prospect for obj in reservations],
+                         self.prospects[:2])
+        # released Prospects return to the Pool
+        Reservation.objects.release(self.caller_1)
+        reservation = Reservation.objects.claim_next(self.caller_1)
+        self.assertEqual(reservation.prospect, self.prospects[0])
+
+    def test_claim_next_complete(self):
+        """Test Prospects with a complete latest Call are skipped."""
+        self.add_call(self.prospects[0], 1, 'No Answer')
+        self.add_call(self.prospects[0], 2, 'No Pledge')
+        reservation = Reservation.objects.claim_next(self.caller_1)
+        self.assertEqual(reservation.prospect, self.prospects[1])
+
+    def test_claim_next_incomplete(self):
+        """Test Prospects with an incomplete latest Call are called again."""
+        self.add_call(self.prospects[0], 1, 'No Answer')
+        reservation = Reservation.objects.claim_next(self.caller_1)
+        self.assertEqual(reservation.prospect, self.prospects[0])
+        self.assertEqual(reservation.attempt, 2)
+
+    def test_claim_next_max_attempts(self):
+        """Test Prospects at the maximum number of attempts are skipped."""
+        for prospect in self.prospects[:2]:
+            self.add_call(prospect, 1, 'No Answer')
+            self.add_call(prospect, 2, 'Not Available')
+        reservation = Reservation.objects.claim_next(self.caller_1)
+        self.assertEqual(reservation.prospect, self.prospects[2])
+        self.assertEqual(reservation.pool, self.pool_2)
+
+    def test_claim_next_inactive_pool(self):
+        """Test Prospects of inactive Pools are skipped."""
+        Pool.objects.filter(pk=self.pool_1.pk).update(max_attempts=0)
+        reservation = Reservation.objects.claim_next(self.caller_1)
+        self.assertEqual(reservation.pool, self.pool_2)
+
+    def test_claim_next_none(self):
+        """Test no Prospect is reserved once every Pool is done."""
+        Reservation.objects.claim_next(self.caller_1)
+        Reservation.objects.claim_next(self.caller_2)
+        caller = PhonathonUser.objects.create_user(
+            username='Test3', password='Test3', name='Test User 3')
+        Assignment.objects.create(user=caller, pool=self.pool_1, order=1)
+        self.assertIsNone(Reservation.objects.claim_next(caller))
+
+    def test_claim_next_expired(self):
+        """Test expired Reservations return their Prospect to the Pool."""
+        Reservation.objects.create(
+            caller=self.caller_2, prospect=self.prospects[0],
+            pool=self.pool_1, attempt=1,
+            expires_at=timezone.now() - timedelta(seconds=1))
+        reservation = Reservation.objects.claim_next(self.caller_1)
+        self.assertEqual(reservation.prospect, self.prospects[0])
+        self.assertEqual(Reservation.objects.count(), 1)
+
+    def test_claim_next_queries(self):
+        """Test a Prospect is reserved with a fixed number of queries."""
+        # current, expired, assignments, cursor, first open member,
+        # candidates, insert, 6 savepoints, reserved
+        with self.assertNumQueries(14):
+            Reservation.objects.claim_next(self.caller_1)
+
+    def test_claim_cursor(self):
+        """Test claims start after the members done calling."""
+        members = Pool.prospects.through.objects.filter(
+            pool=self.pool_1).order_by('pk')
+        self.add_call(self.prospects[0], 1, 'No Pledge')
+        reservation = Reservation.objects.claim_next(self.caller_1)
+        self.assertEqual(reservation.prospect, self.prospects[1])
+        self.pool_1.refresh_from_db()
+        self.assertEqual(self.pool_1.claim_cursor, members[0].pk)
+        self.assertNotIn(self.prospects[0].pk, [
+            member.prospect_id
+            for member in Reservation.objects.candidates(self.pool_1)])
+
+    def test_claim_cursor_rewound(self):
+        """Test Prospects reopened by a deleted Call are claimed again."""
+        self.add_call(self.prospects[0], 1, 'No Pledge')
+        Reservation.objects.claim_next(self.caller_1)
+        Call.objects.get(prospect=self.prospects[0]).delete()
+        self.pool_1.refresh_from_db()
+        self.assertEqual(self.pool_1.claim_cursor, 0)
+        reservation = Reservation.objects.claim_next(self.caller_2)
+        self.assertEqual(reservation.prospect, self.prospects[0])
+
+    def test_candidates_expired(self):
+        """Test expired Reservations do not hold their Prospect back."""
+        Reservation.objects.create(
+            caller=self.caller_2, prospect=self.prospects[0],
+            pool=self.pool_1, attempt=1,
+            expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(
+            [member.prospect_id
+             for member in Reservation.objects.candidates(self.pool_1)],
+            [prospect.pk for prospect in self.prospects[:2]])
+
+    def test_claim_next_locked(self):
+        """Test a claim failing as the database is locked is retried."""
+        bulk_create = Reservation.objects.bulk_create
+        attempts = []
+
+        def locked_once(objs):
+            attempts.append(objs)
+            if len(attempts) == 1:
+                raise OperationalError('database is locked')
+            return bulk_create(objs)
+        with mock.patch.object(Reservation.objects, 'bulk_create',
+                               side_effect=locked_once):
+            reservation = Reservation.objects.claim_next(self.caller_1)
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(reservation.prospect, self.prospects[0])
+
+    def test_claim_next_twice(self):
+        """Test concurrent claims of one caller each get a Reservation."""
+        claim = Reservation.objects._claim
+
+        def other_tab(caller, count):
+            # the same caller claims in another tab meanwhile
+            Reservation.objects.create(
+                caller=caller, prospect=self.prospects[2], pool=self.pool_2,
+                attempt=1, expires_at=timezone.now() + timedelta(minutes=1))
+            return claim(caller, count)
+        with mock.patch.object(Reservation.objects, '_claim',
+                               side_effect=other_tab):
+            reservation = Reservation.objects.claim_next(self.caller_1)
+        self.assertEqual(reservation.prospect, self.prospects[0])
+
+    def test_claim_batch(self):
+        """Test a batch of Prospects is reserved across Pools."""
+        reservations = Reservation.objects.claim_batch(self.caller_1, 5)
+        self.assertEqual([obj.prospect for obj in reservations],
+                         self.prospects)
+        self.assertEqual([obj.pool for obj in reservations],
+                         [self.pool_1, self.pool_1, self.pool_2])
+        # the other caller gets none of them
+        self.assertEqual(
+            Reservation.objects.claim_batch(self.caller_2, 5), [])
+
+    def test_claim_batch_top_up(self):
+        """Test held Reservations count towards the batch and are renewed."""
+        Reservation.objects.create(
+            caller=self.caller_1, prospect=self.prospects[1],
+            pool=self.pool_1, attempt=1,
+            expires_at=timezone.now() + timedelta(seconds=1))
+        reservations = Reservation.objects.claim_batch(self.caller_1, 2)
+        self.assertEqual([obj.prospect for obj in reservations],
+                         [self.prospects[1], self.prospects[0]])
+        self.assertGreater(reservations[0].expires_at,
+                           timezone.now() + timedelta(minutes=1))
+
+    def test_claim_batch_conflict(self):
+        """Test Prospects reserved concurrently are passed over."""
+        def stale_candidates(pool):
+            # another caller reserves the first member after it was fetched
+            if not Reservation.objects.exists():
+                Reservation.objects.create(
+                    caller=self.caller_2, prospect=self.prospects[0],
+                    pool=self.pool_1, attempt=1, expires_at=timezone.now() +
+                    timedelta(minutes=1))
+            return Pool.prospects.through.objects.filter(
+                pool=pool).annotate(last_attempt=Value(
+                    None, output_field=IntegerField())).order_by('pk')
+        with mock.patch.object(Reservation.objects, 'candidates',
+                               side_effect=stale_candidates):
+            reservations = Reservation.objects.claim_batch(self.caller_1, 2)
+        self.assertEqual([obj.prospect for obj in reservations],
+                         self.prospects[1:])
+
+    def test_claim_batch_history(self):
+        """Test the Call history of a batch is loaded in fixed queries."""
+        self.add_call(self.prospects[0], 1, 'No Answer')
+        self.add_call(self.prospects[1], 1, 'No Answer')
+        Reservation.objects.claim_batch(self.caller_1, 3)
+        # held Reservations, with their Calls
+        with self.assertNumQueries(2):
+            history = [obj.to_dict(history=True)['calls'] for obj in
+                       Reservation.objects.held(self.caller_1)]
+        self.assertEqual([len(calls) for calls in history], [1, 1, 0])
+        self.assertEqual(history[0][0]['result_code'], 'No Answer')
+        self.assertEqual(history[0][0]['caller'], 'Test User 1')
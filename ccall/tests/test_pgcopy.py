@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""Tests for the uploads staged with COPY on PostgreSQL."""
+
+from __future__ import unicode_literals
+
+from decimal import Decimal
+from unittest import skipUnless
+
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from ..models.call import Call
+from ..models.fund import Fund
+from ..models.pledge import Pledge
+from ..models.pool import Pool
+from ..models.project import Project
+from ..models.prospect import Prospect
+from ..models.user import PhonathonUser
+from ..pgcopy import INVALID_VALUE_ERRORS, copy_text, db_value, uses_copy
+
+
+class TestCopyValues(TestCase):
+    """Tests for converting uploaded values for COPY."""
+
+    def test_copy_text(self):
+        """Test values are escaped for the text format of COPY."""
+        self.assertEqual(copy_text(None), '\\N')
+        self.assertEqual(copy_text(Decimal('50.00')), '50.00')
+        self.assertEqual(copy_text('Line 1\nLine 2\tC:\\'),
+                         'Line 1\\nLine 2\\tC:\\\\')
+
+    def test_db_value(self):
+        """Test values are converted as the column would store them."""
+        field = Call._meta.get_field('pledge_amount')
+        self.assertIsNone(db_value(field, '', connection))
+        self.assertEqual(
+            Decimal(db_value(field, '50.5', connection)), Decimal('50.50'))
+        with self.assertRaises(INVALID_VALUE_ERRORS):
+            db_value(field, 'fifty', connection)
+
+    def test_db_value_rejected(self):
+        """Test values the column rejects raise instead of failing COPY."""
+        with self.assertRaises(INVALID_VALUE_ERRORS):
+            db_value(Call._meta.get_field('attempt'), '-1', connection)
+        with self.assertRaises(INVALID_VALUE_ERRORS):
+            db_value(Prospect._meta.get_field('nric'), 'S' * 20, connection)
+        with self.assertRaises(INVALID_VALUE_ERRORS):
+            db_value(Prospect._meta.get_field('name'), None, connection)
+
+    def test_uses_copy(self):
+        """Test COPY is only used on PostgreSQL, unless disabled."""
+        self.assertEqual(uses_copy(Prospect.objects),
+                         connection.vendor == 'postgresql')
+        with override_settings(UPLOAD_COPY=False):
+            self.assertFalse(uses_copy(Prospect.objects))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'COPY needs PostgreSQL')
+class TestCopyUploads(TestCase):
+    """Tests for the uploads staged with COPY."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = PhonathonUser.objects.create_user(
+            username='caller', password='caller', name='Caller')
+        cls.project = Project.objects.create(name='Project 1')
+        cls.pool = Pool.objects.create(name='Pool 1', project=cls.project)
+        Fund.objects.create(name='NTU Bursaries')
+
+    def prospect_row(self, i, **values):
+        """An uploaded Prospect row."""
+        return dict({
+            'nric': 'S000000{}A'.format(i), 'name': 'Prospect {}'.format(i),
+            'phone_mobile': '+65 9123 456{}'.format(i)}, **values)
+
+    def test_prospect_upload(self):
+        """Test Prospects are created, updated and skipped in one merge."""
+        Prospect.objects.from_upload([self.prospect_row(0)])
+        stats = {'skipped': 0}
+        created, updated = Prospect.objects.from_upload([
+            self.prospect_row(0), self.prospect_row(1),
+            self.prospect_row(2, name='Old'), self.prospect_row(2),
+            {'name': 'No NRIC'}], stats=stats)
+        self.assertEqual(sorted(obj.nric for obj in created),
+                         ['S0000001A', 'S0000002A'])
+        self.assertEqual(stats['skipped'], 1)
+        prospect = Prospect.objects.get(nric='S0000002A')
+        self.assertEqual(prospect.name, 'Prospect 2')
+        self.assertEqual(prospect.phone_digits, '91234562')
+        created, updated = Prospect.objects.from_upload(
+            [self.prospect_row(1, name='Renamed')])
+        self.assertEqual([obj.name for obj in updated], ['Renamed'])
+
+    def test_pledge_upload(self):
+        """Test Pledges are created in order, unresolved rows skipped."""
+        Prospect.objects.from_upload([self.prospect_row(0)])
+        created, _ = Pledge.objects.from_upload([
+            {'prospect': 'S0000000A', 'pledge_fund': 'NTU Bursaries',
+             'pledge_amount': '100.50', 'pledge_date': '01/03/2017'},
+            {'prospect': 'S0000009A', 'pledge_fund': 'NTU Bursaries',
+             'pledge_amount': '10', 'pledge_date': '01/03/2017'},
+            {'prospect': 'S0000000A', 'pledge_fund': 'NTU Bursaries',
+             'pledge_amount': '20', 'pledge_date': '02/03/2017'}])
+        self.assertEqual([obj.pledge_amount for obj in created],
+                         [Decimal('100.50'), Decimal('20.00')])
+        self.assertEqual(Pledge.objects.count(), 2)
+
+    def test_call_upload(self):
+        """Test Calls are merged on their natural key."""
+        Prospect.objects.from_upload([self.prospect_row(0)])
+        row = {'caller': 'caller', 'prospect': 'S0000000A',
+               'project': 'Project 1', 'pool': 'Pool 1', 'attempt': '1',
+               'result_code': 'No Answer'}
+        created, _ = Call.objects.from_upload([dict(row)])
+        self.assertEqual(len(created), 1)
+        stats = {'skipped': 0}
+        created, updated = Call.objects.from_upload([
+            dict(row), dict(row, attempt='2', comment='Call back'),
+            dict(row, pool='No Pool')], stats=stats)
+        self.assertEqual([obj.comment for obj in created], ['Call back'])
+        self.assertEqual(stats['skipped'], 1)
+        self.assertEqual(Call.objects.count(), 2)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""Tests for the Prospect search index."""
+
+from __future__ import unicode_literals
+
+import os
+
+from django.contrib.auth.models import Group
+from django.core.management import call_command
+from django.test import TestCase
+
+from ..models.prospect import Prospect
+from ..models.user import PhonathonUser
+from ..search import normalize_phone, phone_digits, prospect_index
+
+
+class TestPhoneDigits(TestCase):
+    """Tests for normalising phone numbers."""
+
+    def test_normalize_phone(self):
+        """Test formatting and the country code are stripped."""
+        self.assertEqual(normalize_phone('+65 9123-4567'), '91234567')
+        self.assertEqual(normalize_phone('6123 4567'), '61234567')
+        self.assertEqual(normalize_phone(''), '')
+
+    def test_phone_digits(self):
+        """Test phone numbers are joined, skipping blank ones."""
+        self.assertEqual(phone_digits('61234567', ''), '61234567')
+        self.assertEqual(phone_digits('61234567', '91234567'),
+                         '61234567 91234567')
+
+
+class TestProspectIndex(TestCase):
+    """Tests for searching Prospects."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.prospect_obj = {
+            'nric': 'S1234567A',
+            'name': 'Anna Low',
+            'email': 'anna.low@example.com',
+            'phone_home': '61234567',
+            'phone_mobile': '91234567',
+            'education_school': 'School of Humanities',
+            'education_degree': 'B.A (Econs)',
+            'education_year': 2017,
+        }
+        cls.prospect = Prospect.objects.create(**cls.prospect_obj)
+        Prospect.objects.create(
+            nric='S7654321B', name='Ben Tan', education_year=2016,
+            education_school='School of Humanities',
+            education_degree='B.A (Econs)')
+
+    def search(self, query):
+        """NRICs of the Prospects found by query."""
+        return [obj.nric for obj in prospect_index().search(query)]
+
+    def test_search(self):
+        """Test Prospects are found by prefixes of their columns."""
+        self.assertEqual(self.prospect.phone_digits, '61234567 91234567')
+        self.assertEqual(self.search('anna'), ['S1234567A'])
+        self.assertEqual(self.search('Low an'), ['S1234567A'])
+        self.assertEqual(self.search('s12345'), ['S1234567A'])
+        self.assertEqual(self.search('anna.low@example'), ['S1234567A'])
+        self.assertEqual(self.search('+65 9123 4567'), ['S1234567A'])
+        self.assertEqual(self.search('6123'), ['S1234567A'])
+        self.assertEqual(self.search('carol'), [])
+        self.assertEqual(self.search(' - '), [])
+
+    def test_search_filter(self):
+        """Test the search without an index finds the same Prospects."""
+        index = prospect_index()
+        for query in ('anna', 'Low an', 's12345', '+65 9123 4567'):
+            self.assertEqual(
+                list(index.filter(query).values_list('nric', flat=True)),
+                ['S1234567A'])
+
+    def test_search_saved(self):
+        """Test saved and deleted Prospects are kept in the index."""
+        self.prospect.name = 'Anna Lee'
+        self.prospect.phone_mobile = '98765432'
+        self.prospect.save(update_fields=['name', 'phone_mobile'])
+        self.assertEqual(self.search('lee'), ['S1234567A'])
+        self.assertEqual(self.search('98765432'), ['S1234567A'])
+        self.assertEqual(self.search('91234567'), [])
+        self.assertEqual(Prospect.objects.get(nric='S1234567A').phone_digits,
+                         '61234567 98765432')
+        self.prospect.delete()
+        self.assertEqual(self.search('anna'), [])
+
+    def test_search_from_upload(self):
+        """Test uploaded Prospects are written to the index."""
+        prospect_obj = self.prospect_obj.copy()
+        prospect_obj['phone_mobile'] = '98765432'
+        new_obj = self.prospect_obj.copy()
+        new_obj.update({'nric': 'S1111111C', 'name': 'Carol Ng',
+                        'phone_mobile': '81234567'})
+        Prospect.objects.from_upload([prospect_obj, new_obj])
+        self.assertEqual(self.search('98765432'), ['S1234567A'])
+        self.assertEqual(self.search('91234567'), [])
+        self.assertEqual(self.search('carol'), ['S1111111C'])
+
+    def test_rebuild(self):
+        """Test the index is rebuilt with the phone digits."""
+        Prospect.objects.update(phone_digits='')
+        call_command('rebuild_prospect_search', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.search('91234567'), ['S1234567A'])
+
+
+class TestSearchViews(TestCase):
+    """Tests for the Prospect search views."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = PhonathonUser.objects.create_superuser(
+            username='super', password='super', name='Super',
+            email='admin@example.com')
+        cls.caller = PhonathonUser.objects.create_user(
+            username='test', password='test', name='Test')
+        cls.caller.groups.add(Group.objects.get(name='Callers'))
+        Prospect.objects.create(
+            nric='S1234567A', name='Anna Low', phone_mobile='91234567',
+            education_school='School of Humanities',
+            education_degree='B.A (Econs)', education_year=2017)
+
+    def test_search_prospects(self):
+        """Test matching Prospects are suggested as JSON."""
+        self.client.force_login(self.caller)
+        response = self.client.get('/ccall/prospects/search/', {'q': 'ann'})
+        self.assertEqual(
+            [obj['nric'] for obj in response.json()['prospects']],
+            ['S1234567A'])
+        response = self.client.get('/ccall/prospects/search/', {'q': 'a'})
+        self.assertEqual(response.json()['prospects'], [])
+
+    def test_admin_search(self):
+        """Test the Prospect admin searches through the index."""
+        self.client.force_login(self.user)
+        response = self.client.get('/admin/ccall/prospect/',
+                                   {'q': '9123 4567'})
+        self.assertContains(response, 'S1234567A')
+        response = self.client.get('/admin/ccall/prospect/', {'q': 'ben'})
+        self.assertNotContains(response, 'S1234567A')
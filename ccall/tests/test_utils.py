@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Tests for utilities."""
+
+from __future__ import unicode_literals
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from ..models.prospect import Prospect
+from ..utils import (apply_sqlite_pragmas, bulk_update_rows, chunked, diff_row,
+                     read_csv_chunks)
+
+
+class TestChunked(TestCase):
+    """Tests for splitting iterables into chunks."""
+
+    def test_chunked(self):
+        """Test chunks of a generator."""
+        chunks = list(chunked((i for i in range(5)), 2))
+        self.assertEqual(chunks, [[0, 1], [2, 3], [4]])
+
+    def test_chunked_empty(self):
+        """Test chunks of an empty iterable."""
+        self.assertEqual(list(chunked([], 2)), [])
+
+
+class TestReadCSVChunks(TestCase):
+    """Tests for reading uploaded CSV files in chunks."""
+
+    def test_read_csv_chunks(self):
+        """Test rows are read in chunks."""
+        csv_file = SimpleUploadedFile(
+            'test.csv', 'name\r\nNTU Bursaries\r\nCafé Fund\r\nOthers\r\n'
+            .encode('utf-8'))
+        chunks = list(read_csv_chunks(csv_file, 2))
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual(chunks[0][1]['name'], 'Café Fund')
+        self.assertEqual(chunks[1][0]['name'], 'Others')
+
+    def test_read_csv_chunks_multiline(self):
+        """Test quoted values spanning several lines."""
+        csv_file = SimpleUploadedFile(
+            'test.csv', b'name,comment\nA,"line 1\nline 2"\nB,\n')
+        rows = next(read_csv_chunks(csv_file))
+        self.assertEqual(rows[0]['comment'], 'line 1\nline 2')
+        self.assertEqual(rows[1]['name'], 'B')
+
+
+class TestDiffRow(TestCase):
+    """Tests for comparing uploaded rows with saved objects."""
+
+    def setUp(self):
+        self.prospect = Prospect.objects.create(
+            nric='S1234567A', name='Anna Low', education_year=2017)
+
+    def test_diff_row_unchanged(self):
+        """Test values are normalised before comparing."""
+        self.assertEqual(diff_row(self.prospect, {
+            'nric': 'S1234567A', 'education_year': '2017'}), {})
+
+    def test_diff_row_changed(self):
+        """Test only changed fields are reported and applied."""
+        changes = diff_row(self.prospect, {
+            'name': 'Anna Lim', 'education_year': '2017'})
+        self.assertEqual(changes, {'name': 'Anna Lim'})
+        self.assertEqual(self.prospect.name, 'Anna Lim')
+
+    def test_bulk_update_rows(self):
+        """Test only the changed fields are written back."""
+        Prospect.objects.filter(pk=self.prospect.pk).update(email='a@a.com')
+        self.prospect.name = 'Anna Lim'
+        failed = bulk_update_rows(
+            Prospect.objects, [(self.prospect, ['name'])])
+        self.assertFalse(failed)
+        prospect = Prospect.objects.get(pk=self.prospect.pk)
+        self.assertEqual(prospect.name, 'Anna Lim')
+        self.assertEqual(prospect.email, 'a@a.com')
+
+
+class TestSqlitePragmas(TestCase):
+    """Tests for tuning SQLite connections."""
+
+    def pragma(self, name):
+        """Value of a PRAGMA on the test connection."""
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA {}'.format(name))
+            return cursor.fetchone()[0]
+
+    def test_connection_pragmas(self):
+        """Test the PRAGMAs of the settings are run on new connections."""
+        if connection.vendor != 'sqlite':
+            self.skipTest('Needs a SQLite database')
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('busy_timeout'), 20000)
+        self.assertEqual(self.pragma('cache_size'), -65536)
+        for cache_size in (-2000, -65536):
+            with override_settings(
+                    SQLITE_PRAGMAS=(('cache_size', cache_size),)):
+                apply_sqlite_pragmas(connection)
+            self.assertEqual(self.pragma('cache_size'), cache_size)
@@ -3,21 +3,36 @@
 
 from __future__ import unicode_literals
 
+import json
 import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
 from django.contrib.auth.models import Group
-from django.test import TestCase
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
 from django.urls import resolve
+from django.utils import timezone
 from django.views.generic.base import RedirectView
 
 from ..models.call import Call
+from ..models.call_rollup import CallRollup
 from ..models.fund import Fund
 from ..models.pledge import Pledge
 from ..models.pool import Pool
 from ..models.project import Project
 from ..models.prospect import Prospect
-from ..models.user import PhonathonUser
-from ..views import LoginView, LogoutView, home, upload, upload_pool
+from ..models.reservation import Reservation
+from ..models.result_code import ResultCode
+from ..models.upload_job import UploadJob
+from ..models.user import Assignment, PhonathonUser
+from ..views import (LoginView, LogoutView, dashboard, dashboard_data, home,
+                     next_prospect, prospect_batch, submit_calls, upload,
+                     upload_job, upload_job_status, upload_pool)
 
 
 class TestResolveURLs(TestCase):
@@ -33,6 +48,27 @@ class TestResolveURLs(TestCase):
         view = resolve('/ccall/')
         self.assertEqual(view.func, home)
 
+    def test_resolve_url_next_prospect(self):
+        """Test whether /ccall/next/ resolves to next_prospect view."""
+        view = resolve('/ccall/next/')
+        self.assertEqual(view.func, next_prospect)
+
+    def test_resolve_url_prospect_batch(self):
+        """Test whether /ccall/batch/ resolves to prospect_batch view."""
+        view = resolve('/ccall/batch/')
+        self.assertEqual(view.func, prospect_batch)
+
+    def test_resolve_url_dashboard(self):
+        """Test whether /admin/dashboard/ resolves to dashboard views."""
+        self.assertEqual(resolve('/admin/dashboard/').func, dashboard)
+        self.assertEqual(resolve('/admin/dashboard/data/').func,
+                         dashboard_data)
+
+    def test_resolve_url_ccall_calls(self):
+        """Test whether /ccall/calls/ resolves to submit_calls view."""
+        view = resolve('/ccall/calls/')
+        self.assertEqual(view.func, submit_calls)
+
     def test_resolve_url_login(self):
         """Test whether login/ resolves to login view."""
         view = resolve('/login/')
@@ -53,6 +89,16 @@ class TestResolveURLs(TestCase):
         view = resolve('/admin/upload_pool/')
         self.assertEqual(view.func, upload_pool)
 
+    def test_resolve_url_upload_job(self):
+        """Test whether /admin/upload/1 resolves to upload_job view."""
+        view = resolve('/admin/upload/1/')
+        self.assertEqual(view.func, upload_job)
+
+    def test_resolve_url_upload_job_status(self):
+        """Test whether /admin/upload/1/status resolves to status view."""
+        view = resolve('/admin/upload/1/status/')
+        self.assertEqual(view.func, upload_job_status)
+
 
 class TestLoginLogout(TestCase):
     """Test the login-logout flow."""
@@ -87,6 +133,18 @@ class TestLoginLogout(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.redirect_chain[-1][0], '/admin/')
 
+    def test_admin_index_roles(self):
+        """Test upload shortcuts are only shown to managers and above."""
+        user = PhonathonUser.objects.create_user(
+            username='supervisor', password='supervisor', name='Supervisor')
+        user.groups.add(Group.objects.get(name='Supervisors'))
+        self.client.force_login(user)
+        response = self.client.get('/admin/')
+        self.assertNotContains(response, '/admin/upload_pool/')
+        user.groups.add(Group.objects.get(name='Managers'))
+        response = self.client.get('/admin/')
+        self.assertContains(response, '/admin/upload_pool/')
+
     def test_logout(self):
         """Test logout."""
         self.client.post(
@@ -101,6 +159,19 @@ class TestUploadView(TestCase):
     cur_dir = os.path.dirname(os.path.realpath(__file__))
     data_dir = os.path.join(cur_dir, 'test_data')
 
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+        super(TestUploadView, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestUploadView, cls).tearDownClass()
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root)
+
     @classmethod
     def setUpTestData(cls):
         cls.user = PhonathonUser.objects.create_user(
@@ -119,9 +190,24 @@ class TestUploadView(TestCase):
                                         {'model': 'Caller',
                                          'uploaded_file': csv_},
                                         follow=True)
+        call_command('process_uploads', once=True)
         self.assertEqual(response.status_code, 200)
         self.assertTrue(PhonathonUser.objects.get(username='Test1'))
 
+    def test_upload_user_hash_pool(self):
+        """Test the worker keeps one pool of processes for the passwords of
+        a user upload."""
+        data_file = os.path.join(self.data_dir, 'test_user.csv')
+        with open(data_file, 'r') as csv_:
+            self.client.post('/admin/upload/', {'model': 'Caller',
+                                                'uploaded_file': csv_})
+        with mock.patch('ccall.jobs.os.cpu_count', return_value=2), \
+                mock.patch('ccall.jobs.ProcessPoolExecutor') as pool:
+            call_command('process_uploads', once=True, chunk_size=1)
+        pool.assert_called_once_with(2)
+        pool.return_value.shutdown.assert_called_once_with()
+        self.assertTrue(PhonathonUser.objects.get(username='Test1'))
+
     def test_upload_fund(self):
         """Test upload a fund CSV file."""
         data_file = os.path.join(self.data_dir, 'test_fund.csv')
@@ -130,6 +216,7 @@ class TestUploadView(TestCase):
                                         {'model': 'Fund',
                                          'uploaded_file': csv_},
                                         follow=True)
+        call_command('process_uploads', once=True)
         self.assertEqual(response.status_code, 200)
         self.assertTrue(Fund.objects.get(name='NTU Bursaries'))
 
@@ -141,6 +228,7 @@ class TestUploadView(TestCase):
                                         {'model': 'Prospect',
                                          'uploaded_file': csv_},
                                         follow=True)
+        call_command('process_uploads', once=True)
         self.assertEqual(response.status_code, 200)
         self.assertTrue(Prospect.objects.get(nric='S1234567A'))
 
@@ -154,6 +242,7 @@ class TestUploadView(TestCase):
                                         {'model': 'Pledge',
                                          'uploaded_file': csv_},
                                         follow=True)
+        call_command('process_uploads', once=True)
         self.assertEqual(response.status_code, 200)
         self.assertTrue(Pledge.objects.get(prospect__nric='S1234567A'))
 
@@ -167,6 +256,7 @@ class TestUploadView(TestCase):
                                          'project': project_obj.id,
                                          'uploaded_file': csv_},
                                         follow=True)
+        call_command('process_uploads', once=True)
         self.assertEqual(response.status_code, 200)
         self.assertTrue(Pool.objects.get(name='Test Pool'))
         self.assertEqual(Pool.objects.get(
@@ -181,5 +271,294 @@ class TestUploadView(TestCase):
                                         {'model': 'Call',
                                          'uploaded_file': csv_},
                                         follow=True)
+        call_command('process_uploads', once=True)
         self.assertEqual(response.status_code, 200)
         self.assertTrue(Call.objects.get(prospect__nric='S1234567A'))
+
+    def test_upload_job_status(self):
+        """Test the progress reported for a processed upload."""
+        data_file = os.path.join(self.data_dir, 'test_fund.csv')
+        with open(data_file, 'r') as csv_:
+            response = self.client.post('/admin/upload/',
+                                        {'model': 'Fund',
+                                         'uploaded_file': csv_})
+        job = UploadJob.objects.get()
+        self.assertRedirects(response, '/admin/upload/{}/'.format(job.pk))
+        self.assertEqual(self.client.get(
+            '/admin/upload/{}/status/'.format(job.pk)).json()['status'],
+                         UploadJob.STATUS_QUEUED)
+        call_command('process_uploads', once=True)
+        status = self.client.get(
+            '/admin/upload/{}/status/'.format(job.pk)).json()
+        self.assertEqual(status['status'], UploadJob.STATUS_DONE)
+        self.assertEqual(status['rows_processed'], 1)
+        self.assertEqual(status['rows_created'], 1)
+        self.assertEqual(status['rows_failed'], 0)
+
+    def test_upload_file_deleted(self):
+        """Test the uploaded file is deleted once processed."""
+        self.test_upload_fund()
+        job = UploadJob.objects.get()
+        self.assertTrue(job.uploaded_file.name)
+        self.assertFalse(
+            job.uploaded_file.storage.exists(job.uploaded_file.name))
+
+    def test_upload_job_stale(self):
+        """Test jobs left running by a stopped worker are failed."""
+        data_file = os.path.join(self.data_dir, 'test_fund.csv')
+        with open(data_file, 'r') as csv_:
+            self.client.post('/admin/upload/', {'model': 'Fund',
+                                                'uploaded_file': csv_})
+            csv_.seek(0)
+            self.client.post('/admin/upload/', {'model': 'Fund',
+                                                'uploaded_file': csv_})
+        stale, running = UploadJob.objects.order_by('pk')
+        UploadJob.objects.claim()
+        UploadJob.objects.claim()
+        UploadJob.objects.filter(pk=stale.pk).update(
+            heartbeat_at=timezone.now() - timedelta(hours=1))
+        call_command('process_uploads', once=True)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, UploadJob.STATUS_FAILED)
+        self.assertIn('worker stopped', stale.error)
+        self.assertFalse(
+            stale.uploaded_file.storage.exists(stale.uploaded_file.name))
+        running.refresh_from_db()
+        self.assertEqual(running.status, UploadJob.STATUS_RUNNING)
+
+    def test_upload_job_chunk_rejected(self):
+        """Test a chunk rejected by the database is counted as failed, and
+        the next chunks are processed."""
+        csv_ = SimpleUploadedFile(
+            'funds.csv', b'name\nFund 1\nFund 2\nFund 3\n')
+        self.client.post('/admin/upload/', {'model': 'Fund',
+                                            'uploaded_file': csv_})
+        from_upload = Fund.objects.from_upload
+        calls = iter([DatabaseError('database is locked')])
+
+        def reject_first(data, **kwargs):
+            error = next(calls, None)
+            if error is not None:
+                raise error
+            return from_upload(data, **kwargs)
+        with mock.patch.object(Fund.objects, 'from_upload', reject_first):
+            call_command('process_uploads', once=True, chunk_size=1)
+        job = UploadJob.objects.get()
+        self.assertEqual(job.status, UploadJob.STATUS_DONE)
+        self.assertEqual(job.rows_processed, 3)
+        self.assertEqual(job.rows_failed, 1)
+        self.assertEqual(job.rows_created, 2)
+        self.assertEqual(
+            sorted(Fund.objects.values_list('name', flat=True)),
+            ['Fund 2', 'Fund 3'])
+
+    def test_upload_job_status_skipped(self):
+        """Test unchanged rows are reported as skipped."""
+        self.test_upload_fund()
+        self.test_upload_fund()
+        job = UploadJob.objects.latest('pk')
+        self.assertEqual(job.rows_processed, 1)
+        self.assertEqual(job.rows_updated, 0)
+        self.assertEqual(job.rows_skipped, 1)
+
+    def test_upload_job_status_merged(self):
+        """Test rows repeated within a chunk are reported as merged, not as
+        failed."""
+        csv_ = SimpleUploadedFile(
+            'funds.csv', b'name\nFund 1\nFund 2\nFund 1\nFund 1\n')
+        self.client.post('/admin/upload/', {'model': 'Fund',
+                                            'uploaded_file': csv_})
+        call_command('process_uploads', once=True)
+        job = UploadJob.objects.get()
+        self.assertEqual(job.rows_processed, 4)
+        self.assertEqual(job.rows_created, 2)
+        self.assertEqual(job.rows_merged, 2)
+        self.assertEqual(job.rows_failed, 0)
+
+    def test_upload_pool_replace(self):
+        """Test upload a pool CSV file replacing the pool's Prospects."""
+        self.test_upload_pool()
+        pool_obj = Pool.objects.get(name='Test Pool')
+        pool_obj.prospects.add(Prospect.objects.create(
+            nric='S7654321A', name='Anna Low', education_year=2017))
+        data_file = os.path.join(self.data_dir, 'test_prospect.csv')
+        with open(data_file, 'r') as csv_:
+            self.client.post('/admin/upload_pool/',
+                             {'name': 'Test Pool',
+                              'project': pool_obj.project.id,
+                              'replace': True,
+                              'uploaded_file': csv_})
+        call_command('process_uploads', once=True)
+        self.assertEqual(
+            list(pool_obj.prospects.values_list('nric', flat=True)),
+            ['S1234567A'])
+
+
+class TestNextProspectView(TestCase):
+    """Test the next_prospect view."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = PhonathonUser.objects.create_user(
+            username='test', password='test')
+        cls.user.groups.add(Group.objects.get(name='Callers'))
+        project = Project.objects.create(name='Project 1')
+        pool = Pool.objects.create(
+            name='Pool 1', project=project, max_attempts=1)
+        pool.prospects.add(*[Prospect.objects.create(
+            nric='S000000{}A'.format(i), name='Prospect {}'.format(i),
+            education_school='School of Humanities',
+            education_degree='B.A (Econs)', education_year=2017)
+            for i in range(2)])
+        Assignment.objects.create(user=cls.user, pool=pool, order=1)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_next_prospect(self):
+        """Test the reserved Prospect is reported to the caller."""
+        response = self.client.get('/ccall/next/')
+        self.assertEqual(response.status_code, 200)
+        reservation = response.json()['reservation']
+        self.assertEqual(reservation['prospect']['nric'], 'S0000000A')
+        self.assertEqual(reservation['pool'], 'Pool 1')
+        self.assertEqual(reservation['project'], 'Project 1')
+        self.assertEqual(reservation['attempt'], 1)
+        # fetching again gives the same Prospect
+        response = self.client.get('/ccall/next/')
+        self.assertEqual(response.json()['reservation']['id'],
+                         reservation['id'])
+
+    def test_next_prospect_release(self):
+        """Test POST releases the Reservation and reserves the next one."""
+        self.client.get('/ccall/next/')
+        response = self.client.post('/ccall/next/')
+        self.assertEqual(
+            response.json()['reservation']['prospect']['nric'], 'S0000000A')
+        Pool.objects.update(max_attempts=0)
+        response = self.client.post('/ccall/next/')
+        self.assertIsNone(response.json()['reservation'])
+
+    def test_prospect_batch(self):
+        """Test a batch of Prospects is reserved for the caller."""
+        response = self.client.get('/ccall/batch/', {'size': 5})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['lease_seconds'], 900)
+        self.assertEqual(
+            [obj['prospect']['nric'] for obj in data['reservations']],
+            ['S0000000A', 'S0000001A'])
+        self.assertEqual(data['reservations'][0]['calls'], [])
+
+    def test_prospect_batch_release(self):
+        """Test POST releases the listed Reservations first."""
+        response = self.client.get('/ccall/batch/', {'size': 1})
+        reservation = response.json()['reservations'][0]
+        response = self.client.post('/ccall/batch/?size=1',
+                                    {'release': [reservation['id']]})
+        reservations = response.json()['reservations']
+        self.assertEqual(len(reservations), 1)
+        self.assertNotEqual(reservations[0]['id'], reservation['id'])
+
+    def test_next_prospect_login_required(self):
+        """Test anonymous users are redirected to login."""
+        self.client.logout()
+        response = self.client.get('/ccall/next/')
+        self.assertEqual(response.status_code, 302)
+
+    def post_calls(self, calls):
+        """POST call results as JSON."""
+        return self.client.post('/ccall/calls/', json.dumps({'calls': calls}),
+                                content_type='application/json')
+
+    def test_submit_calls(self):
+        """Test submitted Calls are recorded and their Prospects released."""
+        self.client.get('/ccall/batch/', {'size': 2})
+        response = self.post_calls([{
+            'client_ref': '0b6b2a4e-3c1e-4c55-9d6a-2f0e3e1d4a51',
+            'prospect': 'S0000000A', 'project': 'Project 1',
+            'pool': 'Pool 1', 'result_code': 'No Answer'}])
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['created'], 1)
+        self.assertEqual(data['calls'][0]['attempt'], 1)
+        self.assertEqual(
+            list(Reservation.objects.values_list('prospect__nric', flat=True)),
+            ['S0000001A'])
+        self.assertEqual(Call.objects.get().caller, self.user)
+
+    def test_submit_calls_invalid(self):
+        """Test invalid call results are reported and nothing is written."""
+        response = self.post_calls([
+            {'prospect': 'S0000000A', 'project': 'Project 1',
+             'pool': 'Pool 1', 'result_code': 'No Answer'},
+            {'prospect': 'S0000001A', 'project': 'Project 1'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()['errors']), ['1'])
+        response = self.post_calls([
+            {'prospect': 'S0000009A', 'project': 'Project 1',
+             'pool': 'Pool 1', 'result_code': 'No Answer'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Call.objects.exists())
+
+    def test_submit_calls_post_required(self):
+        """Test GET is not allowed."""
+        response = self.client.get('/ccall/calls/')
+        self.assertEqual(response.status_code, 405)
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class TestDashboardView(TestCase):
+    """Test the dashboard views."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = PhonathonUser.objects.create_user(
+            username='test', password='test', name='Test User')
+        cls.user.groups.add(Group.objects.get(name='Supervisors'))
+        cls.project = Project.objects.create(name='Project 1')
+        cls.pool = Pool.objects.create(name='Pool 1', project=cls.project)
+        cls.prospect = Prospect.objects.create(
+            nric='S0000000A', name='Prospect 0',
+            education_school='School of Humanities',
+            education_degree='B.A (Econs)', education_year=2017)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def add_call(self, attempt):
+        """Record a Call of the Prospect."""
+        Call.objects.create(
+            caller=self.user, prospect=self.prospect, project=self.project,
+            pool=self.pool, attempt=attempt,
+            result_code=ResultCode.objects.get(result_code='No Answer'))
+
+    def test_dashboard(self):
+        """Test the dashboard is shown to supervisors."""
+        response = self.client.get('/admin/dashboard/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_dashboard_data(self):
+        """Test the rollups of today are reported, then only changes."""
+        self.add_call(1)
+        data = self.client.get('/admin/dashboard/data/').json()
+        self.assertEqual(len(data['rollups']), 1)
+        self.assertEqual(data['rollups'][0]['pool'], 'Pool 1')
+        self.assertEqual(data['rollups'][0]['calls'], 1)
+        CallRollup.objects.update(
+            updated_at=timezone.now() - timedelta(minutes=1))
+        data = self.client.get('/admin/dashboard/data/',
+                               {'since': data['cursor']}).json()
+        self.assertEqual(data['rollups'], [])
+        self.add_call(2)
+        cursor = (timezone.now() - timedelta(seconds=30)).isoformat()
+        data = self.client.get('/admin/dashboard/data/',
+                               {'since': cursor}).json()
+        self.assertEqual(data['rollups'][0]['calls'], 2)
+
+    def test_dashboard_callers(self):
+        """Test callers cannot see the dashboard."""
+        self.user.groups.set([Group.objects.get(name='Callers')])
+        response = self.client.get('/admin/dashboard/data/')
+        self.assertEqual(response.status_code, 302)
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Utilities for app ccall."""
+
+from __future__ import unicode_literals
+
+import codecs
+import csv
+import logging
+from collections import OrderedDict
+from itertools import islice
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Case, Value, When
+
+ccall_log = logging.getLogger('ccall')
+
+# default number of rows processed per chunk during uploads, kept below
+# the 999 query parameters allowed by older SQLite builds
+UPLOAD_CHUNK_SIZE = 500
+
+
+def chunked(iterable, size):
+    """Yield successive lists of at most size items from iterable."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_csv_chunks(csv_file, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    Yield the rows of an uploaded CSV file in chunks of chunk_size.
+    The file is decoded line by line, so only one chunk of rows is held
+    in memory at a time.
+    """
+    csv_file.seek(0)
+    return chunked(csv.DictReader(codecs.iterdecode(csv_file, 'utf-8')),
+                   chunk_size)
+
+
+def bulk_update(queryset, objs, fields):
+    """
+    Write fields of saved objs back to the database.
+    Uses one UPDATE ... SET field = CASE pk WHEN ... per batch of objs.
+    """
+    if not objs or not fields:
+        return
+    opts = queryset.model._meta
+    fields = [opts.get_field(name) for name in fields]
+    # one pk and one value per field per object, plus the pk IN (...) list
+    batch_size = connections[queryset.db].ops.bulk_batch_size(
+        [opts.pk] * (2 * len(fields) + 1), objs)
+    for batch in chunked(objs, max(batch_size, 1)):
+        values = {}
+        for field in fields:
+            whens = [When(pk=obj.pk, then=Value(field.pre_save(obj, False),
+                                                output_field=field))
+                     for obj in batch]
+            values[field.name] = Case(*whens, output_field=field)
+        queryset.filter(pk__in=[obj.pk for obj in batch]).update(**values)
+
+
+def bulk_create_rows(manager, pending):
+    """
+    Create objects for uploaded rows in bulk.
+    pending is a list of (unsaved object, row) pairs. If the batch is
+    rejected, objects are created one by one so that only the offending
+    rows are reported. Returns the list of created objects.
+    """
+    model_name = manager.model.__name__
+    if not pending:
+        return []
+    try:
+        with transaction.atomic(using=manager.db):
+            created = manager.bulk_create([obj for obj, _ in pending])
+        for _, row in pending:
+            ccall_log.debug('Created %s object: %s', model_name, row)
+        return created
+    except (DatabaseError, ValueError):
+        pass
+    # find the offending rows
+    created = []
+    for obj, row in pending:
+        try:
+            with transaction.atomic(using=manager.db):
+                obj.save(force_insert=True)
+            created.append(obj)
+            ccall_log.debug('Created %s object: %s', model_name, row)
+        except (DatabaseError, ValueError):
+            obj.pk = None
+            ccall_log.error('Cannot create %s object: %s', model_name, row)
+    return created
+
+
+def count_merged(pending, repeats, created):
+    """
+    Number of repeated rows merged into the created objects.
+    pending maps natural keys to tuples starting with the unsaved object,
+    and repeats counts the rows merged into each natural key.
+    """
+    created = {id(obj) for obj in created}
+    return sum(repeats[key] for key, value in pending.items()
+               if id(value[0]) in created)
+
+
+def null_blanks(model, row):
+    """
+    Copy of an uploaded row with blank values of nullable fields, such as
+    an empty pledge amount, replaced by None.
+    """
+    opts = model._meta
+    return {attr: None if value == '' and opts.get_field(attr).null
+            else value for attr, value in row.items()}
+
+
+def diff_row(model_obj, row):
+    """
+    Apply an uploaded row to a saved object.
+    Values are normalised by their field before comparing, so that '2016'
+    matches 2016 and unchanged rows can be told apart from changed ones.
+    Fields set automatically on save are ignored. Returns a dict of the
+    changed fields to their uploaded values, empty if nothing changed.
+    """
+    opts = model_obj._meta
+    changes = {}
+    for attr, value in row.items():
+        field = opts.get_field(attr)
+        if getattr(field, 'auto_now', False) or \
+                getattr(field, 'auto_now_add', False):
+            continue
+        if field.is_relation:
+            current = getattr(model_obj, field.attname)
+            new = getattr(value, 'pk', value)
+        else:
+            current = getattr(model_obj, field.attname)
+            new = field.to_python(None if value == '' and field.null
+                                  else value)
+            value = new
+        if new != current:
+            changes[field.name] = value
+    for name, value in changes.items():
+        setattr(model_obj, name, value)
+    return changes
+
+
+def bulk_update_rows(manager, changes):
+    """
+    Write changed objects back in batched UPDATEs.
+    changes is a list of (object, changed field names) pairs. Objects are
+    grouped by their changed fields, so each UPDATE only writes modified
+    columns. If a batch is rejected, its objects are saved one by one so
+    that only the offending rows are reported. Returns the primary keys of
+    the objects that could not be saved.
+    """
+    model_name = manager.model.__name__
+    groups = OrderedDict()
+    for obj, fields in changes:
+        if fields:
+            groups.setdefault(tuple(sorted(fields)), []).append(obj)
+    failed = set()
+    for fields, objs in groups.items():
+        try:
+            with transaction.atomic(using=manager.db):
+                bulk_update(manager.all(), objs, fields)
+            continue
+        except (DatabaseError, ValueError):
+            pass
+        # find the offending rows
+        for obj in objs:
+            try:
+                with transaction.atomic(using=manager.db):
+                    obj.save(update_fields=fields)
+            except (DatabaseError, ValueError):
+                failed.add(obj.pk)
+                ccall_log.error(
+                    'Cannot update %s object: %s', model_name, obj)
+    return failed
+
+
+def apply_sqlite_pragmas(sqlite_connection):
+    """Run the PRAGMAs of settings.SQLITE_PRAGMAS on a SQLite connection."""
+    with sqlite_connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', ()):
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
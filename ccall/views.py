@@ -3,38 +3,36 @@
 
 from __future__ import unicode_literals
 
+import json
 import logging
+from datetime import timedelta
 
 from django.contrib.auth import views as auth_views
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.http import HttpResponseRedirect
-from django.shortcuts import render, resolve_url
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.http import HttpResponseRedirect, JsonResponse
+from django.shortcuts import get_object_or_404, render, resolve_url
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
-from .forms import UploadForm, UploadPoolForm
+from .forms import CallResultForm, UploadForm, UploadPoolForm
 from .models.call import Call
-from .models.fund import Fund
-from .models.pledge import Pledge
-from .models.pool import Pool
-from .models.prospect import Prospect
-from .models.user import PhonathonUser
+from .models.call_rollup import CallRollup
+from .models.reservation import (RESERVATION_BATCH_SIZE, RESERVATION_LEASE,
+                                 Reservation)
+from .models.upload_job import UploadJob
+from .search import prospect_index
+from .utils import UPLOAD_CHUNK_SIZE
 
 ccall_log = logging.getLogger('ccall')
 
-
-def upload_data(data, model_string):
-    """Parse the model choice to a Model class and process the data."""
-    lookup = {
-        UploadForm.MODEL_USER: PhonathonUser,
-        UploadForm.MODEL_FUND: Fund,
-        UploadForm.MODEL_PROSPECT: Prospect,
-        UploadForm.MODEL_PLEDGE: Pledge,
-        UploadForm.MODEL_CALL: Call,
-    }
-    try:
-        lookup[model_string].objects.from_upload(data)
-    except KeyError:
-        # Upload is not implemented for this model
-        ccall_log.error('Cannot upload %s data', model_string)
+# seconds between dashboard polls, also the granularity of their cursors
+DASHBOARD_POLL_SECONDS = 5
+# default and maximum number of Prospects suggested by the typeahead
+SEARCH_LIMIT = 10
+SEARCH_LIMIT_MAX = 20
 
 
 def test_user_manager_and_above(user):
@@ -42,19 +40,130 @@ def test_user_manager_and_above(user):
     return user.is_manager_and_above
 
 
+def test_user_supervisor_and_above(user):
+    """Test whether an User is supervisor and above."""
+    return user.is_supervisor_and_above
+
+
 @login_required(login_url='login')
 def home(request):
     """Default view for ccall."""
     return render(request, 'ccall/base.html')
 
 
+@login_required(login_url='login')
+def next_prospect(request):
+    """
+    Report the Prospect reserved for the caller, reserving the next one if
+    needed. POST releases the current Reservation first, when the caller
+    is done with it.
+    """
+    if request.method == 'POST':
+        Reservation.objects.release(request.user)
+    reservation = Reservation.objects.claim_next(request.user)
+    return JsonResponse({'reservation': reservation.to_dict()
+                         if reservation is not None else None})
+
+
+@login_required(login_url='login')
+def prospect_batch(request):
+    """
+    Reserve a batch of Prospects for the caller, with their Call history,
+    so that a calling session needs no round-trip between calls. The size
+    query parameter sets the batch size. POST first releases the
+    Reservations listed in release, when the caller is done with them.
+    """
+    if request.method == 'POST':
+        ids = [int(value) for value in request.POST.getlist('release')
+               if value.isdigit()]
+        Reservation.objects.release(request.user, ids)
+    try:
+        size = int(request.GET.get('size', RESERVATION_BATCH_SIZE))
+    except ValueError:
+        size = RESERVATION_BATCH_SIZE
+    reservations = Reservation.objects.claim_batch(
+        request.user, max(size, 0))
+    return JsonResponse({
+        'lease_seconds': int(RESERVATION_LEASE.total_seconds()),
+        'reservations': [reservation.to_dict(history=True)
+                         for reservation in reservations],
+    })
+
+
+@login_required(login_url='login')
+def search_prospects(request):
+    """
+    Suggest Prospects matching ?q by NRIC, name, email or phone number as
+    JSON, for typeahead. At most ?limit Prospects are suggested.
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = int(request.GET.get('limit', SEARCH_LIMIT))
+    except ValueError:
+        limit = SEARCH_LIMIT
+    limit = max(min(limit, SEARCH_LIMIT_MAX), 1)
+    prospects = prospect_index().search(query, limit) \
+        if len(query) >= 2 else []
+    return JsonResponse({'prospects': [{
+        'id': prospect.pk,
+        'nric': prospect.nric,
+        'name': prospect.name,
+        'email': prospect.email,
+        'phone_home': prospect.phone_home,
+        'phone_mobile': prospect.phone_mobile,
+    } for prospect in prospects]})
+
+
+@login_required(login_url='login')
+def submit_calls(request):
+    """
+    Record a batch of call results posted as JSON by the caller, as
+    {"calls": [...]}. The batch is validated as a whole and written in one
+    transaction, or not at all. The Reservations of the called Prospects
+    are released.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST required'}, status=405)
+    try:
+        results = json.loads(request.body.decode('utf-8'))['calls']
+        if not isinstance(results, list):
+            raise TypeError
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+    if len(results) > UPLOAD_CHUNK_SIZE:
+        return JsonResponse({'error': 'At most {} calls per request'.format(
+            UPLOAD_CHUNK_SIZE)}, status=400)
+    forms = [CallResultForm(obj if isinstance(obj, dict) else {})
+             for obj in results]
+    errors = {index: {field: list(messages)
+                      for field, messages in form.errors.items()}
+              for index, form in enumerate(forms) if not form.is_valid()}
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+    try:
+        with transaction.atomic():
+            created, errors = Call.objects.from_results(
+                request.user, [form.cleaned_data for form in forms])
+            Reservation.objects.filter(
+                caller=request.user,
+                prospect__in=[obj.prospect_id for obj in created]).delete()
+    except IntegrityError:
+        # the same attempts were recorded concurrently, nothing was written
+        return JsonResponse({'error': 'Conflicting calls, retry'}, status=409)
+    if errors:
+        return JsonResponse({'errors': errors}, status=400)
+    return JsonResponse({
+        'created': len(created),
+        'skipped': len(results) - len(created),
+        'calls': [{'client_ref': obj.client_ref, 'prospect': obj.prospect.nric,
+                   'attempt': obj.attempt} for obj in created],
+    })
+
+
 @login_required(login_url='login')
 @user_passes_test(test_user_manager_and_above)
 def upload(request):
     """Upload Caller/ Fund/ Prospect/ Pledge CSV data from admin interface."""
-    import csv
-    from io import StringIO
-
     # if GET, render the form
     if request.method == 'GET':
         return render(request, 'admin/upload.html',
@@ -65,15 +174,12 @@ def upload(request):
     try:
         form = UploadForm(request.POST, request.FILES)
         if form.is_valid():
-            # get data
-            csv_file = request.FILES['uploaded_file']
-            csv_file.seek(0)
-            data = csv.DictReader(StringIO(csv_file.read().decode('utf-8')))
-
-            # upload data
-            upload_data(data, form.cleaned_data['model'])
-
-            return HttpResponseRedirect('/admin/')
+            # queue the upload for the worker
+            job = UploadJob.objects.create(
+                model=form.cleaned_data['model'],
+                uploaded_file=request.FILES['uploaded_file'],
+                user=request.user)
+            return HttpResponseRedirect(reverse('upload_job', args=(job.pk,)))
         else:
             return render(request, 'admin/upload.html',
                           {'form': UploadForm,
@@ -87,9 +193,6 @@ def upload(request):
 @user_passes_test(test_user_manager_and_above)
 def upload_pool(request):
     """Upload Pool CSV data from admin interface."""
-    import csv
-    from io import StringIO
-
     # if GET, render the form
     if request.method == 'GET':
         return render(request, 'admin/upload_pool.html',
@@ -99,17 +202,15 @@ def upload_pool(request):
     try:
         form = UploadPoolForm(request.POST, request.FILES)
         if form.is_valid():
-            # get data
-            csv_file = request.FILES['uploaded_file']
-            csv_file.seek(0)
-            data = csv.DictReader(StringIO(csv_file.read().decode('utf-8')))
-
-            # upload data
-            name = form.cleaned_data['name']
-            project = form.cleaned_data['project']
-            Pool.objects.from_upload(project, name, data)
-
-            return HttpResponseRedirect('/admin/')
+            # queue the upload for the worker
+            job = UploadJob.objects.create(
+                model=UploadJob.MODEL_POOL,
+                uploaded_file=request.FILES['uploaded_file'],
+                project=form.cleaned_data['project'],
+                pool_name=form.cleaned_data['name'],
+                replace=form.cleaned_data['replace'],
+                user=request.user)
+            return HttpResponseRedirect(reverse('upload_job', args=(job.pk,)))
         else:
             return render(request, 'admin/upload_pool.html',
                           {'form': UploadPoolForm,
@@ -118,6 +219,73 @@ def upload_pool(request):
         ccall_log.exception(exc)
 
 
+@login_required(login_url='login')
+@user_passes_test(test_user_manager_and_above)
+def upload_job(request, job_id):
+    """Show the progress of a queued upload."""
+    job = get_object_or_404(UploadJob, pk=job_id)
+    return render(request, 'admin/upload_job.html',
+                  {'job': job, 'title': 'Upload status'})
+
+
+@login_required(login_url='login')
+@user_passes_test(test_user_manager_and_above)
+def upload_job_status(request, job_id):
+    """Report the progress of a queued upload, for polling."""
+    job = get_object_or_404(UploadJob, pk=job_id)
+    return JsonResponse(job.to_dict())
+
+
+@login_required(login_url='login')
+@user_passes_test(test_user_supervisor_and_above)
+def dashboard(request):
+    """Show the calls, completion and pledges of today, for supervisors."""
+    return render(request, 'admin/dashboard.html',
+                  {'title': 'Calling dashboard',
+                   'poll_seconds': DASHBOARD_POLL_SECONDS})
+
+
+@login_required(login_url='login')
+@user_passes_test(test_user_supervisor_and_above)
+def dashboard_data(request):
+    """
+    Report the CallRollups of today as JSON, for polling. With a cursor in
+    ?since, only the rollups changed since then are reported. Cursors are
+    rounded to the poll interval, so that supervisors polling together
+    share one cached response.
+    """
+    now = timezone.now()
+    cursor = now - timedelta(seconds=now.second % DASHBOARD_POLL_SECONDS,
+                             microseconds=now.microsecond)
+    today = timezone.localtime(now).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    try:
+        since = parse_datetime(request.GET.get('since', ''))
+    except ValueError:
+        since = None
+    if since is not None and timezone.is_naive(since):
+        since = timezone.make_aware(since)
+    if since is None:
+        rollups = CallRollup.objects.filter(hour__gte=today).select_related(
+            'project', 'pool', 'caller')
+        cache_key = None
+    else:
+        rollups = CallRollup.objects.changed_since(since).filter(
+            hour__gte=today)
+        cache_key = 'ccall:dashboard:{}'.format(since.isoformat())
+        data = cache.get(cache_key)
+        if data is not None:
+            return JsonResponse(data)
+    data = {
+        'cursor': cursor.isoformat(),
+        'day': today.date().isoformat(),
+        'rollups': [rollup.to_dict() for rollup in rollups],
+    }
+    if cache_key is not None:
+        cache.set(cache_key, data, DASHBOARD_POLL_SECONDS)
+    return JsonResponse(data)
+
+
 class LoginView(auth_views.LoginView):
     """Login view for ccall."""
     template_name = 'ccall/login.html'
@@ -12,7 +12,9 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 
 import logging.config
 import os
+import tempfile
 
+from django.core.exceptions import ImproperlyConfigured
 from django.utils.log import DEFAULT_LOGGING
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -48,7 +50,8 @@ MIDDLEWARE = [
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # request.user from the cache of authenticated users, see ccall/auth.py
+    'ccall.middleware.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -66,6 +69,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'ccall.context_processors.roles',
             ],
         },
     },
@@ -76,14 +80,117 @@ WSGI_APPLICATION = 'phonathon.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
+# The database profile is selected by the PHONATHON_DB environment variable,
+# 'sqlite' (the default) or 'postgresql', and configured by the
+# PHONATHON_DB_* variables.
 
-DATABASES = {
-    'default': {
+DATABASE_PROFILES = {
+    'sqlite': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        'NAME': os.environ.get(
+            'PHONATHON_DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+    },
+    # needs psycopg2
+    'postgresql': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('PHONATHON_DB_NAME', 'phonathon'),
+        'USER': os.environ.get('PHONATHON_DB_USER', ''),
+        'PASSWORD': os.environ.get('PHONATHON_DB_PASSWORD', ''),
+        'HOST': os.environ.get('PHONATHON_DB_HOST', ''),
+        'PORT': os.environ.get('PHONATHON_DB_PORT', ''),
+        # keep connections open across requests for this many seconds
+        'CONN_MAX_AGE': int(os.environ.get('PHONATHON_DB_CONN_MAX_AGE', 600)),
+    },
+}
+
+DATABASE_PROFILE = os.environ.get('PHONATHON_DB', 'sqlite')
+if DATABASE_PROFILE not in DATABASE_PROFILES:
+    raise ImproperlyConfigured('Unknown database profile {!r}, expected one '
+                               'of {}'.format(DATABASE_PROFILE,
+                                              ', '.join(DATABASE_PROFILES)))
+
+DATABASES = {
+    'default': DATABASE_PROFILES[DATABASE_PROFILE],
+}
+
+# PRAGMAs run on each new SQLite connection, in order
+SQLITE_PRAGMAS = (
+    # readers no longer block the writer, nor the writer readers
+    ('journal_mode', 'WAL'),
+    # in WAL mode, sync at checkpoints only: a crash of the process loses
+    # no committed write, a power loss may lose the last ones
+    ('synchronous', 'NORMAL'),
+    # wait up to 20s for the write lock instead of failing at once with
+    # "database is locked"
+    ('busy_timeout', 20000),
+    # 64 MiB page cache per connection, given in KiB when negative
+    ('cache_size', -65536),
+)
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+# The cache profile is selected by the PHONATHON_CACHE environment variable.
+# A local-memory cache ('locmem', the default) suits a single process, such
+# as the development server and the tests. Deployments running several
+# processes select a file-based cache ('file') in PHONATHON_CACHE_DIR,
+# outside of the checkout, shared by every process on the host, so that the
+# versions of the cached lookup tables and users, and the cached sessions,
+# are seen by all workers. Authenticated users are only cached in a shared
+# cache, see ccall/middleware.py. Past MAX_ENTRIES, each write to a file-based
+# cache culls it, scanning the whole directory.
+
+CACHE_PROFILES = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get(
+            'PHONATHON_CACHE_DIR',
+            os.path.join(tempfile.gettempdir(), 'phonathon-cache')),
+        # room for a session and a user per caller on shift
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+CACHE_PROFILE = os.environ.get('PHONATHON_CACHE', 'locmem')
+if CACHE_PROFILE not in CACHE_PROFILES:
+    raise ImproperlyConfigured('Unknown cache profile {!r}, expected one '
+                               'of {}'.format(CACHE_PROFILE,
+                                              ', '.join(CACHE_PROFILES)))
+
+CACHES = {
+    'default': CACHE_PROFILES[CACHE_PROFILE],
+}
+
+
+# Sessions
+# https://docs.djangoproject.com/en/1.11/topics/http/sessions/
+# The session engine is selected by the PHONATHON_SESSIONS environment
+# variable: 'cached_db' (the default) reads sessions from the cache and
+# writes them through to the database, 'signed_cookies' keeps them in the
+# browser, and 'db' reads every session from the database.
+
+SESSION_ENGINES = {
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+    'db': 'django.contrib.sessions.backends.db',
 }
 
+SESSION_PROFILE = os.environ.get('PHONATHON_SESSIONS', 'cached_db')
+if SESSION_PROFILE not in SESSION_ENGINES:
+    raise ImproperlyConfigured('Unknown session engine {!r}, expected one '
+                               'of {}'.format(SESSION_PROFILE,
+                                              ', '.join(SESSION_ENGINES)))
+
+SESSION_ENGINE = SESSION_ENGINES[SESSION_PROFILE]
+
+# seconds an authenticated user is served from the cache, without reading
+# the user and its groups from the database
+USER_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
@@ -111,6 +218,11 @@ USE_TZ = True
 STATIC_URL = '/static/'
 
 
+# Uploaded files, kept until processed by the upload worker
+
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+
 # Logging
 
 LOGGING_CONFIG = None
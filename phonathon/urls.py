@@ -24,8 +24,21 @@ urlpatterns = [
     url(r'^login/$', ccall_views.LoginView.as_view(), name='login'),
     url(r'^logout/$', ccall_views.LogoutView.as_view(), name='logout'),
     url(r'^ccall/$', ccall_views.home, name='ccall'),
+    url(r'^ccall/next/$', ccall_views.next_prospect, name='next_prospect'),
+    url(r'^ccall/batch/$', ccall_views.prospect_batch,
+        name='prospect_batch'),
+    url(r'^ccall/calls/$', ccall_views.submit_calls, name='submit_calls'),
+    url(r'^ccall/prospects/search/$', ccall_views.search_prospects,
+        name='search_prospects'),
     url(r'^admin/upload/$', ccall_views.upload, name='upload'),
     url(r'^admin/upload_pool/$', ccall_views.upload_pool, name='upload_pool'),
+    url(r'^admin/upload/(?P<job_id>\d+)/$', ccall_views.upload_job,
+        name='upload_job'),
+    url(r'^admin/upload/(?P<job_id>\d+)/status/$',
+        ccall_views.upload_job_status, name='upload_job_status'),
+    url(r'^admin/dashboard/$', ccall_views.dashboard, name='dashboard'),
+    url(r'^admin/dashboard/data/$', ccall_views.dashboard_data,
+        name='dashboard_data'),
     url(r'^admin/', admin.site.urls),
     url(r'^$', RedirectView.as_view(url='ccall')),
 ]